@@ -0,0 +1 @@
+# Marking as package
@@ -0,0 +1,108 @@
+# Benchmark and check of the GHCN by-year ingestion on a local fixture: synthetic .dly histories are split into an
+# old part, kept as .dly files, and by-year archives of the recent years holding many other stations. The archives
+# are downloaded from a local stand-in server, ingested into per-station partitions and merged with the old .dly
+# files; the result must match read_dly_file on the complete histories
+# usage: python -m benchmarks.by_year [n_other_stations] [n_registered]
+
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from benchmarks.fetch import serve_directory
+from benchmarks.read_dly import make_synthetic_dly
+from data.converter import read_dly_file
+from data.fetcher import Fetcher
+from data.ghcn_by_year import by_year_elements, ingest_by_year, merge_station_history, read_station_partitions
+from data.scraper import noaa_by_year_scraper
+
+# years of the synthetic histories and first year served as by-year archives
+end_year = 2024
+first_archive_year = 2023
+
+
+# function to convert a read_dly_file DataFrame to the long rows of the by-year archives
+def dly_frame_to_by_year_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param df: DataFrame returned by read_dly_file
+    :return: DataFrame with the 8 columns of the archives
+    """
+    long = df.melt(id_vars=["STATION_ID", "DATE"], value_vars=list(df.columns[5:]), var_name="ELEMENT",
+                   value_name="VALUE").dropna(subset=["VALUE"])
+    return pd.DataFrame({
+        "ID": long["STATION_ID"], "DATE": long["DATE"].dt.strftime("%Y%m%d"), "ELEMENT": long["ELEMENT"],
+        "VALUE": long["VALUE"].astype(int), "MFLAG": "", "QFLAG": "", "SFLAG": "W", "OBS_TIME": "0700",
+    })
+
+
+# function to write the fixture: old .dly histories of the registered stations and the by-year archives
+def make_fixture(dly_dir: str, remote_dir: str, n_other: int, n_registered: int) -> tuple:
+    """
+    :param dly_dir: directory of the .dly files (history before first_archive_year) and of the complete histories
+    :param remote_dir: directory served as the by-year archive
+    :param n_other: number of stations of the archives that are not registered
+    :param n_registered: number of registered stations
+    :return: dictionary {station code: GHCN ID} of the registered stations, number of rows of the archives
+    """
+    stations = {f"S{i:03d}": f"USW{i:08d}" for i in range(n_registered)}
+    rows = []
+    for i, (code, ghcn_id) in enumerate(stations.items()):
+        full_path = os.path.join(dly_dir, f"{code}.full.dly")
+        make_synthetic_dly(full_path, n_years=10, station_id=ghcn_id, end_year=end_year, seed=i)
+        with open(full_path) as f:
+            lines = f.readlines()
+        with open(os.path.join(dly_dir, f"{code}.dly"), "w") as f:
+            f.writelines(line for line in lines if int(line[11:15]) < first_archive_year)
+        df = read_dly_file(full_path)
+        rows.append(dly_frame_to_by_year_rows(df[df["YEAR"] >= first_archive_year]))
+    # other stations: copies of the first station's rows under other IDs
+    template = rows[0]
+    rows += [template.assign(ID=f"XXX{i:08d}") for i in range(n_other)]
+    rows = pd.concat(rows, ignore_index=True)
+    for year in range(first_archive_year, end_year + 1):
+        year_rows = rows[rows["DATE"].str.startswith(str(year))].sample(frac=1, random_state=year)
+        year_rows.to_csv(os.path.join(remote_dir, f"{year}.csv.gz"), header=False, index=False)
+    return stations, len(rows)
+
+
+if __name__ == "__main__":
+    n_other = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    n_registered = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    with tempfile.TemporaryDirectory() as dly_dir, tempfile.TemporaryDirectory() as remote_dir, \
+            tempfile.TemporaryDirectory() as local_dir:
+        stations, n_rows = make_fixture(dly_dir, remote_dir, n_other, n_registered)
+        archive_bytes = sum(os.path.getsize(os.path.join(remote_dir, f)) for f in os.listdir(remote_dir))
+        server = serve_directory(remote_dir)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        archive_dir, partitions_dir = os.path.join(local_dir, "by_year"), os.path.join(local_dir, "partitions")
+        state_dir = os.path.join(local_dir, "state")
+
+        # download with the scraper, pointed at the stand-in server
+        fetcher = Fetcher()
+        results = noaa_by_year_scraper(archive_dir, fetcher=fetcher, verbose=False,
+                                       years=list(range(first_archive_year, end_year + 1)), base_url=base_url)
+        fetcher.close()
+        server.shutdown()
+        assert all(result["status"] == "downloaded" for result in results), results
+
+        start_time = time.perf_counter()
+        ingested = ingest_by_year(stations, archive_dir, partitions_dir, state_dir, verbose=False)
+        elapsed = time.perf_counter() - start_time
+        print(f"{len(ingested)} archives, {archive_bytes / 1e6:.1f} MB, {n_rows} rows of {n_other + n_registered} "
+              f"stations: ingested in {elapsed:.2f} seconds ({n_rows / elapsed / 1e6:.2f} M rows per second)")
+        assert not ingest_by_year(stations, archive_dir, partitions_dir, state_dir, verbose=False)
+        print("second run: unchanged archives skipped")
+
+        # merged histories must match the complete .dly files on the ingested elements
+        start_time = time.perf_counter()
+        for code in stations:
+            merged = merge_station_history(read_dly_file(os.path.join(dly_dir, f"{code}.dly")),
+                                           read_station_partitions(code, partitions_dir))
+            expected = read_dly_file(os.path.join(dly_dir, f"{code}.full.dly"))
+            columns = list(expected.columns[:5]) + by_year_elements
+            pd.testing.assert_frame_equal(merged[columns], expected[columns], check_names=False)
+            assert np.isnan(merged.loc[merged["YEAR"] >= first_archive_year, "SNOW"]).all()
+        print(f"merged histories of {len(stations)} stations match read_dly_file "
+              f"({(time.perf_counter() - start_time) / len(stations) * 1e3:.1f} ms per station)")
@@ -0,0 +1,193 @@
+# Check of the feature schema (see data/feature_engineering.py) against the float64 feature set used before it:
+# resident memory of the data held by the model search (the station DataFrames of grid_search.py and the arrays of the
+# cross-validation), the peak memory of a reduced model search run in fresh processes, and the MSE of each model family
+# fitted on both versions
+# usage: python -m benchmarks.dtypes [n_stations] [n_years]
+
+import os
+import sys
+import resource
+import tempfile
+import subprocess
+from contextlib import contextmanager, nullcontext
+import numpy as np
+import pandas as pd
+
+from benchmarks.features import make_daily_climate
+from data import feature_engineering
+from data.feature_engineering import build_features
+from data.storage import read_table, table_files, table_path, write_table
+from models.model import MultiStationModel
+from models.utils import folder_to_data_dict
+
+# models compared, with small sizes so that the check runs in a few minutes
+compared_models = {
+    "ridge": {"alpha": 615},
+    "random_forest": {"n_estimators": 30, "min_samples_leaf": 5, "max_features": "sqrt"},
+    "gaussian_process": {"length_scale": 10, "sigma": 1, "kernel": "rbf", "approximation": "nystroem",
+                         "n_components": 200},
+}
+# largest relative change of the MSE accepted as unchanged accuracy
+mse_tolerance = 1e-3
+# share of missing daily values, low like in the GHCN data of the airports
+missing_rate = 0.001
+# reduced model search measured by peak_memory: the ridge alpha path over the folds of grid_search.py, a few folds
+# of a random forest, then the fit of the final model on every station
+search_folds = 14
+search_forest = ({"n_estimators": 30, "min_samples_leaf": 5, "max_features": "sqrt"}, 2)
+
+
+# context manager building and loading the feature set in float64, as before the schema
+@contextmanager
+def float64_features():
+    """
+    The schema is read from data.feature_engineering when it is applied, and by the modules that import
+    feature_float_dtype when they are imported: those must be imported inside the block
+    :return: context manager
+    """
+    saved = feature_engineering.feature_float_dtype, feature_engineering.calendar_dtypes
+    feature_engineering.feature_float_dtype, feature_engineering.calendar_dtypes = np.float64, {}
+    try:
+        yield
+    finally:
+        feature_engineering.feature_float_dtype, feature_engineering.calendar_dtypes = saved
+
+
+# function to write the processed tables of the stations, as float64 (before the schema) and with the schema
+def make_tables(legacy_dir: str, schema_dir: str, n_stations: int, n_years: int) -> None:
+    """
+    :param legacy_dir: directory of the tables of a float64 build, never rounded to float32
+    :param schema_dir: directory of the tables written by build_features
+    :param n_stations: number of stations
+    :param n_years: years of daily rows of each station
+    :return: None
+    """
+    for i in range(n_stations):
+        daily = make_daily_climate(n_years, missing_rate=missing_rate, seed=i)
+        write_table(build_features(daily), table_path(schema_dir, f"S{i:03d}"))
+        with float64_features():
+            write_table(build_features(daily), table_path(legacy_dir, f"S{i:03d}"))
+
+
+# function to load the data of the model search like grid_search.py and cross_validation.cv_data do
+def load_search_data(path: str, legacy: bool) -> tuple:
+    """
+    :param path: directory of the processed tables
+    :param legacy: load them as before the schema, float64 DataFrames and float64 arrays
+    :return: tuple (data dictionary, dictionary of the cross-validation arrays)
+    """
+    from models.evaluation.cross_validation import StationArrays
+    if legacy:
+        data = {}
+        for f in table_files(path):
+            df = read_table(f)
+            data[os.path.splitext(os.path.basename(f))[0]] = (df[df.columns[15:]], df[df.columns[:15]])
+        arrays = {station: (np.ascontiguousarray(X, dtype=float), np.ascontiguousarray(y, dtype=float))
+                  for station, (X, y) in data.items()}
+        return data, arrays
+    data = folder_to_data_dict(table_files(path))
+    return data, {station: StationArrays(X, y) for station, (X, y) in data.items()}
+
+
+# function to read the peak resident memory of the process
+def peak_rss() -> int:
+    """
+    :return: peak resident memory in bytes, since the last reset of /proc/self/clear_refs on Linux
+    """
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+# function to run a reduced model search like grid_search.py: cross-validation, then the fit of the final model
+def run_search(path: str) -> None:
+    """
+    :param path: directory of the processed tables
+    :return: None
+    """
+    from models.evaluation import cross_validation
+    from models.registry import model_spec
+    cross_validation.in_data_filepath = path
+    cross_validation.ridge_cv_slide(model_spec("ridge").hyperparameters["alpha"], cv_length=search_folds)
+    params, n_folds = search_forest
+    cross_validation.cv_slide("random_forest", params, cv_length=n_folds)
+    # the cross-validation data is still held when the final model is fitted, as in grid_search.main
+    MultiStationModel("ridge", alpha=615).fit(folder_to_data_dict(table_files(path)), verbose=False)
+
+
+# function to measure the memory of run_search in a fresh process
+def peak_memory(path: str, legacy: bool) -> int:
+    """
+    :param path: directory of the processed tables
+    :param legacy: run the search on float64 data, as before the schema
+    :return: growth of the peak resident memory of the process during the search, in bytes
+    """
+    output = subprocess.run([sys.executable, "-m", "benchmarks.dtypes", "--measure", path] + (["--legacy"] if legacy else []),
+                            capture_output=True, text=True, check=True).stdout
+    return int(output.split()[-1])
+
+
+# function to fit a model on all but the last 5 rows of each station and score it on them
+def holdout_mse(data: dict, model_name: str, kwargs: dict) -> float:
+    """
+    :param data: dictionary {station: (X, y)}
+    :param model_name: name of the submodel
+    :param kwargs: model parameters
+    :return: mean over the stations of the MSE
+    """
+    # the random forest draws its bootstrap samples from the global random state
+    np.random.seed(604)
+    model = MultiStationModel(model_name, **kwargs)
+    model.fit({station: (X.iloc[:-5], y.iloc[:-5]) for station, (X, y) in data.items()}, verbose=False)
+    return model.evaluate({station: (X.tail(5), y.tail(5)) for station, (X, y) in data.items()})
+
+
+if __name__ == "__main__":
+    if "--measure" in sys.argv[1:]:
+        # child process of peak_memory: everything is imported before the baseline (in float64 for the legacy run,
+        # so that the cross-validation arrays are float64), then the peak of the imports is reset (Linux) so that it
+        # does not hide the peak of the search
+        with float64_features() if "--legacy" in sys.argv[1:] else nullcontext():
+            import models.evaluation.cross_validation
+            import models.modules.random_forest
+            import models.modules.ridge_regression
+            try:
+                with open("/proc/self/clear_refs", "w") as f:
+                    f.write("5")
+            except OSError:
+                pass
+            before = peak_rss()
+            run_search(sys.argv[sys.argv.index("--measure") + 1])
+            print(peak_rss() - before)
+        sys.exit()
+
+    n_stations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_years = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    with tempfile.TemporaryDirectory() as legacy_dir, tempfile.TemporaryDirectory() as schema_dir:
+        make_tables(legacy_dir, schema_dir, n_stations, n_years)
+        legacy_data, legacy_arrays = load_search_data(legacy_dir, legacy=True)
+        data, arrays = load_search_data(schema_dir, legacy=False)
+        X, y = next(iter(data.values()))
+        print(f"{n_stations} stations x {len(X)} rows x {X.shape[1] + y.shape[1]} columns, dtypes "
+              f"{dict(pd.concat([y, X], axis=1).dtypes.value_counts().rename(lambda dtype: dtype.name))}")
+
+        # resident data: the DataFrames and the cross-validation arrays
+        legacy_bytes = sum(X.memory_usage(deep=True).sum() + y.memory_usage(deep=True).sum()
+                           for X, y in legacy_data.values()) + sum(X.nbytes + y.nbytes for X, y in legacy_arrays.values())
+        schema_bytes = sum(X.memory_usage(deep=True).sum() + y.memory_usage(deep=True).sum()
+                           for X, y in data.values()) + sum(a.X.nbytes + a.y.nbytes for a in arrays.values())
+        legacy_peak, schema_peak = peak_memory(legacy_dir, legacy=True), peak_memory(schema_dir, legacy=False)
+        print(f"data of the model search: float64 {legacy_bytes / 2 ** 20:.0f} MB, schema {schema_bytes / 2 ** 20:.0f} MB "
+              f"({schema_bytes / legacy_bytes:.2f}x)")
+        print(f"peak memory of a search:  float64 {legacy_peak / 2 ** 20:.0f} MB, schema {schema_peak / 2 ** 20:.0f} MB "
+              f"({schema_peak / legacy_peak:.2f}x)")
+
+        for model_name, kwargs in compared_models.items():
+            legacy_mse, schema_mse = holdout_mse(legacy_data, model_name, kwargs), holdout_mse(data, model_name, kwargs)
+            change = abs(schema_mse - legacy_mse) / legacy_mse
+            print(f"{model_name}: MSE float64 {legacy_mse:.6f}, schema {schema_mse:.6f} (relative change {change:.1e})")
+            assert change < mse_tolerance, (model_name, legacy_mse, schema_mse)
+        print("accuracy unchanged")
@@ -0,0 +1,84 @@
+# Benchmark of the vectorized feature builder against the original shift/concat implementation
+# usage: python -m benchmarks.features [n_stations] [n_years]
+
+import sys
+import numpy as np
+import pandas as pd
+
+from benchmarks.read_dly import best_time
+from data.feature_engineering import apply_feature_schema, build_features
+
+
+# function to create a daily climate DataFrame like the combined NOAA/weather.gov data
+def make_daily_climate(n_years: int = 12, end: str = "2024-11-20", missing_rate: float = 0.01, seed: int = 604) -> pd.DataFrame:
+    """
+    :param n_years: number of years of daily rows
+    :param end: last date
+    :param missing_rate: share of missing values in each variable
+    :param seed: random seed
+    :return: DataFrame with DATE, PRCP, TMIN, TAVG, TMAX
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(end=end, periods=365 * n_years, freq="D")
+    seasonal = 50 + 25 * np.sin(2 * np.pi * (dates.dayofyear.to_numpy() - 100) / 365)
+    df = pd.DataFrame({
+        "DATE": dates,
+        "PRCP": rng.gamma(0.5, 30, size=len(dates)).round(),
+        "TMIN": (seasonal - 10 + rng.normal(0, 5, size=len(dates))).round(1),
+        "TAVG": (seasonal + rng.normal(0, 5, size=len(dates))).round(1),
+        "TMAX": (seasonal + 10 + rng.normal(0, 5, size=len(dates))).round(1),
+    })
+    for var in ["PRCP", "TMIN", "TAVG", "TMAX"]:
+        df.loc[rng.random(len(df)) < missing_rate, var] = np.nan
+    return df
+
+
+# the original implementation from data/feature_engineering.py, from the combined data to the processed table
+def legacy_build_features(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param df: DataFrame with a DATE column and the climate variables
+    :return: feature-engineered DataFrame
+    """
+    climate_vars = ['PRCP', 'TMIN', 'TAVG', 'TMAX']
+    df = df.copy()
+    df['YEAR'] = df['DATE'].dt.year
+    df = df[df['YEAR'] >= 2013]
+    df['MONTH'] = df['DATE'].dt.month
+    df['DAY_OF_YEAR'] = df['DATE'].dt.dayofyear
+    df['WEEK_OF_YEAR'] = df['DATE'].dt.isocalendar().week
+    df['SEASON'] = (df['DATE'].dt.month % 12 + 3) // 3
+    for var in climate_vars:
+        backward_lagged_columns = {f'{var}_lag_{i}': df[var].shift(i) for i in range(1, 30 + 1)}
+        forward_lagged_columns = {f'{var}_lag_{i}': df[var].shift(i) for i in range(-1, -4 - 1, -1)}
+        backward_lagged_df = pd.DataFrame(backward_lagged_columns)
+        forward_lagged_df = pd.DataFrame(forward_lagged_columns)
+        df = pd.concat([df, backward_lagged_df, forward_lagged_df], axis=1)
+    for var in climate_vars:
+        df[f'{var}_mean_5d_window'] = df[var].shift(365).rolling(window=5).mean()
+    df = df.drop('DATE', axis=1).astype(float)
+    df = df.dropna()
+    df = df[[item for sublist in [
+        ['TMIN', 'TMAX', 'TAVG'],
+        *[[f'TMIN_lag_{i}', f'TAVG_lag_{i}', f'TMAX_lag_{i}'] for i in range(-1, -5, -1)],
+        *[[f'TMIN_lag_{i}', f'TAVG_lag_{i}', f'TMAX_lag_{i}', f'PRCP_lag_{i}'] for i in range(1, 31)],
+        [f'{var}_mean_5d_window' for var in climate_vars],
+        ['YEAR', 'MONTH', 'DAY_OF_YEAR', 'WEEK_OF_YEAR', 'SEASON'],
+    ] for item in sublist]]
+    return df
+
+
+if __name__ == "__main__":
+    n_stations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_years = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    stations = [make_daily_climate(n_years, seed=i) for i in range(n_stations)]
+    print(f"{n_stations} stations x {len(stations[0])} days")
+
+    # both implementations must produce the same table, in the dtypes of the feature schema
+    for df in stations:
+        pd.testing.assert_frame_equal(build_features(df), apply_feature_schema(legacy_build_features(df)), rtol=1e-6)
+
+    legacy_time = best_time(lambda: [legacy_build_features(df) for df in stations])
+    print(f"original:             {legacy_time:.3f} seconds")
+    for dtype in [np.float64, np.float32]:
+        vectorized_time = best_time(lambda: [build_features(df, dtype=dtype) for df in stations])
+        print(f"build_features {np.dtype(dtype).name}: {vectorized_time:.3f} seconds ({legacy_time / vectorized_time:.1f}x)")
@@ -0,0 +1,86 @@
+# Benchmark of the concurrent fetcher against a local stand-in for the NOAA server
+# usage: python -m benchmarks.fetch [n_stations] [latency_seconds]
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.read_dly import make_synthetic_dly
+from data.fetcher import Fetcher
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """
+    Static file handler that answers conditional GETs with ETags and simulates network latency
+    """
+    latency = 0.0
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send_head(self):
+        time.sleep(self.latency)
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return None
+            self._etag = etag
+        return super().send_head()
+
+    def end_headers(self) -> None:
+        if getattr(self, "_etag", None):
+            self.send_header("ETag", self._etag)
+            self._etag = None
+        super().end_headers()
+
+
+# function to start a stand-in server for a directory in a background thread
+def serve_directory(directory: str, latency: float = 0.0) -> ThreadingHTTPServer:
+    """
+    :param directory: directory served at the root URL
+    :param latency: artificial delay in seconds added to every request
+    :return: running server (call shutdown() to stop it)
+    """
+    handler = type("Handler", (StandInHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    n_stations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.2
+    with tempfile.TemporaryDirectory() as remote_dir, tempfile.TemporaryDirectory() as local_dir:
+        for i in range(n_stations):
+            make_synthetic_dly(os.path.join(remote_dir, f"S{i:03d}.dly"), n_years=30, seed=i)
+        server = serve_directory(remote_dir, latency=latency)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        jobs = {os.path.join(local_dir, f"S{i:03d}.dly"): f"{base_url}/S{i:03d}.dly" for i in range(n_stations)}
+
+        for max_workers in [1, 8]:
+            # first run downloads everything, second run only revalidates
+            for label in ["cold", "warm"]:
+                fetcher = Fetcher(max_workers=max_workers)
+                start_time = time.perf_counter()
+                results = fetcher.fetch_all(jobs, verbose=False)
+                elapsed = time.perf_counter() - start_time
+                fetcher.close()
+                statuses = {r["status"] for r in results}
+                n_bytes = sum(r["bytes"] for r in results)
+                print(f"workers={max_workers} {label}: {elapsed:.2f} seconds, {n_bytes / 1e6:.1f} MB, {statuses}")
+            # touch one remote file: only that file should be transferred again
+            os.utime(os.path.join(remote_dir, "S000.dly"))
+            results = Fetcher(max_workers=max_workers).fetch_all(jobs, verbose=False)
+            print(f"workers={max_workers} one changed: {sum(r['status'] == 'downloaded' for r in results)} downloaded")
+            for file_path in jobs:
+                os.remove(file_path)
+        server.shutdown()
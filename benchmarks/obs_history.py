@@ -0,0 +1,89 @@
+# Benchmark of the lxml obs-history parser against the pd.read_html reference implementation, on the pages saved in
+# predictions/new_data (by make predictions) or, if there are none, on a synthetic page with the layout of
+# https://forecast.weather.gov/data/obhistory
+# usage: python -m benchmarks.obs_history [page.html ...]
+
+import os
+import sys
+import glob
+import tempfile
+import numpy as np
+import pandas as pd
+
+from benchmarks.read_dly import best_time
+from data.converter import html_to_csv_read_html, read_obs_history
+
+saved_pages = os.path.join(os.path.dirname(__file__), "../predictions/new_data/*.html")
+
+
+# function to write a synthetic observation page: three header rows, the data rows, and the header again in tfoot
+def make_synthetic_page(file_path: str, n_days: int = 3, seed: int = 604) -> None:
+    """
+    :param file_path: path of the .html file to write, UTF-8 encoded without a charset declaration like the real pages
+    :param n_days: number of days of hourly observations
+    :param seed: random seed
+    :return: None
+    """
+    rng = np.random.default_rng(seed)
+    header = (
+        '<tr><th rowspan="3">Date</th><th rowspan="3">Time<br>(akst)</th><th rowspan="3">Wind<br>(mph)</th>'
+        '<th rowspan="3">Vis.<br>(mi.)</th><th rowspan="3">Weather</th><th rowspan="3">Sky Cond.</th>'
+        '<th colspan="4">Temperature (ºF)</th><th rowspan="3">Relative<br>Humidity</th>'
+        '<th rowspan="3">Wind<br>Chill<br>(°F)</th><th rowspan="3">Heat<br>Index<br>(°F)</th>'
+        '<th colspan="2">Pressure</th><th colspan="3">Precipitation (in)</th></tr>'
+        '<tr><th rowspan="2">Air</th><th rowspan="2">Dwpt</th><th colspan="2">6 hour</th>'
+        '<th rowspan="2">altimeter<br>(in)</th><th rowspan="2">sea level<br>(mb)</th><th rowspan="2">1 hr</th>'
+        '<th rowspan="2">3 hr</th><th rowspan="2">6 hr</th></tr>'
+        '<tr><th>Max.</th><th>Min.</th></tr>'
+    )
+    rows = []
+    for day in range(17, 17 - n_days, -1):
+        for hour in range(23, -1, -1):
+            temperature = rng.integers(-10, 90)
+            precipitation = f"{rng.integers(1, 30) / 100:.2f}" if rng.random() < 0.2 else ""
+            cells = [day, f"{hour:02d}:53", "N 8", "10.00", "Light Snow", "OVC019", temperature, temperature - 7,
+                     "", "", "75%", "NA", "NA", "29.71", "1006.7", precipitation, "", ""]
+            rows.append('<tr align="center">' + "".join(f"<td>{cell}</td>" for cell in cells) + "</tr>")
+    # navigation before the table and a footer after it, as on the real pages
+    links = "".join(f'<li><a href="https://www.weather.gov/page{i}">Page {i}</a></li>' for i in range(150))
+    page = (
+        '<html><head><title>National Weather Service</title><script>var menu = [];</script></head><body>'
+        f'<div class="header"><ul class="nav">{links}</ul></div>'
+        f'<table cellspacing="3" cellpadding="2" border="0" width="670" class="obs-history"><thead>{header}</thead>'
+        f'<tbody>{"".join(rows)}</tbody><tfoot>{header}</tfoot></table>'
+        f'<div class="footer"><table><tr><td><ul>{links}</ul></td></tr></table></div></body></html>'
+    )
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(page)
+
+
+# function to check that the parsers agree on the kept columns
+def check_same_values(file_path: str) -> None:
+    """
+    :param file_path: path to the .html file
+    :return: None
+    """
+    fast = read_obs_history(file_path)
+    reference = html_to_csv_read_html(file_path)
+    temperature = next(c for c in reference.columns if c.startswith("Temperature") and c.endswith("Air"))
+    precipitation = next(c for c in reference.columns if c.startswith("Precipitation") and c.endswith("1 hr"))
+    assert len(fast) == len(reference), (len(fast), len(reference))
+    np.testing.assert_array_equal(fast["Date"], reference["Date"].astype(int))
+    np.testing.assert_array_equal(fast["Temperature (F) Air"], pd.to_numeric(reference[temperature], errors="coerce"))
+    np.testing.assert_array_equal(fast["Precipitation (in) 1 hr"],
+                                  pd.to_numeric(reference[precipitation], errors="coerce"))
+
+
+if __name__ == "__main__":
+    pages = sys.argv[1:] or sorted(glob.glob(saved_pages))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not pages:
+            pages = [os.path.join(tmp_dir, "SYNTHETIC.html")]
+            make_synthetic_page(pages[0])
+            print("no saved pages in predictions/new_data, using a synthetic page")
+        for page in pages:
+            check_same_values(page)
+            reference_time = best_time(html_to_csv_read_html, page, repeat=20)
+            fast_time = best_time(read_obs_history, page, repeat=200)
+            print(f"{os.path.basename(page)}: pd.read_html {reference_time * 1e3:.1f} ms, "
+                  f"read_obs_history {fast_time * 1e3:.2f} ms ({reference_time / fast_time:.0f}x), same values")
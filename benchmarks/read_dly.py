@@ -0,0 +1,85 @@
+# Benchmark of the vectorized .dly parser against the pd.read_fwf reference implementation
+# usage: python -m benchmarks.read_dly [n_years]
+
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from data.converter import read_dly_file, read_dly_file_fwf
+
+# elements written to the synthetic file (the ones used by the pipeline plus two extras)
+synthetic_elements = ["PRCP", "SNOW", "SNWD", "TAVG", "TMAX", "TMIN"]
+
+
+# function to write a synthetic GHCN .dly file
+def make_synthetic_dly(file_path: str, n_years: int = 100, station_id: str = "USW00099999",
+                       end_year: int = 2024, missing_rate: float = 0.05, seed: int = 604) -> None:
+    """
+    :param file_path: path of the .dly file to write
+    :param n_years: number of years of history
+    :param station_id: 11 character station identifier
+    :param end_year: last year in the file
+    :param missing_rate: share of valid calendar days set to the -9999 sentinel
+    :param seed: random seed
+    :return: None
+    """
+    rng = np.random.default_rng(seed)
+    lines = []
+    for year in range(end_year - n_years + 1, end_year + 1):
+        for month in range(1, 13):
+            n_days = pd.Period(year=year, month=month, freq="M").days_in_month
+            for element in synthetic_elements:
+                values = rng.integers(-300, 400, size=31)
+                values[rng.random(31) < missing_rate] = -9999
+                values[n_days:] = -9999
+                days = "".join(
+                    f"{v:5d}   " if v == -9999 else f"{v:5d} {rng.choice([' ', 'T'])}{rng.choice(['W', '0', '7'])}"
+                    for v in values
+                )
+                lines.append(f"{station_id}{year:4d}{month:02d}{element}{days}")
+    with open(file_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# function to time a callable over a number of repetitions and return the best time
+def best_time(func, *args, repeat: int = 3) -> float:
+    """
+    :param func: function to time
+    :param args: arguments passed to the function
+    :param repeat: number of repetitions
+    :return: best wall-clock time in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start_time)
+    return min(times)
+
+
+if __name__ == "__main__":
+    n_years = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, "SYNTHETIC.dly")
+        make_synthetic_dly(file_path, n_years=n_years)
+        print(f"Synthetic file: {n_years} years, {os.path.getsize(file_path) / 1e6:.1f} MB")
+
+        # check that both readers agree before timing them
+        fast = read_dly_file(file_path)
+        reference = read_dly_file_fwf(file_path)
+        elements = [c for c in reference.columns if c not in ["STATION_ID", "YEAR", "MONTH", "DAY", "DATE"]]
+        pd.testing.assert_frame_equal(
+            fast.reset_index(drop=True),
+            reference.astype({e: float for e in elements}).reset_index(drop=True),
+            check_dtype=False,
+            check_names=False,
+        )
+
+        fwf_time = best_time(read_dly_file_fwf, file_path, repeat=1)
+        numpy_time = best_time(read_dly_file, file_path)
+        print(f"read_dly_file_fwf: {fwf_time:.3f} seconds")
+        print(f"read_dly_file:     {numpy_time:.3f} seconds")
+        print(f"speed-up:          {fwf_time / numpy_time:.1f}x")
@@ -0,0 +1,105 @@
+# Benchmark of the cold start of the entry points, as in the daily job that runs in a fresh container: each case runs
+# in a new interpreter and is timed from the parent (best of the repetitions). The prediction cases load a saved
+# artifact of each model family and predict one batch; the sklearn packages each case imported are listed, only the
+# family of the artifact should appear.
+# usage: python -m benchmarks.startup [n_repeat]
+
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+from benchmarks.dtypes import missing_rate
+from benchmarks.features import make_daily_climate
+from data.feature_engineering import build_features
+from data.storage import table_files, table_path, write_table
+from models.model import MultiStationModel
+from models.utils import folder_to_data_dict
+
+# small models of each family, saved as artifacts by make_artifacts
+artifact_models = {
+    "ridge": {"alpha": 615},
+    "random_forest": {"n_estimators": 10, "min_samples_leaf": 5, "max_features": "sqrt"},
+    "gaussian_process": {"length_scale": 10, "sigma": 1, "kernel": "rbf", "approximation": "nystroem",
+                         "n_components": 50},
+}
+# printed by every case: the sklearn packages it imported
+report_code = ("import sys, json; print(json.dumps(sorted({m.split('.')[1] for m in sys.modules "
+               "if m.startswith('sklearn.') and not m.split('.')[1].startswith('_')})))")
+
+
+# function to save an artifact of each model family fitted on synthetic stations
+def make_artifacts(path: str, n_stations: int = 3, n_years: int = 3) -> dict:
+    """
+    :param path: directory of the tables and artifacts
+    :param n_stations: number of stations
+    :param n_years: years of daily rows of each station
+    :return: dictionary {model name: artifact path}
+    """
+    processed_dir = os.path.join(path, "processed")
+    os.makedirs(processed_dir)
+    for i in range(n_stations):
+        features = build_features(make_daily_climate(n_years, missing_rate=missing_rate, seed=i))
+        write_table(features, table_path(processed_dir, f"S{i:03d}"))
+    data = folder_to_data_dict(table_files(processed_dir))
+    artifacts = {}
+    for model_name, kwargs in artifact_models.items():
+        model = MultiStationModel(model_name, **kwargs)
+        model.fit(data, verbose=False)
+        artifacts[model_name] = os.path.join(path, model_name)
+        model.save(artifacts[model_name])
+    return artifacts
+
+
+# function to write the code of the cases
+def make_cases(artifacts: dict) -> dict:
+    """
+    :param artifacts: dictionary {model name: artifact path} of make_artifacts
+    :return: dictionary {case name: Python code run by a new interpreter}
+    """
+    cases = {
+        "python": "pass",
+        "import predictions.predictions": "import predictions.predictions",
+        "import predictions.download_new": "import predictions.download_new",
+        "import models.train": "import models.train",
+        # what importing models.model cost when it imported every family
+        "import every model family": "import models.modules.ridge_regression, models.modules.random_forest, "
+                                     "models.modules.gaussian_process",
+    }
+    for model_name, path in artifacts.items():
+        cases[f"predict {model_name}"] = (
+            "import numpy as np\n"
+            "from predictions.predictions import MultiStationModel\n"
+            f"model = MultiStationModel.load({path!r})\n"
+            "stations = list(model.models)\n"
+            "model.predict_batch(np.zeros((len(stations), 1, len(model.feature_names))), stations)"
+        )
+    return cases
+
+
+# function to time a case in new interpreters
+def time_case(code: str, n_repeat: int) -> tuple:
+    """
+    :param code: Python code of the case
+    :param n_repeat: number of runs
+    :return: tuple (best wall time in seconds, list of the sklearn packages imported)
+    """
+    times = []
+    for _ in range(n_repeat):
+        start_time = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code + "\n" + report_code], capture_output=True, text=True,
+                                check=True, cwd=os.path.join(os.path.dirname(__file__), "..")).stdout
+        times.append(time.perf_counter() - start_time)
+    return min(times), json.loads(output.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    n_repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = make_cases(make_artifacts(tmp_dir))
+        print(f"{'case':<36}{'ms':>8}  sklearn packages")
+        for name, code in cases.items():
+            seconds, packages = time_case(code, n_repeat)
+            print(f"{name:<36}{seconds * 1e3:>8.0f}  {', '.join(packages) or '-'}")
@@ -0,0 +1,76 @@
+# Benchmark of the station registry on a synthetic GHCN catalogue: registry build, k-d tree nearest-station
+# lookups against a brute-force haversine search, and sharding
+# usage: python -m benchmarks.stations [n_catalogue] [n_registered]
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from data.stations import StationRegistry, earth_radius, forecast_stations
+
+
+# function to create a station catalogue with the columns of read_metadata
+def make_station_metadata(n_stations: int = 120000, seed: int = 604) -> pd.DataFrame:
+    """
+    :param n_stations: number of stations besides the forecast airports
+    :param seed: random seed
+    :return: DataFrame with ID, LATITUDE, LONGITUDE, ELEVATION, STATE, NAME
+    """
+    rng = np.random.default_rng(seed)
+    ids = [ghcn_id for _, _, ghcn_id in forecast_stations] + [f"XX{i:09d}" for i in range(n_stations)]
+    # uniform on the sphere
+    latitude = np.degrees(np.arcsin(rng.uniform(-1, 1, len(ids))))
+    longitude = rng.uniform(-180, 180, len(ids))
+    elevation = np.where(rng.random(len(ids)) < 0.01, -999.9, rng.uniform(0, 3000, len(ids))).round(1)
+    return pd.DataFrame({
+        "ID": ids, "LATITUDE": latitude.round(4), "LONGITUDE": longitude.round(4), "ELEVATION": elevation,
+        "STATE": "", "NAME": [f"STATION {i}" for i in range(len(ids))],
+    })
+
+
+# function to find the k closest stations by computing every great-circle distance
+def brute_force_nearest(stations: pd.DataFrame, latitude: float, longitude: float, k: int) -> list:
+    """
+    :param stations: registry table with LATITUDE and LONGITUDE
+    :param latitude: latitude in degrees
+    :param longitude: longitude in degrees
+    :param k: number of stations
+    :return: list of station codes, closest first
+    """
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(stations["LATITUDE"].to_numpy()), np.radians(stations["LONGITUDE"].to_numpy())
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    distances = 2 * earth_radius * np.arcsin(np.sqrt(a))
+    return list(stations.index[np.argsort(distances)[:k]])
+
+
+if __name__ == "__main__":
+    n_catalogue = int(sys.argv[1]) if len(sys.argv) > 1 else 120000
+    n_registered = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    metadata = make_station_metadata(n_catalogue)
+    extra_ids = list(metadata["ID"].iloc[len(forecast_stations):len(forecast_stations) + n_registered])
+
+    start_time = time.perf_counter()
+    registry = StationRegistry.build(metadata, extra_ids)
+    print(f"registry of {len(registry)} stations from a catalogue of {len(metadata)}: "
+          f"{time.perf_counter() - start_time:.3f} seconds")
+
+    # nearest neighbors of every registered station
+    start_time = time.perf_counter()
+    neighbors = {code: registry.neighbors(code, k=5) for code in registry}
+    elapsed = time.perf_counter() - start_time
+    print(f"5 nearest neighbors of {len(registry)} stations: {elapsed:.3f} seconds "
+          f"({elapsed / len(registry) * 1e6:.0f} us per lookup)")
+
+    # the k-d tree over unit vectors must return the same stations as the haversine search
+    start_time = time.perf_counter()
+    for code in registry.codes()[:200]:
+        row = registry.stations.loc[code]
+        expected = brute_force_nearest(registry.stations.drop(index=code), row["LATITUDE"], row["LONGITUDE"], 5)
+        assert [other for other, _ in neighbors[code]] == expected, code
+    elapsed = time.perf_counter() - start_time
+    print(f"brute force: {elapsed / 200 * 1e6:.0f} us per lookup, same neighbors for 200 stations")
+
+    shards = registry.shards(size=100)
+    print(f"{len(shards)} shards of at most 100 stations")
@@ -0,0 +1,71 @@
+# Benchmark of the storage formats for the processed feature tables: disk footprint and load time
+# usage: python -m benchmarks.storage [n_stations] [n_years]
+
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+
+from benchmarks.read_dly import best_time
+from data.storage import storage_extensions, table_files, table_path, write_table
+from models.utils import folder_to_data_dict
+
+
+# function to list the columns of a processed feature table, in the order written by feature_engineering.py
+def processed_columns() -> list:
+    """
+    :return: list of the 15 target columns followed by the feature columns
+    """
+    climate_vars = ['PRCP', 'TMIN', 'TAVG', 'TMAX']
+    return (
+        ['TMIN', 'TMAX', 'TAVG']
+        + [f'{var}_lag_{i}' for i in range(-1, -5, -1) for var in ['TMIN', 'TAVG', 'TMAX']]
+        + [f'{var}_lag_{i}' for i in range(1, 31) for var in ['TMIN', 'TAVG', 'TMAX', 'PRCP']]
+        + [f'{var}_mean_5d_window' for var in climate_vars]
+        + ['YEAR', 'MONTH', 'DAY_OF_YEAR', 'WEEK_OF_YEAR', 'SEASON']
+    )
+
+
+# function to create a random processed feature table with realistic shape and value ranges
+def make_processed_table(n_years: int = 12, seed: int = 604) -> pd.DataFrame:
+    """
+    :param n_years: number of years of daily rows
+    :param seed: random seed
+    :return: DataFrame with the columns of processed_columns()
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range("2013-01-01", periods=365 * n_years, freq="D")
+    columns = processed_columns()
+    # temperatures in Fahrenheit with one decimal from the tenths of Celsius, precipitation in tenths of mm
+    values = (rng.integers(-300, 400, size=(len(dates), len(columns))) / 10 * (9 / 5) + 32)
+    df = pd.DataFrame(values, columns=columns)
+    for column in [c for c in columns if c.startswith('PRCP')]:
+        df[column] = rng.gamma(0.5, 30, size=len(dates)).round()
+    df['YEAR'] = dates.year.astype(float)
+    df['MONTH'] = dates.month.astype(float)
+    df['DAY_OF_YEAR'] = dates.dayofyear.astype(float)
+    df['WEEK_OF_YEAR'] = dates.isocalendar().week.to_numpy().astype(float)
+    df['SEASON'] = ((dates.month % 12 + 3) // 3).astype(float)
+    return df
+
+
+if __name__ == "__main__":
+    n_stations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    n_years = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    # a model that only uses the 1-day lags and the calendar
+    projected_features = ['TMIN_lag_1', 'TAVG_lag_1', 'TMAX_lag_1', 'PRCP_lag_1', 'DAY_OF_YEAR', 'SEASON']
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tables = [make_processed_table(n_years, seed=i) for i in range(n_stations)]
+        print(f"{n_stations} stations x {len(tables[0])} rows x {tables[0].shape[1]} columns")
+        print(f"{'format':<10}{'size (MB)':>12}{'load all (s)':>15}{'load 6 features (s)':>22}")
+        for fmt in storage_extensions:
+            directory = os.path.join(tmp_dir, fmt)
+            os.makedirs(directory)
+            for i, table in enumerate(tables):
+                write_table(table, table_path(directory, f"S{i:03d}", fmt))
+            files = table_files(directory, fmt)
+            size = sum(os.path.getsize(f) for f in files) / 1e6
+            load_all = best_time(folder_to_data_dict, files)
+            load_projected = best_time(folder_to_data_dict, files, projected_features)
+            print(f"{fmt:<10}{size:>12.1f}{load_all:>15.3f}{load_projected:>22.3f}")
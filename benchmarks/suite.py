@@ -0,0 +1,221 @@
+# Benchmark suite of the pipeline stages on a synthetic multi-station dataset, for comparing runs offline.
+# The fixture is generated from fixed seeds at a configurable scale (stations x years of history):
+#   noaa/{code}.dly             GHCN .dly histories (benchmarks/read_dly.py)
+#   weather_gov/{code}.html     obs-history pages (benchmarks/obs_history.py)
+#   noaa/{code}.{ext}           converted NOAA tables, weather_gov/{code}.csv converted pages
+#   processed/{code}.{ext}      feature tables written by the feature engineering
+# Each stage is timed on the whole fixture (best and mean of the repetitions) and the results are written as JSON to
+# benchmarks/results/latest.json, then compared with benchmarks/results/baseline.json if it was recorded at the same
+# scale.
+# usage: python -m benchmarks.suite [n_stations] [n_years] [--save-baseline] [--check]
+#   --save-baseline  also store the results as the baseline
+#   --check          exit with an error if a stage is more than regression_tolerance slower than the baseline
+
+import io
+import os
+import sys
+import json
+import time
+import platform
+import tempfile
+import subprocess
+import contextlib
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import sklearn
+
+from benchmarks.obs_history import make_synthetic_page
+from benchmarks.read_dly import make_synthetic_dly
+from data.converter import html_to_csv, read_dly_file
+from data.feature_engineering import feature_engineering_noaa_climate_data
+from data.storage import table_files, table_path, write_table
+from models.evaluation import cross_validation
+from models.model import MultiStationModel
+from models.utils import folder_to_data_dict
+
+results_path = os.path.join(os.path.dirname(__file__), "results")
+latest_path = os.path.join(results_path, "latest.json")
+baseline_path = os.path.join(results_path, "baseline.json")
+# slowdown relative to the baseline reported as a regression
+regression_tolerance = 0.25
+# last year of the synthetic histories, fixed so the fixture does not depend on the date of the run
+end_year = 2024
+# share of missing values of the histories, low enough that most days have every lag of the features
+missing_rate = 0.001
+# repetitions of each stage and number of folds of the cross-validation
+n_repeat = 3
+cv_length = 5
+
+
+# function to write the fixture
+def make_fixture(path: str, n_stations: int, n_years: int) -> list:
+    """
+    :param path: directory of the fixture
+    :param n_stations: number of stations
+    :param n_years: years of history of each station
+    :return: list of the station codes
+    """
+    codes = [f"S{i:03d}" for i in range(n_stations)]
+    for directory in ["noaa", "weather_gov", "processed"]:
+        os.makedirs(os.path.join(path, directory), exist_ok=True)
+    for i, code in enumerate(codes):
+        dly_path = os.path.join(path, "noaa", f"{code}.dly")
+        make_synthetic_dly(dly_path, n_years=n_years, station_id=f"USW{i:08d}", end_year=end_year,
+                           missing_rate=missing_rate, seed=i)
+        write_table(read_dly_file(dly_path), table_path(os.path.join(path, "noaa"), code))
+        page_path = os.path.join(path, "weather_gov", f"{code}.html")
+        make_synthetic_page(page_path, seed=i)
+        html_to_csv(page_path).to_csv(os.path.join(path, "weather_gov", f"{code}.csv"), index=False)
+        features = feature_engineering_noaa_climate_data(table_path(os.path.join(path, "noaa"), code))
+        write_table(features, table_path(os.path.join(path, "processed"), code))
+    return codes
+
+
+# function to time a stage
+def time_stage(func, repeat: int = n_repeat) -> dict:
+    """
+    :param func: function without arguments running the stage once, its prints are discarded
+    :param repeat: number of repetitions
+    :return: dictionary {best_seconds, mean_seconds, repeat}
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start_time)
+    return {"best_seconds": min(times), "mean_seconds": float(np.mean(times)), "repeat": repeat}
+
+
+# function to run every benchmark on a fixture
+def run_suite(path: str, codes: list) -> dict:
+    """
+    :param path: directory of the fixture
+    :param codes: station codes of the fixture
+    :return: dictionary {benchmark name: timing of time_stage}
+    """
+    dly_files = [os.path.join(path, "noaa", f"{code}.dly") for code in codes]
+    pages = [os.path.join(path, "weather_gov", f"{code}.html") for code in codes]
+    noaa_tables = [table_path(os.path.join(path, "noaa"), code) for code in codes]
+    processed = table_files(os.path.join(path, "processed"))
+    data = folder_to_data_dict(processed)
+    X = {station: X_s for station, (X_s, y_s) in data.items()}
+    fitted = {}
+
+    def fit(model_name: str, **kwargs) -> None:
+        fitted[model_name] = MultiStationModel(model_name, **kwargs)
+        fitted[model_name].fit(data, verbose=False)
+
+    def cv_slide() -> None:
+        # the cross-validation data is cached per process: read it again on each repetition
+        cross_validation.cv_data.cache_clear()
+        cross_validation.cv_slide("ridge", {"alpha": 615}, cv_length)
+
+    cross_validation.in_data_filepath = os.path.join(path, "processed")
+    benchmarks = {
+        "read_dly_file": lambda: [read_dly_file(f) for f in dly_files],
+        "html_to_csv": lambda: [html_to_csv(f) for f in pages],
+        "feature_engineering_noaa_climate_data": lambda: [feature_engineering_noaa_climate_data(f)
+                                                          for f in noaa_tables],
+        "folder_to_data_dict": lambda: folder_to_data_dict(processed),
+        "fit_ridge": lambda: fit("ridge", alpha=615),
+        "predict_ridge": lambda: fitted["ridge"].predict(X),
+        "fit_random_forest": lambda: fit("random_forest", n_estimators=20, min_samples_leaf=5, max_features="sqrt"),
+        "predict_random_forest": lambda: fitted["random_forest"].predict(X),
+        "cv_slide_ridge": cv_slide,
+    }
+    results = {}
+    for name, func in benchmarks.items():
+        results[name] = time_stage(func)
+        print(f"{name:<40}{results[name]['best_seconds'] * 1e3:>10.1f} ms")
+    return results
+
+
+# function to describe the run, results are only comparable on the same machine and scale
+def run_info(n_stations: int, n_years: int) -> dict:
+    """
+    :param n_stations: number of stations of the fixture
+    :param n_years: years of history of each station
+    :return: dictionary {scale, environment, commit, created_at}
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(__file__), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "scale": {"n_stations": n_stations, "n_years": n_years, "cv_length": cv_length},
+        "environment": {
+            "python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+            "sklearn": sklearn.__version__, "machine": platform.machine(), "cpu_count": os.cpu_count(),
+            "storage": os.environ.get("WEATHERPRED_STORAGE", "parquet"),
+        },
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+# function to compare results with a baseline
+def compare(results: dict, baseline: dict) -> list:
+    """
+    :param results: results of this run, with run_info and "benchmarks"
+    :param baseline: results of the baseline run
+    :return: list of the names of the benchmarks more than regression_tolerance slower than the baseline
+    """
+    regressions = []
+    print(f"\ncompared with the baseline of {baseline['created_at']} (commit {baseline['commit']})")
+    print(f"{'benchmark':<40}{'baseline ms':>13}{'ms':>10}{'ratio':>8}")
+    for name, timing in results["benchmarks"].items():
+        if name not in baseline["benchmarks"]:
+            print(f"{name:<40}{'-':>13}{timing['best_seconds'] * 1e3:>10.1f}")
+            continue
+        reference = baseline["benchmarks"][name]["best_seconds"]
+        ratio = timing["best_seconds"] / reference
+        flag = ""
+        if ratio > 1 + regression_tolerance:
+            regressions.append(name)
+            flag = "  slower"
+        print(f"{name:<40}{reference * 1e3:>13.1f}{timing['best_seconds'] * 1e3:>10.1f}{ratio:>8.2f}{flag}")
+    return regressions
+
+
+# function to write a JSON file
+def write_json(data: dict, file_path: str) -> None:
+    """
+    :param data: JSON serializable dictionary
+    :param file_path: path of the file
+    :return: None
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    n_stations = int(args[0]) if len(args) > 0 else 10
+    n_years = int(args[1]) if len(args) > 1 else 10
+    results = run_info(n_stations, n_years)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        start_time = time.perf_counter()
+        codes = make_fixture(tmp_dir, n_stations, n_years)
+        print(f"fixture of {n_stations} stations x {n_years} years written in "
+              f"{time.perf_counter() - start_time:.1f} seconds")
+        results["benchmarks"] = run_suite(tmp_dir, codes)
+    write_json(results, latest_path)
+    print(f"results written to {latest_path}")
+
+    regressions = []
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline["scale"] == results["scale"]:
+            regressions = compare(results, baseline)
+        else:
+            print(f"baseline recorded at another scale {baseline['scale']}, not compared")
+    if "--save-baseline" in sys.argv[1:]:
+        write_json(results, baseline_path)
+        print(f"baseline written to {baseline_path}")
+    if "--check" in sys.argv[1:] and regressions:
+        sys.exit(f"slower than the baseline: {', '.join(regressions)}")
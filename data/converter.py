@@ -2,12 +2,24 @@
 
 # import libraries
 import os
+import re
+import sys
+import html
+import json
+import hashlib
+import numpy as np
 import pandas as pd
-import time
+from functools import partial
+from data.storage import format_of, read_table, table_path, write_table
+from data.stations import StationRegistry, run_sharded
+from data.ghcn_by_year import ingest_by_year, merge_station_history, read_station_partitions
+from pipeline.instrumentation import span
 
 # base filepath for the NOAA data
 noaa_in_path = os.path.join(os.path.dirname(__file__), "raw_data/noaa")
 noaa_out_path = os.path.join(os.path.dirname(__file__), "raw_data/noaa/to_csv")
+# per-station watermarks of the incremental conversion (a directory, so it is skipped as input)
+noaa_state_path = os.path.join(os.path.dirname(__file__), "raw_data/noaa/.convert_state")
 
 # base filepath for the weather.gov data
 weather_gov_in_path = os.path.join(os.path.dirname(__file__), "raw_data/weather_gov")
@@ -71,8 +83,117 @@ data_day_col_names = [item for sublist in data_day_col_names for item in sublist
 data_day_col_specs = [item for sublist in data_day_col_specs for item in sublist]
 data_dtypes = {**data_header_dtypes, **{k: v for d in data_col_dtypes for k, v in d.items()}}
 
+# width of one .dly record without the line terminator (21 header bytes + 31 days * 8 bytes)
+dly_record_width = 21 + 31 * 8
+# missing value sentinel used by NOAA
+dly_missing_value = -9999
+# index/key columns of the wide DataFrame returned by read_dly_file
+dly_index_names = ["STATION_ID", "YEAR", "MONTH", "DAY", "DATE"]
+
+# function to turn the raw bytes of a .dly file into a (n_records, dly_record_width) uint8 array
+def dly_bytes_to_records(raw: bytes) -> np.ndarray:
+    """
+    :param raw: content of a .dly file
+    :return: 2-D uint8 array with one fixed-width record per row
+    """
+    buffer = np.frombuffer(raw, dtype=np.uint8)
+    # fast path: every line is exactly one record followed by "\n", so the buffer is a strided matrix
+    line_width = dly_record_width + 1
+    if buffer.size % line_width == 0 and buffer.size > 0:
+        records = buffer.reshape(-1, line_width)
+        if (records[:, -1] == ord("\n")).all():
+            return records[:, :-1]
+    # slow path: ragged lines (trailing spaces stripped, \r\n endings, missing final newline)
+    lines = [line.rstrip(b"\r") for line in raw.split(b"\n") if line.strip()]
+    if not lines:
+        return np.empty((0, dly_record_width), dtype=np.uint8)
+    # fixed-width bytes dtype pads short lines with NUL, which we map to spaces
+    records = np.array(lines, dtype=f"S{dly_record_width}").view(np.uint8).reshape(len(lines), dly_record_width)
+    return np.where(records == 0, ord(" "), records).astype(np.uint8)
+
+# function to parse right-justified integer fields of a uint8 character array along the last axis
+def parse_int_fields(chars: np.ndarray) -> np.ndarray:
+    """
+    :param chars: uint8 array of shape (..., width) containing ASCII digits, spaces and minus signs
+    :return: int64 array of shape (...)
+    """
+    digits = chars.astype(np.int64) - ord("0")
+    is_digit = (digits >= 0) & (digits <= 9)
+    # fields are right-justified, so the place value is given by the distance to the right edge
+    place = 10 ** np.arange(chars.shape[-1] - 1, -1, -1, dtype=np.int64)
+    values = (np.where(is_digit, digits, 0) * place).sum(axis=-1)
+    negative = (chars == ord("-")).any(axis=-1)
+    return np.where(negative, -values, values)
+
 # function to read a .dly file from NOAA and return a DataFrame
 def read_dly_file(file_path: str) -> pd.DataFrame:
+    """
+    Vectorized parser: the file is read as a single byte buffer and the header, value and flag fields
+    are sliced out as strided views, so no per-line or per-field Python work is done.
+    :param file_path: path to the .dly file
+    :return: DataFrame with the data
+    """
+    # read the file
+    with open(file_path, "rb") as f:
+        records = dly_bytes_to_records(f.read())
+    return dly_records_to_frame(records)
+
+# function to convert an array of .dly records to the wide DataFrame returned by read_dly_file
+def dly_records_to_frame(records: np.ndarray) -> pd.DataFrame:
+    """
+    :param records: uint8 array of shape (n_records, dly_record_width)
+    :return: DataFrame keyed by STATION_ID/YEAR/MONTH/DAY/DATE with one column per element
+    """
+    n_records = records.shape[0]
+    # header fields
+    station_ids = np.ascontiguousarray(records[:, 0:11]).view("S11").ravel()
+    years = parse_int_fields(records[:, 11:15])
+    months = parse_int_fields(records[:, 15:17])
+    elements = np.ascontiguousarray(records[:, 17:21]).view("S4").ravel()
+
+    # day fields: 31 blocks of (VALUE 5, MFLAG 1, QFLAG 1, SFLAG 1) viewed as (n_records, 31, 8)
+    days_block = records[:, 21:].reshape(n_records, 31, 8)
+    values = parse_int_fields(days_block[:, :, 0:5])
+    # the flags (bytes 5 to 7 of each block) are dropped, as in the fixed-width reader
+
+    # keep valid observations that fall on real calendar days
+    month_start = (years - 1970) * 12 + (months - 1)
+    month_start = month_start.astype("datetime64[M]")
+    days_in_month = ((month_start + 1).astype("datetime64[D]") - month_start.astype("datetime64[D]")).astype(np.int64)
+    day_numbers = np.arange(1, 32)
+    valid = (values != dly_missing_value) & (day_numbers[None, :] <= days_in_month[:, None])
+    record_idx, day_idx = np.nonzero(valid)
+    observed = values[record_idx, day_idx]
+    dates = month_start[record_idx].astype("datetime64[D]") + day_idx
+
+    # pivot: one row per (station, date), one column per element, sorted like DataFrame.pivot
+    station_codes, station_inverse = np.unique(station_ids, return_inverse=True)
+    element_codes, element_inverse = np.unique(elements, return_inverse=True)
+    date_ordinals = dates.astype(np.int64)
+    keys = station_inverse[record_idx].astype(np.int64) * (1 << 32) + (date_ordinals - date_ordinals.min(initial=0))
+    unique_keys, row_inverse = np.unique(keys, return_inverse=True)
+    wide = np.full((unique_keys.size, element_codes.size), np.nan)
+    wide[row_inverse, element_inverse[record_idx]] = observed
+
+    # index columns for each output row
+    first_obs = np.zeros(unique_keys.size, dtype=np.int64)
+    first_obs[row_inverse[::-1]] = np.arange(row_inverse.size)[::-1]
+    row_dates = dates[first_obs]
+    row_records = record_idx[first_obs]
+    df = pd.DataFrame({
+        "STATION_ID": station_codes[station_inverse[row_records]].astype(str),
+        "YEAR": years[row_records],
+        "MONTH": months[row_records],
+        "DAY": day_idx[first_obs] + 1,
+        "DATE": row_dates.astype("datetime64[ns]"),
+    })
+    element_df = pd.DataFrame(wide, columns=pd.Index(element_codes.astype(str), name="ELEMENT"))
+    df = pd.concat([df, element_df], axis=1)
+    df.columns.name = "ELEMENT"
+    return df
+
+# reference implementation based on pd.read_fwf, kept for validation and benchmarking of read_dly_file
+def read_dly_file_fwf(file_path: str) -> pd.DataFrame:
     """
     :param file_path: path to the .dly file
     :return: DataFrame with the data
@@ -111,6 +232,145 @@ def read_dly_file(file_path: str) -> pd.DataFrame:
     df = df.pivot(index=["STATION_ID", "YEAR", "MONTH", "DAY", "DATE"], columns="ELEMENT", values="VALUE").reset_index()
     return df
 
+# function to find the byte offset at which each non-empty line of a buffer starts
+def line_offsets(raw: bytes) -> np.ndarray:
+    """
+    :param raw: content of a text file
+    :return: int64 array with the byte offset of every non-empty line
+    """
+    buffer = np.frombuffer(raw, dtype=np.uint8)
+    ends = np.flatnonzero(buffer == ord("\n"))
+    if buffer.size and buffer[-1] != ord("\n"):
+        ends = np.append(ends, buffer.size)
+    starts = np.concatenate([[0], ends[:-1] + 1]).astype(np.int64)
+    # skip blank lines, consistently with dly_bytes_to_records
+    return starts[(ends - starts) > 1] if ends.size else starts[:0]
+
+# function to convert a .dly file to a table, re-parsing only the months after the station's watermark
+def convert_dly_file(in_path: str, out_path: str, state_path: str, refresh_months: int = 2, full: bool = False) -> dict:
+    """
+    NOAA only revises the last month or two of a station's history, and new months are appended at the end of the
+    file. The watermark stores the byte offset of the first of the last refresh_months months, a checksum of the
+    bytes before it, and the number of output rows before those months. If the checksum still matches, only the
+    bytes after the offset are parsed and merged into the stored table (a csv is truncated and appended in place);
+    otherwise the file is rebuilt in full.
+    :param in_path: path to the .dly file
+    :param out_path: path to the output table, its extension selects the storage format
+    :param state_path: path to the JSON file holding the station's watermark
+    :param refresh_months: number of trailing months that are re-parsed on every run
+    :param full: force a full rebuild
+    :return: dictionary {mode: "incremental" or "full", rows: number of parsed rows}
+    """
+    with open(in_path, "rb") as f:
+        raw = f.read()
+
+    # check whether the watermark is still valid
+    watermark = None
+    if not full and os.path.exists(state_path) and os.path.exists(out_path):
+        with open(state_path) as f:
+            watermark = json.load(f)
+        offset = watermark["dly_offset"]
+        if (len(raw) < offset
+                or hashlib.blake2b(raw[:offset]).hexdigest() != watermark["dly_checksum"]
+                or os.path.getsize(out_path) != watermark.get("out_size")):
+            watermark = None
+
+    # parse everything, or only the records after the watermark
+    start = watermark["dly_offset"] if watermark else 0
+    tail_raw = raw[start:]
+    records = dly_bytes_to_records(tail_raw)
+    starts = line_offsets(tail_raw) + start
+    df = dly_records_to_frame(records)
+    if watermark:
+        new_elements = set(df.columns) - set(watermark["columns"])
+        in_order = df.empty or (df["YEAR"] * 12 + df["MONTH"]).min() >= watermark["year"] * 12 + watermark["month"]
+        if new_elements or not in_order:
+            # a new element appeared or older months were inserted: rebuild from scratch
+            return convert_dly_file(in_path, out_path, state_path, refresh_months=refresh_months, full=True)
+        df = df.reindex(columns=watermark["columns"])
+
+    # split the output in the stable part and the trailing months that will be re-parsed next time
+    record_months = parse_int_fields(records[:, 11:15]) * 12 + parse_int_fields(records[:, 15:17]) - 1
+    cutoff = record_months.max() - (refresh_months - 1) if record_months.size else 0
+    if watermark:
+        # never move the watermark backwards
+        cutoff = max(cutoff, watermark["year"] * 12 + watermark["month"] - 1)
+    row_months = (df["YEAR"] * 12 + df["MONTH"] - 1).to_numpy()
+    head, tail = df[row_months < cutoff], df[row_months >= cutoff]
+
+    head_rows = (watermark["head_rows"] if watermark else 0) + len(head)
+    out_offset = None
+    if format_of(out_path) == "csv":
+        # csv: truncate to the stable part and append in incremental mode
+        if watermark:
+            with open(out_path, "r+b") as f:
+                f.truncate(watermark["out_offset"])
+        else:
+            df.iloc[:0].to_csv(out_path, index=False)
+        head.to_csv(out_path, mode="a", header=False, index=False)
+        out_offset = os.path.getsize(out_path)
+        tail.to_csv(out_path, mode="a", header=False, index=False)
+    else:
+        # binary formats cannot be appended: merge the new rows with the stable part of the stored table
+        merged = df
+        if watermark:
+            stored = read_table(out_path)
+            merged = pd.concat([stored.iloc[:watermark["head_rows"]], df], ignore_index=True)
+        write_table(merged, out_path)
+
+    # the new watermark is the first record of the refreshed months, provided the file is sorted by month
+    tail_records = np.flatnonzero(record_months >= cutoff)
+    sorted_months = record_months.size == 0 or (np.diff(record_months) >= 0).all()
+    if not sorted_months or len(starts) != len(records):
+        # unusual layout: no watermark, so the next run rebuilds the file in full
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        return {"mode": "incremental" if watermark else "full", "rows": len(df)}
+    dly_offset = int(starts[tail_records[0]]) if tail_records.size else len(raw)
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path, "w") as f:
+        json.dump({
+            "dly_offset": dly_offset,
+            "dly_checksum": hashlib.blake2b(raw[:dly_offset]).hexdigest(),
+            "year": int(cutoff // 12),
+            "month": int(cutoff % 12 + 1),
+            "head_rows": head_rows,
+            "out_offset": out_offset,
+            "out_size": os.path.getsize(out_path),
+            "columns": list(df.columns),
+        }, f)
+    return {"mode": "incremental" if watermark else "full", "rows": len(df)}
+
+# Function to convert the .dly file of a registered station, run by the workers of run_sharded
+def convert_station(code: str, full: bool = False) -> dict:
+    """
+    Stations with partitions of the GHCN by-year archives (see data/ghcn_by_year.py) are rebuilt in full from their
+    .dly file, if any, merged with the partitions
+    :param code: station code (see data/stations.py)
+    :param full: ignore the watermark and reparse the whole history
+    :return: result of convert_dly_file, None if the station has not been downloaded
+    """
+    in_file = f"{noaa_in_path}/{code}.dly"
+    out_file = table_path(noaa_out_path, code)
+    state_file = f"{noaa_state_path}/{code}.json"
+    with span("convert", station=code) as s:
+        partitions = read_station_partitions(code)
+        if partitions is not None:
+            df = merge_station_history(read_dly_file(in_file) if os.path.exists(in_file) else None, partitions)
+            write_table(df, out_file)
+            # the merged table does not match the watermark of the .dly file
+            if os.path.exists(state_file):
+                os.remove(state_file)
+            result = {"mode": "by_year", "rows": len(df)}
+        elif not os.path.exists(in_file):
+            return None
+        else:
+            result = convert_dly_file(in_file, out_file, state_file, full=full)
+        s.set(mode=result["mode"])
+        s.add("rows", result["rows"])
+    return result
+
+
 # Function to process metadata of geolocations of the weather stations
 def read_metadata(file_path: str) -> pd.DataFrame:
     """
@@ -139,11 +399,130 @@ def list_to_str_no_duplicates(lst: list) -> str:
             result.append(lst[i])
     return " ".join(result)
 
+# columns of the weather.gov obs-history table kept by read_obs_history: {starts of the header labels: column name}
+obs_history_columns = {
+    ("Date",): "Date",
+    ("Time",): "Time",
+    ("Temperature", "Air"): "Temperature (F) Air",
+    ("Precipitation", "1 hr"): "Precipitation (in) 1 hr",
+}
+
+# function to find the header labels of each column of a table whose header cells span rows and columns
+def header_labels(header_rows: list) -> list:
+    """
+    :param header_rows: list of header rows, each a list of (text, rowspan, colspan) cells
+    :return: list with the tuple of labels of each column, from the top header row down
+    """
+    n_columns = sum(colspan for _, _, colspan in header_rows[0])
+    labels = [[] for _ in range(n_columns)]
+    # number of rows still covered by a cell of a previous row, per column
+    covered = [0] * n_columns
+    for row in header_rows:
+        column = 0
+        for text, rowspan, colspan in row:
+            while column < n_columns and covered[column] > 0:
+                column += 1
+            for c in range(column, min(column + colspan, n_columns)):
+                labels[c].append(text)
+                covered[c] = rowspan
+            column += colspan
+        covered = [max(0, n - 1) for n in covered]
+    return [tuple(label) for label in labels]
+
+# function to decode the leading text of a table cell
+def cell_text(raw: bytes) -> str:
+    """
+    :param raw: bytes of the cell up to its first tag
+    :return: text of the cell without surrounding whitespace, character references decoded
+    """
+    text = raw.decode("utf-8", errors="replace")
+    return (html.unescape(text) if "&" in text else text).strip()
+
+# function to convert the text of a table cell to a float, NaN when empty or not a number
+def cell_to_float(text: str) -> float:
+    """
+    :param text: text of the cell
+    :return: float
+    """
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return np.nan
+
+# start of each table row, leading text of each td cell of a row and start of a th cell
+obs_history_row = re.compile(rb"<tr[\s>]", re.IGNORECASE)
+obs_history_td = re.compile(rb"<td(?:\s[^>]*)?>([^<]*)", re.IGNORECASE)
+obs_history_th = re.compile(rb"<th[\s>]", re.IGNORECASE)
+
+# function to read the obs-history table of a weather.gov observation page
+def read_obs_history(file_path: str) -> pd.DataFrame:
+    """
+    Only the header of the table is parsed by lxml, to find the position of the columns of obs_history_columns. The
+    data rows are then scanned with regular expressions that only collect the leading text of each cell, instead
+    of building the element tree of the rows (or every table of the page with pd.read_html). The page is
+    decoded as UTF-8 (it has no charset declaration, so the default latin-1 decoding turned the degree sign of
+    "Temperature (ºF)" into "ÂºF").
+    :param file_path: path to the .html file
+    :return: DataFrame with the columns of obs_history_columns: Date (day of the month) as integers, Time as
+             strings, the air temperature and the 1 hour precipitation as floats (NaN when missing)
+    """
+    from lxml import etree
+    with open(file_path, "rb") as f:
+        raw = f.read()
+    # only the bytes of the table are read, not the navigation and the footer of the page
+    marker = raw.find(b"obs-history")
+    start, end = raw.rfind(b"<table", 0, marker), raw.find(b"</table>", marker)
+    if marker < 0 or start < 0 or end < 0:
+        raise ValueError(f"No obs-history table in {file_path}")
+    table = raw[start:end]
+    # leading text of the td cells of each row, and whether the row has th cells
+    row_starts = [match.start() for match in obs_history_row.finditer(table)] + [len(table)]
+    rows = [(obs_history_td.findall(table, a, b), obs_history_th.search(table, a, b) is not None)
+            for a, b in zip(row_starts, row_starts[1:])]
+    # header rows: the rows of th cells before the first row of data (the copy of the header in tfoot is skipped)
+    n_header_rows = next((i for i, (cells, _) in enumerate(rows) if cells), len(rows))
+    document = etree.fromstring(table[:row_starts[n_header_rows]], etree.HTMLParser(encoding="utf-8"))
+    header_rows = [] if document is None else [
+        [(" ".join("".join(cell.itertext()).split()), int(cell.get("rowspan", 1)), int(cell.get("colspan", 1)))
+         for cell in tr if cell.tag in ("th", "td")] for tr in document.iter("tr")]
+    if not header_rows:
+        raise ValueError(f"No header in the obs-history table of {file_path}")
+
+    # position of the kept columns
+    labels = header_labels(header_rows)
+    positions = {}
+    for starts, name in obs_history_columns.items():
+        matches = [i for i, label in enumerate(labels)
+                   if len(label) >= len(starts) and all(l.startswith(s) for l, s in zip(label, starts))]
+        if not matches:
+            raise ValueError(f"No {name} column in the obs-history table of {file_path}")
+        positions[name] = matches[0]
+    # only the kept cells of the data rows made of one td per column are read
+    rows = [cells for cells, has_th in rows[n_header_rows:] if len(cells) == len(labels) and not has_th]
+    columns = {name: [cell_text(cells[i]) for cells in rows] for name, i in positions.items()}
+    return pd.DataFrame({
+        "Date": np.array(columns["Date"], dtype=np.int64),
+        "Time": np.array(columns["Time"], dtype=object),
+        "Temperature (F) Air": np.array([cell_to_float(v) for v in columns["Temperature (F) Air"]]),
+        "Precipitation (in) 1 hr": np.array([cell_to_float(v) for v in columns["Precipitation (in) 1 hr"]]),
+    }, copy=False)
+
 # Function to convert html files to csv files.
 def html_to_csv(file_path: str) -> pd.DataFrame:
     """
     :param file_path: path to the .html file
-    :return: DataFrame
+    :return: DataFrame of read_obs_history
+    """
+    with span("parse_obs_history", file=os.path.basename(file_path)) as s:
+        df = read_obs_history(file_path)
+        s.add("rows", len(df))
+    return df
+
+# reference implementation based on pd.read_html, kept for benchmarking of read_obs_history
+def html_to_csv_read_html(file_path: str) -> pd.DataFrame:
+    """
+    :param file_path: path to the .html file
+    :return: DataFrame with every column of the obs-history table
     # need to extract the data from <table class="obs-history">
     """
     # read the file
@@ -157,44 +536,52 @@ def html_to_csv(file_path: str) -> pd.DataFrame:
 
 
 if __name__ == '__main__':
-    # time conversion
-    start_time = time.time()
-    # create the output directory if it doesn't exist
-    if not os.path.exists(noaa_out_path):
-        os.makedirs(noaa_out_path)
-    # for each file in the noaa directory
-    for file in os.listdir(noaa_in_path):
-        # skip the file if it is a directory
-        if os.path.isdir(f"{noaa_in_path}/{file}"):
-            continue
-        # if the file is not a .dly (i.e. metadata  txt file)
-        elif not file.endswith(".dly"):
+    # pass --full to ignore the watermarks and reparse every station's whole history
+    full = "--full" in sys.argv[1:]
+    # time conversion, each station and page is also recorded in a span when WEATHERPRED_METRICS is set
+    with span("convert_data") as conversion:
+        # create the output directory if it doesn't exist
+        if not os.path.exists(noaa_out_path):
+            os.makedirs(noaa_out_path)
+        # convert the metadata txt files first, the station registry is built from them
+        for file in os.listdir(noaa_in_path):
+            # skip directories and .dly files
+            if os.path.isdir(f"{noaa_in_path}/{file}") or file.endswith(".dly"):
+                continue
+            out_file = table_path(noaa_out_path, file.replace('.txt', ''))
+            # skip the metadata if it has not changed since the last conversion
+            if not full and os.path.exists(out_file) and os.path.getmtime(out_file) >= os.path.getmtime(f"{noaa_in_path}/{file}"):
+                continue
             # read the file
             data = read_metadata(f"{noaa_in_path}/{file}")
-            # save the file to csv format
-            data.to_csv(f"{noaa_out_path}/{file.replace('.txt', '.csv')}", index=False)
-            print(f"Converted {file} to {file.replace('.txt', '.csv')}")
-        # if the file is a .dly file
-        else:
-            # read the file
-            data = read_dly_file(f"{noaa_in_path}/{file}")
-            # save the file to csv format
-            data.to_csv(f"{noaa_out_path}/{file.replace('.dly', '.csv')}", index=False)
-            print(f"Converted {file} to {file.replace('.dly', '.csv')}")
-    # create the output directory if it doesn't exist
-    if not os.path.exists(weather_gov_out_path):
-        os.makedirs(weather_gov_out_path)
-    # for each file in the weather.gov directory
-    for file in os.listdir(weather_gov_in_path):
-        # skip the file if it is a directory
-        if os.path.isdir(f"{weather_gov_in_path}/{file}"):
-            continue
-        # if the file is .html file
-        elif file.endswith(".html"):
-            # read the file
-            data = html_to_csv(f"{weather_gov_in_path}/{file}")
-            # save the file to csv format
-            data.to_csv(f"{weather_gov_out_path}/{file.replace('.html', '.csv')}", index=False)
-            print(f"Converted {file} to {file.replace('.html', '.csv')}")
+            # save the file in the storage format
+            write_table(data, out_file)
+            print(f"Converted {file} to {os.path.basename(out_file)}")
+        registry = StationRegistry.load()
+        # split the GHCN by-year archives downloaded by the scraper (--by-year) into per-station partitions
+        ingest_by_year({code: registry.ghcn_id(code) for code in registry}, full=full)
+        # convert the .dly file of each registered station, only parsing the months after the station's watermark;
+        # stations are processed in shards, in parallel within a shard
+        for code, result in run_sharded(partial(convert_station, full=full), registry):
+            if result is None:
+                print(f"No NOAA data for station {code}")
+            else:
+                print(f"Converted {code}.dly to {os.path.basename(table_path(noaa_out_path, code))} "
+                      f"({result['mode']}, {result['rows']} rows)")
+        # create the output directory if it doesn't exist
+        if not os.path.exists(weather_gov_out_path):
+            os.makedirs(weather_gov_out_path)
+        # for each file in the weather.gov directory
+        for file in os.listdir(weather_gov_in_path):
+            # skip the file if it is a directory
+            if os.path.isdir(f"{weather_gov_in_path}/{file}"):
+                continue
+            # if the file is .html file
+            elif file.endswith(".html"):
+                # read the file
+                data = html_to_csv(f"{weather_gov_in_path}/{file}")
+                # save the file to csv format
+                data.to_csv(f"{weather_gov_out_path}/{file.replace('.html', '.csv')}", index=False)
+                print(f"Converted {file} to {file.replace('.html', '.csv')}")
     # print the time taken
-    print(f"Time taken for conversion: {time.time() - start_time} seconds")
+    print(f"Time taken for conversion: {conversion.seconds} seconds")
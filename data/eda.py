@@ -5,15 +5,16 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 from scipy.signal import correlate
+from data.storage import read_table, table_files
 
 # relative file path to the processed data
 noaa_data_path = os.path.join(os.path.dirname(__file__), '../data/raw_data/noaa/to_csv')
-noaa_files = os.listdir(noaa_data_path)
+noaa_files = table_files(noaa_data_path)
 
 # function to perform EDA on the NOAA GHCN-DAILY climate dataset.
 def eda_noaa_climate_data(file_path: str):
     """
-    :param file_path: Path to the CSV file containing the climate data for a specific city.
+    :param file_path: Path to the table containing the climate data for a specific city.
     :returns: None
     """
     ### Processing
@@ -21,7 +22,7 @@ def eda_noaa_climate_data(file_path: str):
     city_code = os.path.splitext(os.path.basename(file_path))[0]
     
     # Load the dataset
-    df = pd.read_csv(file_path, parse_dates=['DATE'])
+    df = read_table(file_path, parse_dates=['DATE'])
 
     # Climate variables of interest
     climate_vars = ['PRCP', 'TMIN', 'TAVG', 'TMAX']
@@ -128,6 +129,6 @@ if __name__ == '__main__':
         # Run EDA for each file if does not contain 'stations' in the name
         if not 'stations' in file:
             print(f"Running EDA for {file}")
-            eda_noaa_climate_data(os.path.join(noaa_data_path, file))
+            eda_noaa_climate_data(file)
 
 
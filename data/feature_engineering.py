@@ -1,100 +1,343 @@
 # import libraries
 import os
+import numpy as np
 import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 from datetime import datetime, timedelta
+from data.storage import read_table, table_path, write_table
+from data.stations import StationRegistry, run_sharded
+from pipeline.instrumentation import span
 
 
 # relative file path to the processed data
 noaa_data_path = os.path.join(os.path.dirname(__file__), 'raw_data/noaa/to_csv')
 out_path = os.path.join(os.path.dirname(__file__), 'processed_data')
-noaa_files = os.listdir(noaa_data_path)
 
-# function to perform feature engineering on each city's NOAA climate dataset that was converted to .csv.
-def feature_engineering_noaa_climate_data(file_path: str) -> pd.DataFrame:
+# Climate variables of interest
+climate_vars = ['PRCP', 'TMIN', 'TAVG', 'TMAX']
+# Targets, in the order of today's columns and of the forward lags
+basic_vars = ['TMIN', 'TMAX', 'TAVG']
+target_vars = ['TMIN', 'TAVG', 'TMAX']
+# Default lag configuration: backward lags are predictors, forward lags are the multi-day targets
+default_lag_vars = ['TMIN', 'TAVG', 'TMAX', 'PRCP']
+default_backward_lags = list(range(1, 30 + 1))
+default_forward_lags = list(range(-1, -4 - 1, -1))
+# Offsets (in days) of the window last year that is averaged for the *_mean_5d_window features
+last_year_window_lags = list(range(365, 365 + 5))
+# First year kept in the processed data
+first_year = 2013
+# weather.gov csv columns written before read_obs_history, when the pages were decoded as latin-1
+legacy_weather_gov_columns = {'Temperature (ÂºF) Air': 'Temperature (F) Air'}
+# Schema of the processed feature set, from the feature build to the model input: targets, lags and windows are
+# float32 (the observations have 4 significant digits at most) and the calendar fields are small integers
+feature_float_dtype = np.float32
+calendar_dtypes = {'YEAR': np.int16, 'MONTH': np.int8, 'DAY_OF_YEAR': np.int16, 'WEEK_OF_YEAR': np.int8,
+                   'SEASON': np.int8}
+
+
+# function to get the dtypes of the processed feature set
+def feature_dtypes(columns: list) -> dict:
     """
-    :param file_path: Path to the CSV file containing the climate data for a specific city.
-    :returns: A pandas DataFrame with the feature-engineered climate data.
+    :param columns: columns of a processed table, or of its features or targets
+    :returns: dictionary {column: dtype}
+    """
+    return {column: calendar_dtypes.get(column, feature_float_dtype) for column in columns}
+
+
+# function to cast a processed table to the feature schema, e.g. a csv table or a table written before the schema
+def apply_feature_schema(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param df: DataFrame of processed columns without missing values
+    :returns: DataFrame with the dtypes of feature_dtypes; columns that already have their dtype are not copied
+    """
+    schema = feature_dtypes(df.columns)
+    cast = {column: schema[column] for column, dtype in df.dtypes.items() if dtype != schema[column]}
+    return df.astype(cast, copy=False) if cast else df
+
+
+# function to build the lag block of a set of daily series with sliding-window views
+def lag_matrix(values: np.ndarray, lags: list, dtype: type = np.float64) -> np.ndarray:
+    """
+    :param values: array of shape (n_days, n_vars), one row per day in chronological order
+    :param lags: list of lags; positive lags look back and negative lags look forward, like pd.Series.shift
+    :param dtype: float dtype of the result
+    :returns: array of shape (n_days, n_vars, len(lags)) with entry [t, v, j] = values[t - lags[j], v] (NaN if out of range)
+    """
+    lags = np.asarray(lags)
+    n_days, n_vars = values.shape
+    before, after = max(lags.max(), 0), max(-lags.min(), 0)
+    # pad with NaN so that every day has a full window
+    padded = np.full((n_days + before + after, n_vars), np.nan, dtype=dtype)
+    padded[before:before + n_days] = values
+    # windows[t, v, j] = padded[t + j, v] = values[t + j - before, v], a view without copies
+    windows = sliding_window_view(padded, before + after + 1, axis=0)
+    # gather all lags at once: this is the only copy of the lag block
+    return windows[:, :, before - lags]
+
+
+# function to build the feature-engineered table from the combined daily climate data
+def build_features(df: pd.DataFrame, lag_vars: list = None, backward_lags: list = None,
+                   forward_lags: list = None, dtype: type = np.float64) -> pd.DataFrame:
+    """
+    :param df: DataFrame with a DATE column and the climate variables, one row per day in chronological order
+    :param lag_vars: variables whose backward lags are used as predictors, in output order
+    :param backward_lags: positive lags used as predictors
+    :param forward_lags: negative lags of the target variables used as multi-day targets
+    :param dtype: float dtype of the computations, the output follows the feature schema (see feature_dtypes)
+    :returns: A pandas DataFrame with targets first, then lags, mean window and time features
     """
-    # Load the NOAA dataset
-    noaa_df = pd.read_csv(file_path, parse_dates=['DATE'])
+    lag_vars = default_lag_vars if lag_vars is None else lag_vars
+    backward_lags = default_backward_lags if backward_lags is None else list(backward_lags)
+    forward_lags = default_forward_lags if forward_lags is None else list(forward_lags)
+
+    # Drop all observations before Year 2013
+    df = df[df['DATE'].dt.year >= first_year]
+    dates = df['DATE'].dt
+
+    # Stack every variable that is a target or a predictor into one (n_days, n_vars) array
+    variables = [var for var in climate_vars if var in target_vars or var in lag_vars]
+    var_index = {var: i for i, var in enumerate(variables)}
+    values = df[variables].to_numpy(dtype=dtype)
+
+    # Every variable at every lag, lag 0 being today's value: lag_block[t, v, j] is the value of v at day t - lags[j]
+    lags = [0] + backward_lags + forward_lags
+    lag_block = lag_matrix(values, lags, dtype)
+
+    # (variable, lag) of each lag-type output column in output order:
+    # today's climate variables and negative lags are at the beginning
+    names = list(basic_vars)
+    column_vars, column_lags = [var_index[var] for var in basic_vars], [0] * len(basic_vars)
+    for i in forward_lags:
+        names += [f'{var}_lag_{i}' for var in target_vars]
+        column_vars += [var_index[var] for var in target_vars]
+        column_lags += [i] * len(target_vars)
+    for i in backward_lags:
+        names += [f'{var}_lag_{i}' for var in lag_vars]
+        column_vars += [var_index[var] for var in lag_vars]
+        column_lags += [i] * len(lag_vars)
+    column_vars, column_lags = np.array(column_vars), np.array([lags.index(lag) for lag in column_lags])
+
+    # Mean over a 5-day window for each climate variable based on the values of this window last year
+    window = lag_matrix(values, last_year_window_lags, dtype).mean(axis=2)
+    names += [f'{var}_mean_5d_window' for var in variables]
+
+    # Time features: year, month, day of the year, week of the year and season
+    # season_map = {1: 'Winter', 2: 'Spring', 3: 'Summer', 4: 'Fall'}
+    names += ['YEAR', 'MONTH', 'DAY_OF_YEAR', 'WEEK_OF_YEAR', 'SEASON']
+    time_values = np.column_stack([
+        dates.year, dates.month, dates.dayofyear, dates.isocalendar().week.to_numpy(), (dates.month % 12 + 3) // 3
+    ])
+
+    # Drop all observations with missing values in any variable at any lag (including lags that are not kept
+    # as columns, e.g. forward lags of PRCP)
+    missing = np.isnan(lag_block).any(axis=(1, 2)) | np.isnan(window).any(axis=1)
+    rows = np.flatnonzero(~missing)
+
+    # Gather the whole lag block of the complete rows at once into the final 2-D array, rounded once to the schema
+    n_lag_columns = len(column_vars)
+    features = np.empty((len(rows), len(names)), dtype=feature_float_dtype)
+    features[:, :n_lag_columns] = lag_block[rows[:, None], column_vars[None, :], column_lags[None, :]]
+    features[:, n_lag_columns:n_lag_columns + len(variables)] = window[rows]
+    features[:, n_lag_columns + len(variables):] = time_values[rows]
+    return apply_feature_schema(pd.DataFrame(features, columns=names, index=df.index[rows]))
+
+
+# function to load a city's daily climate data: NOAA history completed with the recent weather.gov observations
+def load_daily_climate(file_path: str, weather_gov_file_path: str = None) -> pd.DataFrame:
+    """
+    :param file_path: Path to the table (see data/storage.py) containing the climate data for a specific city.
+    :param weather_gov_file_path: Path to the weather.gov csv of the city, next to the NOAA table by default.
+                                  Stations without weather.gov observations (not airports) only use NOAA data.
+    :returns: A pandas DataFrame with DATE and the climate variables, temperatures in Farenheit.
+    """
+    # Load the NOAA dataset, only the columns we need
+    noaa_df = read_table(file_path, columns=['DATE'] + climate_vars, parse_dates=['DATE'])
 
     # Filter out today and prior 2 days of data due to incompleteness
     # We will augment it with the weather.gov dataset
     noaa_df = noaa_df[noaa_df['DATE'] < (pd.Timestamp.now() - timedelta(days=4))]
 
-    # Climate variables of interest
-    climate_vars = ['PRCP', 'TMIN', 'TAVG', 'TMAX']
-    noaa_df = noaa_df[['DATE'] + climate_vars]
-
     # Convert temperature variables from tenths of a degree Celsius to Farenheit
     # (see NOAA docs: https://www.ncei.noaa.gov/pub/data/ghcn/daily/readme.txt)
     noaa_df['TMIN'] = noaa_df['TMIN'] / 10 * (9 / 5) + 32
     noaa_df['TAVG'] = noaa_df['TAVG'] / 10 * (9 / 5) + 32
     noaa_df['TMAX'] = noaa_df['TMAX'] / 10 * (9 / 5) + 32
 
-    # Load the weather.gov dataset, which is already measured in Farenheit
-    weather_gov_file_path = file_path.replace('noaa', 'weather_gov')
+    # Load the weather.gov dataset, which is already measured in Farenheit (always stored as csv)
+    if weather_gov_file_path is None:
+        weather_gov_file_path = os.path.splitext(file_path.replace('noaa', 'weather_gov'))[0] + '.csv'
+    if not os.path.exists(weather_gov_file_path):
+        return noaa_df
     weather_gov_df = feature_engineering_weather_gov_data(weather_gov_file_path)
 
     # Combine the two datasets
-    df = pd.concat([noaa_df, weather_gov_df], axis=0)
+    return pd.concat([noaa_df, weather_gov_df], axis=0)
 
-    # Add year, month columns for plotting
-    df['YEAR'] = df['DATE'].dt.year
-    # Drop all observations before Year 2013
-    df = df[df['YEAR'] >= 2013]
-    df['MONTH'] = df['DATE'].dt.month
 
-    # Add a column for the day of the year
-    df['DAY_OF_YEAR'] = df['DATE'].dt.dayofyear
+# function to perform feature engineering on each city's NOAA climate dataset that was converted to .csv.
+def feature_engineering_noaa_climate_data(file_path: str, weather_gov_file_path: str = None, **kwargs) -> pd.DataFrame:
+    """
+    :param file_path: Path to the table (see data/storage.py) containing the climate data for a specific city.
+    :param weather_gov_file_path: Path to the weather.gov csv of the city, next to the NOAA table by default.
+    :param kwargs: lag configuration passed to build_features
+    :returns: A pandas DataFrame with the feature-engineered climate data.
+    """
+    return build_features(load_daily_climate(file_path, weather_gov_file_path), **kwargs)
+
 
-    # Add a column for the week of the year
-    df['WEEK_OF_YEAR'] = df['DATE'].dt.isocalendar().week
+# function to process the converted NOAA table of a registered station, run by the workers of run_sharded
+def process_station(code: str) -> int:
+    """
+    :param code: station code (see data/stations.py)
+    :returns: number of feature rows written, None if the station has no converted NOAA table
+    """
+    file_path = table_path(noaa_data_path, code)
+    if not os.path.exists(file_path):
+        return None
+    with span("features", station=code) as s:
+        # Perform feature engineering on the climate data
+        engineered_data = feature_engineering_noaa_climate_data(file_path)
+        # Save the feature-engineered data in the storage format
+        write_table(engineered_data, table_path(out_path, code))
+        s.add("rows", len(engineered_data))
+    return len(engineered_data)
+
+
+# function to list the target columns of the feature-engineered data (its first columns)
+def target_names(forward_lags: list = None) -> list:
+    """
+    :param forward_lags: negative lags of the target variables
+    :returns: list of target column names in output order
+    """
+    forward_lags = default_forward_lags if forward_lags is None else forward_lags
+    return basic_vars + [f'{var}_lag_{i}' for i in forward_lags for var in target_vars]
+
+
+class OnlineFeatures:
+    """
+    Rolling per-station state that produces the predictor columns of build_features for new days only.
+    The state keeps the last days of the climate variables needed by the backward lags and by the window last year,
+    so a day's feature row can be computed as soon as the previous day has been observed.
+    """
+    def __init__(self, lag_vars: list = None, backward_lags: list = None, horizon: int = 31,
+                 dtype: type = np.float64) -> None:
+        """
+        :param lag_vars: variables whose backward lags are used as predictors, in output order
+        :param backward_lags: positive lags used as predictors
+        :param horizon: number of past days whose feature rows can still be produced by update
+        :param dtype: float dtype of the stored days and of the computations, the feature rows follow the feature schema
+        """
+        self.lag_vars = default_lag_vars if lag_vars is None else list(lag_vars)
+        self.backward_lags = default_backward_lags if backward_lags is None else list(backward_lags)
+        self.dtype = dtype
+        self.variables = [var for var in climate_vars if var in target_vars or var in self.lag_vars]
+        # number of days needed before a feature row: the largest lag and the oldest day of last year's window
+        self.history = max(max(self.backward_lags), max(last_year_window_lags))
+        # values[k] holds the day end - len(values) + k
+        self.values = np.full((self.history + horizon, len(self.variables)), np.nan, dtype=dtype)
+        self.end = None
+        self.last_observed = None
+        # last day whose feature row was emitted (the forecast row of the previous update)
+        self.last_emitted = None
+
+    def feature_names(self) -> list:
+        """
+        :returns: list of the predictor columns, in the order of build_features
+        """
+        return ([f'{var}_lag_{i}' for i in self.backward_lags for var in self.lag_vars]
+                + [f'{var}_mean_5d_window' for var in self.variables]
+                + ['YEAR', 'MONTH', 'DAY_OF_YEAR', 'WEEK_OF_YEAR', 'SEASON'])
+
+    def update(self, daily: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add new or revised daily observations and return the feature rows of the new days
+        :param daily: DataFrame with DATE and the climate variables; its values overwrite the stored ones
+        :returns: predictor rows (see feature_names) for every day after the last day emitted by the previous update
+                  up to the day after the last observed day (the forecast row), empty if no day was added; rows with
+                  missing values are dropped
+        """
+        daily = daily.dropna(subset=['DATE'])
+        dates = daily['DATE'].to_numpy().astype('datetime64[D]')
+        new_end = dates.max() + 1
+        if self.end is None:
+            self.end = new_end
+        elif new_end > self.end:
+            # roll the buffer forward, the new days start as missing
+            shift = min(int((new_end - self.end).astype(int)), len(self.values))
+            self.values = np.roll(self.values, -shift, axis=0)
+            self.values[-shift:] = np.nan
+            self.end = new_end
+        start = self.end - len(self.values)
+
+        # write the observations that fall into the buffer, missing values do not overwrite stored ones
+        keep = dates >= start
+        positions = (dates[keep] - start).astype(int)
+        observed = daily.loc[keep, self.variables].to_numpy(dtype=self.dtype)
+        current = self.values[positions]
+        self.values[positions] = np.where(np.isnan(observed), current, observed)
+
+        # days to emit: from the day after the last emitted one to the day after the last observation, the forecast
+        # row only depends on the days before it so it is not emitted again once its day is observed
+        last_observed = dates.max() if self.last_observed is None else max(self.last_observed, dates.max())
+        first = last_observed + 1 if self.last_emitted is None else self.last_emitted + 1
+        self.last_observed = last_observed
+        self.last_emitted = last_observed + 1 if self.last_emitted is None else max(self.last_emitted,
+                                                                                     last_observed + 1)
+        first = max(first, start + self.history)
+        days = np.arange(first, last_observed + 2, dtype='datetime64[D]')
+        return self.features(days)
+
+    def features(self, days: np.ndarray) -> pd.DataFrame:
+        """
+        :param days: datetime64[D] array of days whose predictors are all in the buffer
+        :returns: predictor rows for the given days, rows with missing values are dropped
+        """
+        offsets = (days - (self.end - len(self.values))).astype(int)
+        var_index = {var: i for i, var in enumerate(self.variables)}
+        # lags[k, j, v] = value of variable v at day k - backward_lags[j]
+        lagged = self.values[offsets[:, None] - np.array(self.backward_lags)[None, :]]
+        lag_block = lagged[:, :, [var_index[var] for var in self.lag_vars]].reshape(
+            len(days), len(self.backward_lags) * len(self.lag_vars))
+        window = self.values[offsets[:, None] - np.array(last_year_window_lags)[None, :]].mean(axis=1)
+        dates = pd.DatetimeIndex(days.astype('datetime64[ns]'))
+        features = np.concatenate([lag_block, window], axis=1)
+        complete = ~np.isnan(features).any(axis=1)
+        dates = dates[complete]
+        # the frame is built in the feature schema: one float block, then the calendar columns
+        names = self.feature_names()
+        df = pd.DataFrame(features[complete].astype(feature_float_dtype), columns=names[:features.shape[1]],
+                          index=dates.rename('DATE'))
+        calendar = {'YEAR': dates.year, 'MONTH': dates.month, 'DAY_OF_YEAR': dates.dayofyear,
+                    'WEEK_OF_YEAR': dates.isocalendar().week.to_numpy(), 'SEASON': (dates.month % 12 + 3) // 3}
+        return pd.concat([df, pd.DataFrame({name: np.asarray(values, dtype=calendar_dtypes[name])
+                                            for name, values in calendar.items()}, index=df.index)], axis=1)
+
+    def save(self, path: str) -> None:
+        """
+        Save the state to a .npz file
+        :param path: path to the file
+        :return: None
+        """
+        np.savez(path, values=self.values, end=self.end, last_observed=self.last_observed,
+                 last_emitted=self.last_emitted, lag_vars=self.lag_vars, backward_lags=self.backward_lags)
+
+    @staticmethod
+    def load(path: str) -> 'OnlineFeatures':
+        """
+        Load the state from a .npz file
+        :param path: path to the file
+        :return: OnlineFeatures object
+        """
+        with np.load(path) as f:
+            state = OnlineFeatures(lag_vars=f['lag_vars'].tolist(), backward_lags=f['backward_lags'].tolist(),
+                                   dtype=f['values'].dtype.type)
+            state.values = f['values']
+            state.end = f['end'][()]
+            state.last_observed = f['last_observed'][()]
+            # states saved before last_emitted was stored had emitted the forecast row of their last update
+            state.last_emitted = f['last_emitted'][()] if 'last_emitted' in f else state.last_observed + 1
+        return state
 
-    # Add a column for the season
-    # season_map = {1: 'Winter', 2: 'Spring', 3: 'Summer', 4: 'Fall'}
-    df['SEASON'] = (df['DATE'].dt.month % 12 + 3) // 3
-
-    # Add columns for lagged versions of the climate variables
-    for var in climate_vars:
-        # Create a dictionary of forward and backward lagged columns
-        # Forward lags are for multi-day out prediction, backward lags are predictors
-        backward_lagged_columns = {f'{var}_lag_{i}': df[var].shift(i) for i in range(1, 30 + 1)}
-        forward_lagged_columns = {f'{var}_lag_{i}': df[var].shift(i) for i in range(-1, -4 - 1, -1)}
-        # Convert dictionaries to DataFrame and concatenate
-        backward_lagged_df = pd.DataFrame(backward_lagged_columns)
-        forward_lagged_df = pd.DataFrame(forward_lagged_columns)
-        df = pd.concat([df, backward_lagged_df, forward_lagged_df], axis=1)
-
-    # Add columns for the mean over a 5-day window for each climate variable
-    # based on the values of this window last year
-    for var in climate_vars:
-        df[f'{var}_mean_5d_window'] = df[var].shift(365).rolling(window=5).mean()
-
-    # Drop date column and convert all values in the df to float
-    df = df.drop('DATE', axis=1).astype(float)
-
-    # Drop all observations with missing values
-    df = df.dropna()
-
-    # Re-order columns so today's climate variables and negative lags are at the beginning
-    df = df[[item for sublist in [
-        ['TMIN', 'TMAX', 'TAVG'],  # Basic variables
-        *[
-            [f'TMIN_lag_{i}', f'TAVG_lag_{i}', f'TMAX_lag_{i}']
-            for i in range(-1, -5, -1)
-        ],  # Negative lags
-        *[
-            [f'TMIN_lag_{i}', f'TAVG_lag_{i}', f'TMAX_lag_{i}', f'PRCP_lag_{i}']
-            for i in range(1, 31)
-        ],  # Positive lags
-        [
-            f'{var}_mean_5d_window' for var in climate_vars
-        ],  # Mean window variables
-        ['YEAR', 'MONTH', 'DAY_OF_YEAR', 'WEEK_OF_YEAR', 'SEASON'],  # Time features
-    ] for item in sublist]]
-
-    return df
 
 # function to perform feature engineering on each city's weather.gov climate dataset that was converted to .csv.
 def feature_engineering_weather_gov_data(file_path: str, verbose = True) -> pd.DataFrame:
@@ -103,7 +346,7 @@ def feature_engineering_weather_gov_data(file_path: str, verbose = True) -> pd.D
     :returns: A pandas DataFrame with the feature-engineered climate data.
     """
     # Load the dataset
-    df = pd.read_csv(file_path)
+    df = pd.read_csv(file_path).rename(columns=legacy_weather_gov_columns)
 
     # Filter out today's calendar date due to data incompleteness
     df = df[df['Date'] < pd.Timestamp.now().day]
@@ -112,9 +355,9 @@ def feature_engineering_weather_gov_data(file_path: str, verbose = True) -> pd.D
     # Compute daily aggregated (daily min, max, avg) temperature values and aggregate precipitation
     df_daily = df.groupby('DATE').agg(
         PRCP=('Precipitation (in) 1 hr', 'sum'),
-        TMIN=('Temperature (ÂºF) Air', 'min'),
-        TAVG=('Temperature (ÂºF) Air', 'mean'),
-        TMAX=('Temperature (ÂºF) Air', 'max')
+        TMIN=('Temperature (F) Air', 'min'),
+        TAVG=('Temperature (F) Air', 'mean'),
+        TMAX=('Temperature (F) Air', 'max')
     ).reset_index()
 
     # Convert aggregate precipitation from in to tenths of mm
@@ -133,10 +376,7 @@ if __name__ == "__main__":
     if not os.path.exists(out_path):
         os.makedirs(out_path)
 
-    for file in noaa_files:
-        # Skip the stations file
-        if not 'stations' in file:
-            # Perform feature engineering on the climate data
-            engineered_data = feature_engineering_noaa_climate_data(os.path.join(noaa_data_path, file))
-            # Save the feature-engineered data to a new CSV file
-            engineered_data.to_csv(f"{out_path}/{file}", index=False)
+    # process the registered stations in shards, in parallel within a shard
+    for code, n_rows in run_sharded(process_station, StationRegistry.load()):
+        if n_rows is None:
+            print(f"No converted NOAA data for station {code}")
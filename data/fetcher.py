@@ -0,0 +1,187 @@
+# Concurrent HTTP downloader shared by the NOAA and weather.gov scrapers
+# - one pooled requests.Session for all downloads
+# - bounded thread pool
+# - conditional GETs (ETag / If-Modified-Since) so unchanged files are not downloaded again
+# - retries with exponential backoff, also when the connection breaks while the body is streamed
+# - bodies are streamed to a temporary file and atomically renamed into place
+
+import os
+import json
+import time
+import tempfile
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+from pipeline.instrumentation import span
+
+# name of the hidden directory (next to the downloaded files) that holds validators and partial downloads.
+# A directory is used so that the converters, which skip directories, never pick these files up.
+cache_dir_name = ".http_cache"
+
+
+class Fetcher:
+    def __init__(self, max_workers: int = 8, timeout: float = 30.0, retries: int = 3,
+                 backoff_factor: float = 0.5, chunk_size: int = 1 << 16,
+                 session: requests.Session = None) -> None:
+        """
+        Initialize the fetcher
+        :param max_workers: maximum number of concurrent downloads
+        :param timeout: connect/read timeout in seconds for each request
+        :param retries: number of retries for connection errors and 429/5xx responses
+        :param backoff_factor: backoff factor between retries (sleeps backoff_factor * 2 ** retry seconds)
+        :param chunk_size: size in bytes of the chunks streamed to disk
+        :param session: optional session to use instead of a new pooled one
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.chunk_size = chunk_size
+        if session is None:
+            session = requests.Session()
+            retry = Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["GET"],
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    @staticmethod
+    def _validator_path(file_path: str) -> str:
+        """
+        :param file_path: path of the downloaded file
+        :return: path of the JSON file holding the HTTP validators of the file
+        """
+        directory, name = os.path.split(os.path.abspath(file_path))
+        return os.path.join(directory, cache_dir_name, f"{name}.json")
+
+    def _read_validators(self, url: str, file_path: str) -> dict:
+        """
+        :param url: URL of the file
+        :param file_path: path of the downloaded file
+        :return: dictionary with the stored ETag/Last-Modified, empty if the file must be downloaded in full
+        """
+        validator_path = self._validator_path(file_path)
+        if not os.path.exists(file_path) or not os.path.exists(validator_path):
+            return {}
+        with open(validator_path) as f:
+            validators = json.load(f)
+        # validators are only meaningful for the URL they were obtained from
+        if validators.get("url") != url:
+            return {}
+        return validators
+
+    def fetch(self, url: str, file_path: str) -> dict:
+        """
+        Download a single URL to a file unless the server reports it unchanged
+        :param url: URL to download
+        :param file_path: destination path
+        :return: dictionary {url, path, status, bytes, seconds}; status is one of
+                 "downloaded", "not_modified" or "failed" (with an "error" entry)
+        """
+        with span("download", file=os.path.basename(file_path)) as s:
+            result = self._fetch(url, file_path)
+            s.add("bytes", result["bytes"])
+            s.set(status=result["status"])
+        return result
+
+    def _fetch(self, url: str, file_path: str) -> dict:
+        """
+        Download of fetch, recorded in a "download" span (see pipeline/instrumentation.py)
+        """
+        start_time = time.time()
+        result = {"url": url, "path": file_path, "status": "failed", "bytes": 0}
+        validators = self._read_validators(url, file_path)
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        cache_dir = os.path.dirname(self._validator_path(file_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            for attempt in range(self.retries + 1):
+                with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 304:
+                        result["status"] = "not_modified"
+                        return result
+                    response.raise_for_status()
+                    try:
+                        self._stream_to_file(response, file_path, cache_dir, result)
+                    except (requests.ConnectionError, requests.exceptions.ChunkedEncodingError):
+                        # the connection broke while the body was streamed: the retries of the adapter only cover
+                        # the request, so the whole download is retried here
+                        if attempt == self.retries:
+                            raise
+                        time.sleep(self.backoff_factor * 2 ** attempt)
+                        continue
+                    # save the validators for the next conditional request
+                    with open(self._validator_path(file_path), "w") as f:
+                        json.dump({
+                            "url": url,
+                            "etag": response.headers.get("ETag"),
+                            "last_modified": response.headers.get("Last-Modified"),
+                        }, f)
+                    result["status"] = "downloaded"
+                    break
+        except requests.RequestException as e:
+            result["error"] = str(e)
+        finally:
+            result["seconds"] = time.time() - start_time
+        return result
+
+    def _stream_to_file(self, response: requests.Response, file_path: str, cache_dir: str, result: dict) -> None:
+        """
+        Stream the body to a temporary file in the same file system, then rename it into place
+        :param response: streamed response
+        :param file_path: destination path
+        :param cache_dir: directory of the temporary file
+        :param result: result dictionary of the download, its byte count is updated
+        :return: None
+        """
+        result["bytes"] = 0
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    result["bytes"] += len(chunk)
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def fetch_all(self, jobs: dict, verbose: bool = True) -> list:
+        """
+        Download several URLs concurrently
+        :param jobs: dictionary {file_path: url}
+        :param verbose: print one line per finished download
+        :return: list of result dictionaries (see fetch), in the order of jobs
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.fetch, url, file_path) for file_path, url in jobs.items()]
+            results = []
+            for future in futures:
+                result = future.result()
+                if verbose:
+                    name = os.path.basename(result["path"])
+                    if result["status"] == "failed":
+                        print(f"Failed to download {name}: {result['error']}")
+                    else:
+                        print(f"{name}: {result['status']} ({result['bytes']} bytes in {result['seconds']:.2f} seconds)")
+                results.append(result)
+        return results
+
+    def close(self) -> None:
+        """
+        Close the underlying session
+        :return: None
+        """
+        self.session.close()
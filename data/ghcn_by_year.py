@@ -0,0 +1,209 @@
+# GHCN by-year archives: one gzip csv per year holding the observations of every GHCN station
+# (https://www.ncei.noaa.gov/pub/data/ghcn/daily/by_year), an alternative to downloading the complete .dly history
+# of each station when many stations are tracked and only the recent years change.
+#
+# An archive is streamed in chunks, filtered to the registered stations and to by_year_elements, and written as one
+# partition per station and year with the columns of read_dly_file:
+#
+#   raw_data/noaa/by_year/2024.csv.gz
+#   raw_data/noaa/by_year/partitions/KBOI/2024.parquet
+#
+# data/converter.py merges the partitions of a station with its .dly history (see merge_station_history).
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from data.storage import read_table, storage_extensions, table_path, write_table
+from pipeline.instrumentation import span
+
+# base URL of the archives and local paths of the archives, of the partitions and of the ingestion state
+by_year_url = "https://www.ncei.noaa.gov/pub/data/ghcn/daily/by_year"
+by_year_path = os.path.join(os.path.dirname(__file__), "raw_data/noaa/by_year")
+partitions_path = os.path.join(by_year_path, "partitions")
+by_year_state_path = os.path.join(os.path.dirname(__file__), "raw_data/noaa/.convert_state/by_year")
+
+# number of recent years downloaded by the scraper in by-year mode
+by_year_years = int(os.environ.get("WEATHERPRED_BY_YEAR_YEARS", 2))
+# elements kept from the archives, the ones used by the pipeline
+by_year_elements = ["PRCP", "TAVG", "TMAX", "TMIN"]
+# columns of the archives (no header): ID, YYYYMMDD, ELEMENT, DATA_VALUE, M-FLAG, Q-FLAG, S-FLAG, OBS-TIME;
+# the flags are dropped, as in read_dly_file
+by_year_names = ["STATION_ID", "DATE", "ELEMENT", "VALUE"]
+by_year_dtypes = {"STATION_ID": str, "DATE": str, "ELEMENT": str, "VALUE": np.int64}
+# rows read at a time
+by_year_chunksize = 1_000_000
+
+
+# function to build the download jobs of the archives of some years
+def by_year_jobs(years: list, filepath: str = by_year_path, base_url: str = by_year_url) -> dict:
+    """
+    :param years: years to download
+    :param filepath: output directory
+    :param base_url: URL of the directory of the archives
+    :return: dictionary {file_path: url} for Fetcher.fetch_all
+    """
+    return {os.path.join(filepath, f"{year}.csv.gz"): f"{base_url}/{year}.csv.gz" for year in years}
+
+
+# function to read the rows of an archive for some stations, one chunk at a time
+def read_by_year_file(file_path: str, station_ids: list, elements: list = None,
+                      chunksize: int = by_year_chunksize) -> pd.DataFrame:
+    """
+    :param file_path: path to the archive (.csv.gz, or an uncompressed .csv)
+    :param station_ids: GHCN IDs of the stations to keep
+    :param elements: elements to keep (defaults to by_year_elements)
+    :param chunksize: number of rows parsed at a time, so memory is bounded by a chunk and the kept rows
+    :return: long DataFrame with STATION_ID, DATE (YYYYMMDD strings), ELEMENT and VALUE
+    """
+    station_ids = pd.Index(station_ids).unique()
+    elements = pd.Index(elements or by_year_elements)
+    kept = []
+    with span("parse_by_year", file=os.path.basename(file_path)) as s, \
+            pd.read_csv(file_path, header=None, usecols=range(len(by_year_names)), names=by_year_names,
+                        dtype=by_year_dtypes, chunksize=chunksize, compression="infer") as reader:
+        for chunk in reader:
+            kept.append(chunk[chunk["STATION_ID"].isin(station_ids) & chunk["ELEMENT"].isin(elements)])
+            s.add("rows", len(chunk))
+            s.add("kept_rows", len(kept[-1]))
+    if not kept:
+        return pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in by_year_dtypes.items()})
+    return pd.concat(kept, ignore_index=True)
+
+
+# function to convert the long rows of an archive to the wide DataFrame returned by read_dly_file
+def by_year_rows_to_frame(rows: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param rows: DataFrame returned by read_by_year_file
+    :return: DataFrame keyed by STATION_ID/YEAR/MONTH/DAY/DATE with one column per element, sorted like read_dly_file
+    """
+    rows = rows.drop_duplicates(["STATION_ID", "DATE", "ELEMENT"], keep="last")
+    wide = rows.pivot(index=["STATION_ID", "DATE"], columns="ELEMENT", values="VALUE").astype(float)
+    wide = wide[sorted(wide.columns)]
+    dates = pd.to_datetime(wide.index.get_level_values("DATE"), format="%Y%m%d")
+    df = pd.DataFrame({
+        "STATION_ID": wide.index.get_level_values("STATION_ID").astype(str),
+        "YEAR": dates.year.astype(np.int64),
+        "MONTH": dates.month.astype(np.int64),
+        "DAY": dates.day.astype(np.int64),
+        "DATE": dates.astype("datetime64[ns]"),
+    })
+    df = pd.concat([df, pd.DataFrame(wide.to_numpy(), columns=pd.Index(wide.columns, name="ELEMENT"))], axis=1)
+    df.columns.name = "ELEMENT"
+    return df
+
+
+# function to split an archive into per-station partitions
+def ingest_by_year_file(file_path: str, stations: dict, out_path: str = partitions_path, elements: list = None,
+                        chunksize: int = by_year_chunksize) -> dict:
+    """
+    The partitions of the archive's year are replaced, so an archive of the current year can be ingested again
+    every day
+    :param file_path: path to the archive, named {year}.csv.gz
+    :param stations: dictionary {station code: GHCN ID} of the stations to keep
+    :param out_path: directory of the partitions, one subdirectory per station
+    :param elements: elements to keep (defaults to by_year_elements)
+    :param chunksize: number of rows parsed at a time
+    :return: dictionary {station code: number of rows written}
+    """
+    year = os.path.basename(file_path).split(".")[0]
+    rows = read_by_year_file(file_path, list(stations.values()), elements, chunksize)
+    df = by_year_rows_to_frame(rows)
+    # one pass over the rows, instead of one filter per station
+    station_dfs = {ghcn_id: station_df.reset_index(drop=True)
+                   for ghcn_id, station_df in df.groupby("STATION_ID", sort=False)}
+    written = {}
+    for code, ghcn_id in stations.items():
+        station_df = station_dfs.get(ghcn_id)
+        partition = table_path(os.path.join(out_path, code), year)
+        # drop the partitions of the year in the other formats (and all of them if the station stopped
+        # reporting), so that a station has one partition per year
+        for fmt in storage_extensions:
+            stale = table_path(os.path.join(out_path, code), year, fmt)
+            if os.path.exists(stale) and (station_df is None or stale != partition):
+                os.remove(stale)
+        if station_df is None:
+            continue
+        os.makedirs(os.path.dirname(partition), exist_ok=True)
+        write_table(station_df, partition)
+        written[code] = len(station_df)
+    return written
+
+
+# function to ingest the archives that changed since their last ingestion
+def ingest_by_year(stations: dict, in_path: str = by_year_path, out_path: str = partitions_path,
+                   state_path: str = by_year_state_path, full: bool = False, verbose: bool = True) -> list:
+    """
+    :param stations: dictionary {station code: GHCN ID} of the stations to keep
+    :param in_path: directory of the downloaded archives
+    :param out_path: directory of the partitions
+    :param state_path: directory of the JSON files recording the size, modification time and stations of each
+                       ingested archive
+    :param full: ingest every archive again
+    :param verbose: print progress
+    :return: list of the ingested archives
+    """
+    if not os.path.isdir(in_path):
+        return []
+    os.makedirs(state_path, exist_ok=True)
+    ingested = []
+    for file in sorted(os.listdir(in_path)):
+        if not file.endswith(".csv.gz"):
+            continue
+        file_path = os.path.join(in_path, file)
+        stat = os.stat(file_path)
+        state = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "stations": stations}
+        state_file = os.path.join(state_path, file.replace(".csv.gz", ".json"))
+        if not full and os.path.exists(state_file):
+            with open(state_file) as f:
+                if json.load(f) == state:
+                    continue
+        written = ingest_by_year_file(file_path, stations, out_path)
+        with open(state_file, "w") as f:
+            json.dump(state, f)
+        ingested.append(file)
+        if verbose:
+            print(f"Ingested {file}: {sum(written.values())} rows for {len(written)} stations")
+    return ingested
+
+
+# function to read the partitions of a station
+def read_station_partitions(code: str, path: str = partitions_path) -> pd.DataFrame:
+    """
+    :param code: station code
+    :param path: directory of the partitions
+    :return: DataFrame with the columns of read_dly_file, None if the station has no partition
+    """
+    station_path = os.path.join(path, code)
+    if not os.path.isdir(station_path):
+        return None
+    extensions = tuple(storage_extensions.values())
+    # one partition per year: if a year was written in several formats, the most recent file is read
+    files = {}
+    for f in sorted(os.listdir(station_path), key=lambda f: os.path.getmtime(os.path.join(station_path, f))):
+        if f.endswith(extensions):
+            files[os.path.splitext(f)[0]] = f
+    files = [files[year] for year in sorted(files)]
+    if not files:
+        return None
+    df = pd.concat([read_table(os.path.join(station_path, f), parse_dates=["DATE"]) for f in files],
+                   ignore_index=True)
+    return df[list(df.columns[:5]) + sorted(df.columns[5:])]
+
+
+# function to merge the by-year partitions of a station with its .dly history
+def merge_station_history(dly_df: pd.DataFrame, partitions: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param dly_df: DataFrame returned by read_dly_file, None if the station has no .dly file
+    :param partitions: DataFrame returned by read_station_partitions
+    :return: DataFrame with the columns of read_dly_file, sorted by date; the values of the archives, more recent,
+             replace those of the .dly file and the other elements of the .dly file are kept
+    """
+    if dly_df is None or dly_df.empty:
+        return partitions
+    keys = ["STATION_ID", "YEAR", "MONTH", "DAY", "DATE"]
+    merged = partitions.set_index(keys).combine_first(dly_df.set_index(keys))
+    merged = merged.sort_index(level="DATE", sort_remaining=False).reset_index()
+    merged = merged[keys + sorted(merged.columns[len(keys):])]
+    merged.columns.name = "ELEMENT"
+    return merged
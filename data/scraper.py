@@ -2,132 +2,124 @@
 
 # Importing libraries
 import os
-import requests
-import time
-
-# Dictionary mapping city names to airport codes
-city_to_airport = {
-    "Anchorage": "PANC",
-    "Boise": "KBOI",
-    "Chicago": "KORD",
-    "Denver": "KDEN",
-    "Detroit": "KDTW",
-    "Honolulu": "PHNL",
-    "Houston": "KIAH",
-    "Miami": "KMIA",
-    "Minneapolis": "KMIC",
-    "Oklahoma City": "KOKC",
-    "Nashville": "KBNA",
-    "New York": "KJFK",
-    "Phoenix": "KPHX",
-    "Portland ME": "KPWM",
-    "Portland OR": "KPDX",
-    "Salt Lake City": "KSLC",
-    "San Diego": "KSAN",
-    "San Francisco": "KSFO",
-    "Seattle": "KSEA",
-    "Washington": "KDCA",
-}
-# Dictionary mapping airport codes to NOAA station IDs
-airport_to_noaa = {
-    "PANC": "USW00026451",
-    "KBOI": "USW00024131",
-    "KORD": "USW00094846",
-    "KDEN": "USW00003017",
-    "KDTW": "USW00094847",
-    "PHNL": "USW00022521",
-    "KIAH": "USW00012960",
-    "KMIA": "USW00012839",
-    "KMIC": "USW00014922", # #"USW00094960",
-    "KOKC": "USW00013967",
-    "KBNA": "USW00013897",
-    "KJFK": "USW00094789",
-    "KPHX": "USW00023183",
-    "KPWM": "USW00014764",
-    "KPDX": "USW00024229",
-    "KSLC": "USW00024127",
-    "KSAN": "USW00023188",
-    "KSFO": "USW00023234",
-    "KSEA": "USW00024233",
-    "KDCA": "USW00013743",
-}
+import sys
+from datetime import date
+from data.fetcher import Fetcher
+from data.ghcn_by_year import by_year_jobs, by_year_url, by_year_years
+from data.stations import StationRegistry
+from pipeline.instrumentation import span
 
 
 # Function to download NOAA data for a list of weather stations
-def noaa_scraper(filepath: str = 'raw_data/noaa') -> None:
+def noaa_scraper(filepath: str = 'raw_data/noaa', fetcher: Fetcher = None, verbose = True,
+                 registry: StationRegistry = None) -> list:
     """
-    :param filepath:
-    :return:
+    :param filepath: output directory
+    :param fetcher: Fetcher used for the downloads (a new one is created if None)
+    :param verbose: print progress
+    :param registry: stations to download (see data/stations.py), loaded from the station metadata if None
+    :return: list of download results (see Fetcher.fetch)
     """
     # Base URL for the NOAA data
     base_noaa_url = 'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/all'
     # Create the output directory if it doesn't exist
     if not os.path.exists(filepath):
         os.makedirs(filepath)
-    # Loop over the city names and airport codes
-    for city, airport in city_to_airport.items():
-        print(f"Downloading data for {city}")
-        url = f"{base_noaa_url}/{airport_to_noaa[airport]}.dly"
-        # Download the data
-        response = requests.get(url)
-        # Save the data to a file
-        with open(f"{filepath}/{airport}.dly", 'wb') as f:
-            f.write(response.content)
-    print("Downloaded NOAA data")
+    registry = registry or StationRegistry.load()
+    fetcher = fetcher or Fetcher()
+    results = []
+    # Map each output file to the station's URL, one shard of stations at a time
+    for shard in registry.shards():
+        jobs = {f"{filepath}/{code}.dly": f"{base_noaa_url}/{registry.ghcn_id(code)}.dly" for code in shard}
+        # Download the data, only files that changed since the last run are transferred
+        results += fetcher.fetch_all(jobs, verbose=verbose)
+    if verbose:
+        print(f"Downloaded NOAA data for {len(registry)} stations")
+    return results
+
+
+# Function to download the GHCN by-year archives of the recent years, which hold every station
+def noaa_by_year_scraper(filepath: str = 'raw_data/noaa/by_year', fetcher: Fetcher = None, verbose = True,
+                         years: list = None, base_url: str = by_year_url) -> list:
+    """
+    :param filepath: output directory
+    :param fetcher: Fetcher used for the downloads (a new one is created if None)
+    :param verbose: print progress
+    :param years: years to download (defaults to the last WEATHERPRED_BY_YEAR_YEARS years)
+    :param base_url: URL of the directory of the archives
+    :return: list of download results (see Fetcher.fetch)
+    """
+    # Create the output directory if it doesn't exist
+    if not os.path.exists(filepath):
+        os.makedirs(filepath)
+    this_year = date.today().year
+    years = years or list(range(this_year - by_year_years + 1, this_year + 1))
+    # Download the archives, only the ones that changed since the last run are transferred
+    results = (fetcher or Fetcher()).fetch_all(by_year_jobs(years, filepath, base_url), verbose=verbose)
+    if verbose:
+        print(f"Downloaded NOAA by-year archives for {years[0]}-{years[-1]}")
+    return results
 
 
 # Function to download geospatial coordinates for a list of weather stations
-def get_noaa_stations_gps(filepath: str = 'raw_data/noaa') -> None:
+def get_noaa_stations_gps(filepath: str = 'raw_data/noaa', fetcher: Fetcher = None, verbose = True) -> list:
     """
-    :param filepath:
-    :return:
+    :param filepath: output directory
+    :param fetcher: Fetcher used for the download (a new one is created if None)
+    :param verbose: print progress
+    :return: list of download results (see Fetcher.fetch)
     """
     # URL for the NOAA station metadata
     noaa_stations_url = 'https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/ghcnd-stations.txt'
     # Download the station metadata
-    response = requests.get(noaa_stations_url)
-    # Save the station metadata to a file
-    with open(f"{filepath}/ghcnd-stations.txt", 'wb') as f:
-        f.write(response.content)
-    print("Downloaded NOAA station metadata")
+    results = (fetcher or Fetcher()).fetch_all({f"{filepath}/ghcnd-stations.txt": noaa_stations_url}, verbose=verbose)
+    if verbose:
+        print("Downloaded NOAA station metadata")
+    return results
 
 # Function to scrape weather.gov last 3 days of data
-def weather_gov_scraper(filepath: str = 'raw_data/weather_gov', verbose = True) -> None:
+def weather_gov_scraper(filepath: str = 'raw_data/weather_gov', verbose = True, fetcher: Fetcher = None,
+                        registry: StationRegistry = None) -> list:
     """
-    :param filepath:
-    :return:
+    :param filepath: output directory
+    :param verbose: print progress
+    :param fetcher: Fetcher used for the downloads (a new one is created if None)
+    :param registry: station registry, only its forecast stations (airports) have weather.gov observations
+    :return: list of download results (see Fetcher.fetch)
     """
     # Base URL for the NOAA data
-    weather_gov_url = 'https://forecast.weather.gov/data/obhistory/'
+    weather_gov_url = 'https://forecast.weather.gov/data/obhistory'
     # Create the output directory if it doesn't exist
     if not os.path.exists(filepath):
         os.makedirs(filepath)
     # full ulr has the form: https://forecast.weather.gov/data/obhistory/{airport_code}.html
-    # Loop over the city names and airport codes
-    for city, airport in city_to_airport.items():
-        if verbose:
-            print(f"Downloading last 3 days of data for {city}")
-        url = f"{weather_gov_url}/{airport}.html"
-        # Download the data
-        response = requests.get(url)
-        # Save the data to a .csv file
-        with open(f"{filepath}/{airport}.html", 'wb') as f:
-            f.write(response.content)
+    jobs = {f"{filepath}/{airport}.html": f"{weather_gov_url}/{airport}.html" for airport in (registry or StationRegistry.build()).forecast_codes()}
+    if verbose:
+        print(f"Downloading last 3 days of data for {len(jobs)} airports")
+    # Download the data
+    results = (fetcher or Fetcher()).fetch_all(jobs, verbose=verbose)
     if verbose:
         print("Downloaded last 3 days of data from weather.gov")
+    return results
 
 
 if __name__ == '__main__':
-    # Scraping time
-    start_time = time.time()
-    # Base path for the NOAA data (get folder in which this file is located)
-    out_noaa_path = os.path.join(os.path.dirname(__file__), 'raw_data/noaa')
-    out_weather_gov_path = os.path.join(os.path.dirname(__file__), 'raw_data/weather_gov')
-    # Run the scraper
-    noaa_scraper(out_noaa_path)
-    # Run the station metadata downloader
-    get_noaa_stations_gps(out_noaa_path)
-    # Run the weather.gov scraper
-    weather_gov_scraper(out_weather_gov_path)
+    # Scraping time, each download is also recorded in a span when WEATHERPRED_METRICS is set
+    with span("scrape") as scrape:
+        # Base path for the NOAA data (get folder in which this file is located)
+        out_noaa_path = os.path.join(os.path.dirname(__file__), 'raw_data/noaa')
+        out_weather_gov_path = os.path.join(os.path.dirname(__file__), 'raw_data/weather_gov')
+        # Share one pooled fetcher between the scrapers
+        fetcher = Fetcher()
+        # Run the station metadata downloader first: the registry of stations to download is built from it
+        get_noaa_stations_gps(out_noaa_path, fetcher=fetcher)
+        # Run the scraper: pass --by-year to download the archives of the recent years instead of the .dly histories
+        if "--by-year" in sys.argv[1:]:
+            noaa_by_year_scraper(os.path.join(out_noaa_path, 'by_year'), fetcher=fetcher)
+        else:
+            noaa_scraper(out_noaa_path, fetcher=fetcher)
+        # Run the weather.gov scraper
+        weather_gov_scraper(out_weather_gov_path, fetcher=fetcher)
+        fetcher.close()
     # Print the time taken
-    print(f"Time taken: {time.time() - start_time:.2f} seconds")
\ No newline at end of file
+    print(f"Time taken: {scrape.seconds:.2f} seconds")
@@ -0,0 +1,243 @@
+# Station registry: the stations covered by the pipeline, with their GHCN metadata (see read_metadata)
+#
+# - the forecast stations: the airports whose forecasts are submitted, in submission order
+# - optional additional GHCN stations, one GHCN ID per line in the file named by WEATHERPRED_STATIONS
+#   (lines starting with # are ignored); they are named by their GHCN ID
+#
+# Pipeline stages iterate the registry in shards of WEATHERPRED_SHARD_SIZE stations and process the stations of a
+# shard with WEATHERPRED_JOBS worker processes (set by the makefile's SHARD_SIZE and JOBS variables), so memory
+# is bounded by the size of a shard whatever the number of stations.
+
+import os
+import numpy as np
+import pandas as pd
+from data.storage import read_table, table_path
+
+# (city, airport code, GHCN ID) of the forecast stations, in submission order
+forecast_stations = [
+    ("Anchorage", "PANC", "USW00026451"),
+    ("Boise", "KBOI", "USW00024131"),
+    ("Chicago", "KORD", "USW00094846"),
+    ("Denver", "KDEN", "USW00003017"),
+    ("Detroit", "KDTW", "USW00094847"),
+    ("Honolulu", "PHNL", "USW00022521"),
+    ("Houston", "KIAH", "USW00012960"),
+    ("Miami", "KMIA", "USW00012839"),
+    ("Minneapolis", "KMIC", "USW00014922"),  # "USW00094960"
+    ("Oklahoma City", "KOKC", "USW00013967"),
+    ("Nashville", "KBNA", "USW00013897"),
+    ("New York", "KJFK", "USW00094789"),
+    ("Phoenix", "KPHX", "USW00023183"),
+    ("Portland ME", "KPWM", "USW00014764"),
+    ("Portland OR", "KPDX", "USW00024229"),
+    ("Salt Lake City", "KSLC", "USW00024127"),
+    ("San Diego", "KSAN", "USW00023188"),
+    ("San Francisco", "KSFO", "USW00023234"),
+    ("Seattle", "KSEA", "USW00024233"),
+    ("Washington", "KDCA", "USW00013743"),
+]
+
+# GHCN station metadata, downloaded by data/scraper.py and converted by data/converter.py
+metadata_raw_path = os.path.join(os.path.dirname(__file__), "raw_data/noaa/ghcnd-stations.txt")
+metadata_path = os.path.join(os.path.dirname(__file__), "raw_data/noaa/to_csv")
+metadata_name = "ghcnd-stations"
+
+# file listing additional GHCN stations, number of stations per shard and number of worker processes
+extra_stations_path = os.environ.get("WEATHERPRED_STATIONS")
+shard_size = int(os.environ.get("WEATHERPRED_SHARD_SIZE", 100))
+n_jobs = int(os.environ.get("WEATHERPRED_JOBS", 1))
+
+# mean Earth radius in km
+earth_radius = 6371.0
+
+
+# function to convert coordinates to points on the unit sphere, where chord distances order like great-circle ones
+def unit_vectors(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    :param latitude: latitudes in degrees
+    :param longitude: longitudes in degrees
+    :return: array of shape (n, 3)
+    """
+    lat, lon = np.radians(np.asarray(latitude, dtype=float)), np.radians(np.asarray(longitude, dtype=float))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+# function to read the GHCN station metadata, from the converted table if it exists
+def read_station_metadata() -> pd.DataFrame:
+    """
+    :return: DataFrame of read_metadata, None if the metadata has not been downloaded
+    """
+    converted = table_path(metadata_path, metadata_name)
+    if os.path.exists(converted):
+        return read_table(converted)
+    if os.path.exists(metadata_raw_path):
+        from data.converter import read_metadata
+        return read_metadata(metadata_raw_path)
+    return None
+
+
+# function to read the GHCN IDs of the additional stations
+def read_extra_stations(path: str = None) -> list:
+    """
+    :param path: file with one GHCN ID per line (defaults to WEATHERPRED_STATIONS)
+    :return: list of GHCN IDs, empty if no file is configured
+    """
+    path = path or extra_stations_path
+    if not path:
+        return []
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+class StationRegistry:
+    """
+    Table of the stations of the pipeline indexed by station code (the airport code of the forecast stations,
+    the GHCN ID of the others), with a k-d tree over their coordinates for nearest-station lookups
+    """
+    def __init__(self, stations: pd.DataFrame) -> None:
+        """
+        :param stations: DataFrame indexed by station code with GHCN_ID, CITY (None for stations that are not
+                         forecast), NAME, LATITUDE, LONGITUDE and ELEVATION
+        """
+        self.stations = stations
+        # k-d tree over the stations with coordinates and their codes, built on the first lookup
+        self.tree = None
+        self.located = None
+
+    @staticmethod
+    def build(metadata: pd.DataFrame = None, extra_ids: list = None) -> 'StationRegistry':
+        """
+        :param metadata: DataFrame of read_metadata (coordinates are NaN without it)
+        :param extra_ids: GHCN IDs of the additional stations
+        :return: registry of the forecast stations followed by the additional stations
+        """
+        rows = [(airport, ghcn_id, city) for city, airport, ghcn_id in forecast_stations]
+        known = {ghcn_id for _, ghcn_id, _ in rows}
+        rows += [(ghcn_id, ghcn_id, None) for ghcn_id in dict.fromkeys(extra_ids or []) if ghcn_id not in known]
+        stations = pd.DataFrame(rows, columns=["CODE", "GHCN_ID", "CITY"]).set_index("CODE")
+        columns = ["NAME", "LATITUDE", "LONGITUDE", "ELEVATION"]
+        if metadata is not None:
+            metadata = metadata.drop_duplicates("ID").set_index("ID")[columns]
+            stations = stations.join(metadata, on="GHCN_ID")
+            if extra_ids:
+                unknown = [ghcn_id for ghcn_id in extra_ids if ghcn_id not in metadata.index]
+                if unknown:
+                    raise ValueError(f"Unknown GHCN stations {unknown[:10]}{'...' if len(unknown) > 10 else ''}")
+        else:
+            stations = stations.assign(**{column: np.nan for column in columns})
+        # GHCN marks missing elevations with -999.9
+        stations["ELEVATION"] = stations["ELEVATION"].where(stations["ELEVATION"] > -999)
+        return StationRegistry(stations)
+
+    @staticmethod
+    def load(extra_stations_file: str = None) -> 'StationRegistry':
+        """
+        :param extra_stations_file: file listing additional GHCN stations (defaults to WEATHERPRED_STATIONS)
+        :return: registry built from the downloaded station metadata
+        """
+        return StationRegistry.build(read_station_metadata(), read_extra_stations(extra_stations_file))
+
+    def __len__(self) -> int:
+        return len(self.stations)
+
+    def __contains__(self, code: str) -> bool:
+        return code in self.stations.index
+
+    def __iter__(self):
+        return iter(self.stations.index)
+
+    def codes(self) -> list:
+        """
+        :return: list of the station codes, forecast stations first
+        """
+        return list(self.stations.index)
+
+    def forecast_codes(self) -> list:
+        """
+        :return: list of the codes of the forecast stations, in submission order
+        """
+        return list(self.stations.index[self.stations["CITY"].notna()])
+
+    def ghcn_id(self, code: str) -> str:
+        """
+        :param code: station code
+        :return: GHCN ID of the station
+        """
+        return self.stations.at[code, "GHCN_ID"]
+
+    def shards(self, codes: list = None, size: int = None) -> list:
+        """
+        :param codes: station codes to split (all the stations if None)
+        :param size: number of stations per shard (defaults to WEATHERPRED_SHARD_SIZE)
+        :return: list of lists of station codes
+        """
+        codes = self.codes() if codes is None else list(codes)
+        size = size or shard_size
+        return [codes[i:i + size] for i in range(0, len(codes), size)]
+
+    def nearest(self, latitude: float, longitude: float, k: int = 1, max_km: float = None) -> list:
+        """
+        Closest stations to a location, among the stations with coordinates
+        :param latitude: latitude in degrees
+        :param longitude: longitude in degrees
+        :param k: number of stations
+        :param max_km: maximum great-circle distance in km
+        :return: list of (station code, distance in km), closest first
+        """
+        if self.tree is None:
+            from scipy.spatial import cKDTree
+            located = self.stations.dropna(subset=["LATITUDE", "LONGITUDE"])
+            self.tree = cKDTree(unit_vectors(located["LATITUDE"], located["LONGITUDE"]))
+            self.located = located.index.to_numpy()
+        k = min(k, len(self.located))
+        if k == 0:
+            return []
+        # the k-d tree returns chord distances on the unit sphere
+        chords, indices = self.tree.query(unit_vectors(latitude, longitude), k=k)
+        chords, indices = np.atleast_1d(chords), np.atleast_1d(indices)
+        distances = 2 * earth_radius * np.arcsin(np.minimum(chords / 2, 1.0))
+        return [(self.located[i], float(d)) for i, d in zip(indices, distances) if max_km is None or d <= max_km]
+
+    def neighbors(self, code: str, k: int = 5, max_km: float = None) -> list:
+        """
+        :param code: station code
+        :param k: number of neighbors
+        :param max_km: maximum great-circle distance in km
+        :return: list of (station code, distance in km) of the closest other stations
+        """
+        latitude, longitude = self.stations.at[code, "LATITUDE"], self.stations.at[code, "LONGITUDE"]
+        return [(other, d) for other, d in self.nearest(latitude, longitude, k + 1, max_km) if other != code][:k]
+
+    def station_features(self) -> pd.DataFrame:
+        """
+        :return: DataFrame indexed by station code with LATITUDE, LONGITUDE and ELEVATION (missing elevations are
+                 replaced by the mean elevation)
+        """
+        features = self.stations[["LATITUDE", "LONGITUDE", "ELEVATION"]].astype(float)
+        features["ELEVATION"] = features["ELEVATION"].fillna(features["ELEVATION"].mean())
+        return features
+
+
+# function to run a per-station function over shards of stations, with worker processes inside each shard
+def run_sharded(func, registry: StationRegistry, codes: list = None, jobs: int = None, size: int = None,
+                verbose: bool = True):
+    """
+    :param func: top-level function taking a station code (it must be importable by the worker processes)
+    :param registry: station registry
+    :param codes: station codes to process (all the stations if None)
+    :param jobs: number of worker processes (defaults to WEATHERPRED_JOBS, -1 for all cores); 1 runs in this process
+    :param size: number of stations per shard (defaults to WEATHERPRED_SHARD_SIZE)
+    :param verbose: print progress
+    :return: generator of (station code, result of func) in station order, one shard at a time
+    """
+    jobs = jobs or n_jobs
+    shards = registry.shards(codes, size)
+    for i, shard in enumerate(shards):
+        if verbose and len(shards) > 1:
+            print(f"Shard {i + 1}/{len(shards)}: {len(shard)} stations")
+        if jobs == 1:
+            results = map(func, shard)
+        else:
+            from joblib import Parallel, delayed
+            results = Parallel(n_jobs=jobs, backend="loky")(delayed(func)(code) for code in shard)
+        yield from zip(shard, results)
@@ -0,0 +1,113 @@
+# Storage backends for the intermediate tables of the pipeline
+# (converted NOAA data in raw_data/noaa/to_csv and feature-engineered data in processed_data)
+#
+# - "csv": plain text, as originally used by the pipeline
+# - "parquet": typed, compressed columnar files with column projection
+# - "feather": Arrow IPC files, uncompressed so they can be memory-mapped
+#
+# The format is chosen with the WEATHERPRED_STORAGE environment variable (set by the makefile's STORAGE variable).
+
+import os
+import pandas as pd
+
+# file extension of each storage format
+storage_extensions = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "feather": ".feather",
+}
+# format used when writing new tables
+storage_format = os.environ.get("WEATHERPRED_STORAGE", "parquet")
+if storage_format not in storage_extensions:
+    raise ValueError(f"Invalid storage format {storage_format}, expected one of {list(storage_extensions)}")
+
+
+# function to get the storage format of a file from its extension
+def format_of(path: str) -> str:
+    """
+    :param path: path to a table file
+    :return: storage format name
+    """
+    extension = os.path.splitext(path)[1]
+    for fmt, ext in storage_extensions.items():
+        if ext == extension:
+            return fmt
+    raise ValueError(f"Unknown table format for {path}")
+
+
+# function to build the path of a table in a directory
+def table_path(directory: str, name: str, fmt: str = None) -> str:
+    """
+    :param directory: directory of the table
+    :param name: table name without extension, e.g. the station code
+    :param fmt: storage format (defaults to storage_format)
+    :return: path to the table file
+    """
+    return os.path.join(directory, name + storage_extensions[fmt or storage_format])
+
+
+# function to list the tables of a directory
+def table_files(directory: str, fmt: str = None) -> list:
+    """
+    :param directory: directory to list
+    :param fmt: storage format of the tables to list (defaults to storage_format)
+    :return: sorted list of paths to the tables in the given format
+    """
+    extension = storage_extensions[fmt or storage_format]
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(extension))
+
+
+# function to read the column names of a table without loading its data
+def table_columns(path: str) -> list:
+    """
+    :param path: path to the table file
+    :return: list of column names in stored order
+    """
+    fmt = format_of(path)
+    if fmt == "csv":
+        return pd.read_csv(path, nrows=0).columns.tolist()
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+        return pq.read_schema(path).names
+    else:
+        import pyarrow.ipc as ipc
+        with ipc.open_file(path) as reader:
+            return reader.schema.names
+
+
+# function to read a table, optionally only some of its columns
+def read_table(path: str, columns: list = None, parse_dates: list = None) -> pd.DataFrame:
+    """
+    :param path: path to the table file
+    :param columns: columns to load (all columns if None)
+    :param parse_dates: columns to parse as dates, only needed for csv (the binary formats keep their types)
+    :return: DataFrame
+    """
+    fmt = format_of(path)
+    if fmt == "csv":
+        return pd.read_csv(path, usecols=columns, parse_dates=parse_dates)[columns] if columns \
+            else pd.read_csv(path, parse_dates=parse_dates)
+    elif fmt == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=columns, memory_map=True)
+    else:
+        import pyarrow.feather as feather
+        table = feather.read_table(path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+# function to write a table
+def write_table(df: pd.DataFrame, path: str) -> None:
+    """
+    :param df: DataFrame to write (the index is not stored)
+    :param path: path to the table file, its extension selects the format
+    :return: None
+    """
+    fmt = format_of(path)
+    if fmt == "csv":
+        df.to_csv(path, index=False)
+    elif fmt == "parquet":
+        df.to_parquet(path, index=False)
+    else:
+        # uncompressed so that the file can be memory-mapped without decoding
+        df.reset_index(drop=True).to_feather(path, compression="uncompressed")
@@ -0,0 +1,234 @@
+# compact, versioned artifact of a MultiStationModel: a directory with a JSON manifest and the fitted arrays of
+# each station model, in place of a pickle of the whole object
+#
+#   final_model/
+#       manifest.json       model name and parameters, feature order, per-station fit records and date ranges,
+#                           library versions
+#       stations/KBOI.npz   arrays of a station model, compressed
+#       stations/KBOI/      or one .npy file per array, uncompressed so that they are memory-mapped when loaded
+#
+# station models are rebuilt from their arrays only when they are first accessed, so a prediction for a few
+# stations only reads the files of those stations
+
+import os
+import json
+import platform
+from datetime import datetime, timezone
+from collections.abc import MutableMapping
+import numpy as np
+
+# version of the layout written by write_artifact, increased when readers of older versions would misread it
+artifact_format_version = 1
+manifest_name = "manifest.json"
+
+
+# function to list the versions of the libraries the artifact was written with
+def library_versions() -> dict:
+    """
+    :return: dictionary {library: version}
+    """
+    import sklearn
+    return {"python": platform.python_version(), "numpy": np.__version__, "scikit-learn": sklearn.__version__}
+
+
+# function to write a file atomically, so that readers (and memory maps) of the previous version stay valid
+def replace_file(path: str, write) -> None:
+    """
+    :param path: path of the file
+    :param write: function writing the content to an open binary file
+    :return: None
+    """
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+# function to write the arrays of a station model
+def write_station_arrays(path: str, station: str, arrays: dict, compress: bool) -> str:
+    """
+    :param path: artifact directory
+    :param station: station id
+    :param arrays: dictionary of arrays returned by the get_arrays method of the station model
+    :param compress: write one compressed .npz file instead of a directory of .npy files
+    :return: path of the written file or directory, relative to the artifact directory
+    """
+    if compress:
+        relative_path = os.path.join("stations", station + ".npz")
+        replace_file(os.path.join(path, relative_path), lambda f: np.savez_compressed(f, **arrays))
+    else:
+        relative_path = os.path.join("stations", station)
+        os.makedirs(os.path.join(path, relative_path), exist_ok=True)
+        for name, array in arrays.items():
+            replace_file(os.path.join(path, relative_path, name + ".npy"),
+                         lambda f: np.save(f, np.ascontiguousarray(array)))
+    return relative_path
+
+
+# function to read the arrays of a station model
+def read_station_arrays(path: str, mmap_mode: str = "r") -> dict:
+    """
+    :param path: path of the .npz file or of the directory of .npy files
+    :param mmap_mode: memory-map mode of the .npy files (None reads them into memory)
+    :return: dictionary of arrays
+    """
+    if os.path.isdir(path):
+        return {os.path.splitext(f)[0]: np.load(os.path.join(path, f), mmap_mode=mmap_mode)
+                for f in sorted(os.listdir(path)) if f.endswith(".npy")}
+    with np.load(path) as f:
+        return {name: f[name] for name in f.files}
+
+
+# function to convert a fit record to JSON
+def fit_info_to_json(info: dict) -> dict:
+    """
+    :param info: fit record (see models.model.fit_info)
+    :return: fit record with lists in place of the arrays
+    """
+    return {key: value.tolist() if isinstance(value, np.ndarray) else value for key, value in info.items()}
+
+
+# function to convert a fit record from JSON
+def fit_info_from_json(info: dict) -> dict:
+    """
+    :param info: fit record read from the manifest
+    :return: fit record with the feature statistics as arrays
+    """
+    return {key: np.asarray(value) if key in ["feature_means", "feature_stds"] else value
+            for key, value in info.items()}
+
+
+# function to convert the numpy scalars of the model parameters when writing JSON
+def json_default(value):
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+# function to read the manifest of an artifact
+def read_manifest(path: str) -> dict:
+    """
+    :param path: artifact directory
+    :return: manifest dictionary
+    """
+    with open(os.path.join(path, manifest_name)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version", 0) > artifact_format_version:
+        raise ValueError(f"Model artifact {path} has format version {manifest['format_version']}, "
+                         f"this version of the code reads up to {artifact_format_version}")
+    return manifest
+
+
+class LazyStationModels(MutableMapping):
+    """
+    Dictionary {station: station model} of an artifact, reading each station model on first access
+    """
+    def __init__(self, path: str, files: dict, restore, mmap_mode: str = "r", excluded: dict = None) -> None:
+        """
+        :param path: artifact directory
+        :param files: dictionary {station: path of its arrays relative to the artifact directory}
+        :param restore: function building the station model from its dictionary of arrays
+        :param mmap_mode: memory-map mode of the uncompressed arrays
+        :param excluded: manifest entries of the stations of the artifact that were not selected when loading,
+                         kept as they are when the model is saved back to the same directory
+        """
+        self.path = path
+        self.files = dict(files)
+        self.restore = restore
+        self.mmap_mode = mmap_mode
+        self.excluded = dict(excluded or {})
+        self.loaded = {}
+
+    def is_loaded(self, station: str) -> bool:
+        """
+        :return: whether the station model is in memory (read, or set since the artifact was loaded)
+        """
+        return station in self.loaded
+
+    def __getitem__(self, station: str):
+        if station not in self.loaded:
+            if station not in self.files:
+                raise KeyError(station)
+            arrays = read_station_arrays(os.path.join(self.path, self.files[station]), self.mmap_mode)
+            self.loaded[station] = self.restore(arrays)
+        return self.loaded[station]
+
+    def __setitem__(self, station: str, station_model) -> None:
+        self.loaded[station] = station_model
+
+    def __delitem__(self, station: str) -> None:
+        if station not in self:
+            raise KeyError(station)
+        self.loaded.pop(station, None)
+        self.files.pop(station, None)
+
+    def __contains__(self, station) -> bool:
+        # answered from the manifest, without reading the station model
+        return station in self.files or station in self.loaded
+
+    def __iter__(self):
+        yield from self.files
+        yield from (station for station in self.loaded if station not in self.files)
+
+    def __len__(self) -> int:
+        return len(self.files) + sum(station not in self.files for station in self.loaded)
+
+
+# function to write a model artifact
+def write_artifact(model, path: str, compress: bool = True, models=None, extra: dict = None) -> None:
+    """
+    Station models loaded lazily from this same directory and never accessed are kept as they are,
+    so saving after refitting a few stations only writes those stations
+    :param model: fitted MultiStationModel
+    :param path: artifact directory, created if needed
+    :param compress: store the arrays compressed (smaller) or uncompressed (memory-mapped when loaded)
+    :param models: dictionary {key: submodel} of the submodels to store (defaults to model.models)
+    :param extra: additional manifest entries
+    :return: None
+    """
+    os.makedirs(os.path.join(path, "stations"), exist_ok=True)
+    models = model.models if models is None else models
+    unchanged = isinstance(models, LazyStationModels) and os.path.abspath(models.path) == os.path.abspath(path)
+    # stations of the artifact left out when loading it are carried over
+    stations = {station: entry for station, entry in models.excluded.items() if station not in models} \
+        if unchanged else {}
+    for station in models:
+        if unchanged and not models.is_loaded(station):
+            relative_path = models.files[station]
+        else:
+            relative_path = write_station_arrays(path, station, models[station].get_arrays(), compress)
+        info = model.fit_info.get(station, {})
+        stations[station] = {
+            "file": relative_path,
+            "fit_seconds": model.fit_times.get(station),
+            "fit_info": fit_info_to_json(info),
+        }
+    first_dates = [s["fit_info"]["first_date"] for s in stations.values() if s["fit_info"].get("first_date")]
+    last_dates = [s["fit_info"]["last_date"] for s in stations.values() if s["fit_info"].get("last_date")]
+    manifest = {
+        "format_version": artifact_format_version,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "versions": library_versions(),
+        "model_name": model.model_name,
+        "kwargs": model.kwargs,
+        "feature_names": model.feature_names,
+        "first_date": min(first_dates, default=None),
+        "last_date": max(last_dates, default=None),
+        "stations": stations,
+        **(extra or {}),
+    }
+    # the manifest is written last: until then readers see the previous version of the artifact
+    replace_file(os.path.join(path, manifest_name),
+                 lambda f: f.write(json.dumps(manifest, indent=2, default=json_default).encode()))
+    # remove station files of previous versions (other stations, or the other compression)
+    referenced = {entry["file"] for entry in stations.values()}
+    for name in os.listdir(os.path.join(path, "stations")):
+        relative_path = os.path.join("stations", name)
+        if relative_path not in referenced:
+            full_path = os.path.join(path, relative_path)
+            if os.path.isdir(full_path):
+                for f in os.listdir(full_path):
+                    os.remove(os.path.join(full_path, f))
+                os.rmdir(full_path)
+            else:
+                os.remove(full_path)
@@ -1,19 +1,104 @@
 import os
+from functools import lru_cache
 import numpy as np
+import pandas as pd
+from data.feature_engineering import feature_float_dtype
+from data.storage import table_files
 from models.utils import folder_to_data_dict
-from models.model import MultiStationModel
+from models.model import MultiStationModel, make_station_model
+from models.registry import model_spec
+from models.modules.ridge_regression import RidgeGram
+from pipeline.dag import file_digest
+from pipeline.instrumentation import span
 
 # get current path, move up one directory, and then into the data folder
 in_data_filepath = os.path.join(os.path.dirname(__file__), "../../data/processed_data")
 # get current path, move up one directory, and then into the saved_models folder
 out_model_filepath = os.path.join(os.path.dirname(__file__), "../../saved_models/")
 
-# get the list of files in the data folder
-files = os.listdir(in_data_filepath)
-# remove any non-csv files and join the file names with the path
-files = [os.path.join(in_data_filepath, f) for f in files if f.endswith(".csv")]
-# construct the data dictionary
-data = folder_to_data_dict(files)
+# number of evaluation rows of each fold
+eval_length = 5
+# definition of the folds, part of the context of the stored search results: change the version when FoldIndex
+# changes
+fold_definition = {"scheme": "sliding", "eval_length": eval_length, "version": 1}
+
+
+class FoldIndex:
+    """
+    Row ranges of the sliding folds of one station: fold `shift` evaluates on the eval_length rows ending
+    `shift` rows before the end of the data and trains on all the rows before them
+    """
+    def __init__(self, n_rows: int, eval_length: int = eval_length) -> None:
+        """
+        :param n_rows: number of rows of the station data
+        :param eval_length: number of evaluation rows of each fold
+        """
+        self.n_rows = n_rows
+        self.eval_length = eval_length
+
+    def train(self, shift: int) -> slice:
+        """
+        :param shift: fold of the sliding cross-validation
+        :return: slice of the training rows
+        """
+        return slice(0, self.n_rows - self.eval_length - shift)
+
+    def eval(self, shift: int) -> slice:
+        """
+        :param shift: fold of the sliding cross-validation
+        :return: slice of the evaluation rows
+        """
+        return slice(self.n_rows - self.eval_length - shift, self.n_rows - shift)
+
+
+class StationArrays:
+    """
+    Features and targets of one station converted once to contiguous float32 arrays (the feature schema, see
+    data/feature_engineering.py); the folds are views
+    """
+    def __init__(self, X: pd.DataFrame, y: pd.DataFrame) -> None:
+        """
+        :param X: feature DataFrame
+        :param y: target DataFrame
+        """
+        self.X = np.ascontiguousarray(X, dtype=feature_float_dtype)
+        self.y = np.ascontiguousarray(y, dtype=feature_float_dtype)
+        self.columns = list(X.columns)
+        self.targets = list(y.columns)
+        self.folds = FoldIndex(len(self.X))
+
+    def split(self, shift: int) -> tuple:
+        """
+        Training and evaluation data of a fold, as DataFrames wrapping views of the arrays (nothing is copied)
+        :param shift: fold of the sliding cross-validation
+        :return: tuple ((X_train, y_train), (X_eval, y_eval))
+        """
+        return tuple(
+            (pd.DataFrame(self.X[rows], columns=self.columns, copy=False),
+             pd.DataFrame(self.y[rows], columns=self.targets, copy=False))
+            for rows in [self.folds.train(shift), self.folds.eval(shift)]
+        )
+
+
+@lru_cache(maxsize=None)
+def cv_data(data_filepath: str = None) -> dict:
+    """
+    Station data used by the cross-validation, read on first use and kept for the life of the process
+    :param data_filepath: folder of the processed station tables (defaults to in_data_filepath, read at the first call
+                          so that benchmarks can point it at synthetic data)
+    :return: dictionary {station_id: StationArrays}
+    """
+    data = folder_to_data_dict(table_files(data_filepath or in_data_filepath))
+    return {station: StationArrays(X, y) for station, (X, y) in data.items()}
+
+
+def search_context(data_filepath: str = None) -> dict:
+    """
+    What the cross-validation scores depend on, used to discard stored search results (see search.ResultsStore)
+    :param data_filepath: folder of the processed station tables (defaults to in_data_filepath)
+    :return: dictionary {data: digest of the processed tables, folds: fold_definition}
+    """
+    return {"data": file_digest(data_filepath or in_data_filepath), "folds": fold_definition}
 
 
 def sequential_cv(model_name, hyperparameters, shift) -> float:
@@ -24,44 +109,47 @@ def sequential_cv(model_name, hyperparameters, shift) -> float:
     print(hyperparameters)
     train_data = {}
     test_data = {}
-    for station in data:
-        X, y = data[station]
-        # get the all but the last 5 rows of the data
-        if shift == 0:
-            X_train = X.iloc[:-5]
-            y_train = y.iloc[:-5]
-            X_eval = X.iloc[-5:]
-            y_eval = y.iloc[-5:]
-        else:
-            X_train = X.iloc[:-(5 + shift)]
-            y_train = y.iloc[:-(5 + shift)]
-            X_eval = X.iloc[-(5 + shift):-shift]
-            y_eval = y.iloc[-(5 + shift):-shift]
-
-        # add to the training data
-        train_data[station] = (X_train, y_train)
-        # add to the evaluation data
-        test_data[station] = (X_eval, y_eval)
-
-    # initialize the model
-    if model_name == "random_forest":
-        model = MultiStationModel(model_name="random_forest",
-                                  n_estimators=hyperparameters["n_estimators"],
-                                  min_samples_leaf=hyperparameters["min_samples_leaf"],
-                                  max_features=hyperparameters["max_features"])
-    elif model_name == "ridge":
-        model = MultiStationModel(model_name="ridge",
-                                  alpha=hyperparameters["alpha"])
-    elif model_name == "gaussian_process":
-        model = MultiStationModel(model_name="gaussian_process",
-                                  length_scale=hyperparameters["length_scale"],
-                                  sigma=hyperparameters["sigma"],
-                                  kernel=hyperparameters["kernel"])
-    else:
-        raise Exception("Invalid model name")
-
-    model.fit(train_data)
-    return model.evaluate(test_data)
+    for station, arrays in cv_data().items():
+        # views of all but the last 5 + shift rows for training, and of the 5 rows after them for evaluation
+        train_data[station], test_data[station] = arrays.split(shift)
+
+    # initialize the model with the parameters of its family (see models/registry.py)
+    model = MultiStationModel(model_name=model_name, **model_spec(model_name).params(hyperparameters))
+
+    with span("cv_fold", model=model_name, fold=shift) as s:
+        model.fit(train_data)
+        s.add("configs", 1)
+        return model.evaluate(test_data)
+
+
+def warm_start_cv(model_name, hyperparameters, param, values, shift) -> list:
+    """
+    sequential_cv of a model for several values of its size parameter (warm_start_param of models/registry.py):
+    each station model is grown once through the sorted values and scored at each of them
+    :param model_name: name of a submodel with a grow(X, y, size) method
+    :param hyperparameters: dictionary of the other model parameters
+    :param param: name of the size parameter
+    :param values: values of the size parameter
+    :param shift: fold of the sliding cross-validation
+    :return: list of the MSE of each value, in the order of values
+    """
+    print("hyperparameters")
+    print({**hyperparameters, param: values})
+    sizes = sorted(set(values))
+    data = cv_data()
+    # errors[i]: sum over stations of the MSE at sizes[i], averaged like MultiStationModel.evaluate
+    errors = np.zeros(len(sizes))
+    with span("cv_fold", model=model_name, fold=shift) as s:
+        for station, arrays in data.items():
+            (X_train, y_train), (X_eval, y_eval) = arrays.split(shift)
+            station_model = make_station_model(model_name, **hyperparameters, **{param: sizes[0]})
+            with span("fit_station", station=station, model=model_name):
+                for i, size in enumerate(sizes):
+                    station_model.grow(X_train, y_train, size)
+                    errors[i] += station_model.evaluate(X_eval, y_eval)
+        s.add("configs", len(sizes))
+    mse = dict(zip(sizes, errors / len(data)))
+    return [mse[value].item() for value in values]
 
 
 def cv_slide(model_name, hyperparameters, cv_length):
@@ -70,3 +158,36 @@ def cv_slide(model_name, hyperparameters, cv_length):
     """
     sliding_mse = [sequential_cv(model_name, hyperparameters, shift=i) for i in range(cv_length)]
     return np.mean(sliding_mse).item()
+
+
+def ridge_cv_slide(alphas, cv_length):
+    """
+    Same folds and score as cv_slide(model_name="ridge", ...) for a whole grid of alphas.
+    Each station's training window is summarized once by a RidgeGram; moving to the next fold removes one
+    row with a rank-1 downdate, and one eigendecomposition per fold scores every alpha.
+    :param alphas: list of regularization strengths
+    :param cv_length: number of sliding folds
+    :return: list of the CV MSE of each alpha
+    """
+    alphas = np.asarray(alphas, dtype=float)
+    # mse[shift, a]: MSE of alpha a on fold shift, averaged over stations like MultiStationModel.evaluate
+    mse = np.zeros((cv_length, len(alphas)))
+    data = cv_data()
+    # the folds are interleaved station by station, so the whole slide is timed
+    with span("cv_slide", model="ridge") as s:
+        for arrays in data.values():
+            X, y, folds = arrays.X, arrays.y, arrays.folds
+            gram = RidgeGram(X[folds.train(0)], y[folds.train(0)])
+            for shift in range(cv_length):
+                if shift > 0:
+                    # the training window of this fold is the previous one without its last row
+                    removed = slice(folds.train(shift).stop, folds.train(shift - 1).stop)
+                    gram.remove_rows(X[removed], y[removed])
+                coefs, intercepts = gram.path(alphas)
+                X_eval, y_eval = X[folds.eval(shift)], y[folds.eval(shift)]
+                y_pred = X_eval @ coefs + intercepts[:, None, :]
+                mse[shift] += ((y_pred - y_eval) ** 2).mean(axis=(1, 2))
+        s.add("folds", cv_length)
+        s.add("configs", len(alphas))
+    mse /= len(data)
+    return mse.mean(axis=0).tolist()
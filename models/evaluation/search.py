@@ -0,0 +1,223 @@
+# hyperparameter search scheduler: runs (model, hyperparameters, fold) tasks on a process pool and
+# appends each result to a results store as soon as it completes, so an interrupted search resumes
+# where it stopped, as long as the training data and the folds are the same. Successive halving optionally
+# drops the worst configurations after a few folds.
+# The capabilities and cost hints of the model families come from models/registry.py.
+
+import os
+import json
+import math
+import time
+import pandas as pd
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+from models.registry import model_spec, plain_params
+
+
+# function to build the key identifying a task in the results store
+def task_key(model_name: str, hyperparameters: dict, fold: int) -> str:
+    """
+    :param model_name: name of the submodel
+    :param hyperparameters: dictionary of model parameters
+    :param fold: fold of the sliding cross-validation (the shift of cv_slide)
+    :return: string key, independent of the order of the hyperparameters
+    """
+    return json.dumps([model_name, hyperparameters, fold], sort_keys=True)
+
+
+# function run by the workers: score configurations on one fold
+def run_task_group(model_name: str, configs: list, fold: int, n_threads: int) -> list:
+    """
+    :param model_name: name of the submodel
+    :param configs: list of hyperparameter dictionaries; for models with a warm_start_param (see models/registry.py)
+                    they must only differ by this size parameter
+    :param fold: fold of the sliding cross-validation (the shift of cv_slide)
+    :param n_threads: number of BLAS/OpenMP threads the task may use
+    :return: list of result records {model_name, hyperparameters, fold, mse, seconds}, one per configuration
+    """
+    # imported here so that the parent process only loads the training data if it runs tasks itself
+    from models.evaluation.cross_validation import sequential_cv, warm_start_cv
+    start_time = time.time()
+    with threadpool_limits(limits=n_threads):
+        param = model_spec(model_name).warm_start_param
+        if param is not None:
+            # the configurations that only differ by the size are scored by growing one model per station
+            others = {name: value for name, value in configs[0].items() if name != param}
+            mses = warm_start_cv(model_name, others, param, [config[param] for config in configs], fold)
+        else:
+            mses = [sequential_cv(model_name, config, shift=fold) for config in configs]
+    # the time of a group is shared evenly between its configurations
+    seconds = (time.time() - start_time) / len(configs)
+    return [
+        {"model_name": model_name, "hyperparameters": config, "fold": fold, "mse": mse, "seconds": seconds}
+        for config, mse in zip(configs, mses)
+    ]
+
+
+class ResultsStore:
+    """
+    Append-only JSON lines file with one record per finished task, after a first line holding the context of the
+    results: the records are only reused while the context (e.g. the training data and the folds) is the same
+    """
+    def __init__(self, path: str, context: dict = None) -> None:
+        """
+        :param path: path to the results file, created on the first append
+        :param context: JSON serializable description of what the results depend on, e.g. a digest of the training
+                        data and the fold definition; a file written with another context is discarded
+        """
+        self.path = path
+        self.context = context
+        self.results = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                header = f.readline()
+                try:
+                    stored_context = json.loads(header).get("context")
+                except (json.JSONDecodeError, AttributeError):
+                    stored_context = None
+                if stored_context == context:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            # last line cut short by a crash: the task is run again
+                            continue
+                        self.results[task_key(record["model_name"], record["hyperparameters"], record["fold"])] = record
+            if stored_context != context:
+                # results of other data or folds (or of a file without context): the search starts over
+                print(f"Discarding the results of {path}, computed with another context")
+                os.remove(path)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.results
+
+    def get(self, model_name: str, hyperparameters: dict, fold: int) -> dict:
+        """
+        :return: result record of the task, None if it has not run
+        """
+        return self.results.get(task_key(model_name, hyperparameters, fold))
+
+    def append(self, record: dict) -> None:
+        """
+        Persist a result record before anything else happens
+        :param record: result record returned by run_task_group
+        :return: None
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        new_file = not os.path.exists(self.path)
+        with open(self.path, "a") as f:
+            if new_file:
+                f.write(json.dumps({"context": self.context}) + "\n")
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.results[task_key(record["model_name"], record["hyperparameters"], record["fold"])] = record
+
+
+class SearchScheduler:
+    def __init__(self, store: ResultsStore, n_jobs: int = 1, halving_eta: int = None, min_folds: int = 2,
+                 verbose: bool = True) -> None:
+        """
+        :param store: results store shared by all the searches
+        :param n_jobs: number of worker processes (-1 for all cores); 1 runs the tasks in this process
+        :param halving_eta: successive halving factor: after each rung only the best 1/eta configurations are
+                            evaluated on eta times more folds. None evaluates every configuration on every fold
+        :param min_folds: number of folds of the first rung of successive halving
+        :param verbose: print progress
+        """
+        self.store = store
+        self.n_jobs = n_jobs
+        self.halving_eta = halving_eta
+        self.min_folds = min_folds
+        self.verbose = verbose
+
+    def rungs(self, cv_length: int) -> list:
+        """
+        Number of folds evaluated at each rung of successive halving
+        :param cv_length: total number of folds
+        :return: increasing list of fold counts ending with cv_length
+        """
+        if not self.halving_eta or cv_length <= self.min_folds:
+            return [cv_length]
+        rungs = [self.min_folds]
+        while rungs[-1] * self.halving_eta < cv_length:
+            rungs.append(rungs[-1] * self.halving_eta)
+        return rungs + [cv_length]
+
+    def run_tasks(self, tasks: list) -> None:
+        """
+        Run the (model_name, hyperparameters, fold) tasks missing from the store and persist each result
+        :param tasks: list of tasks
+        :return: None
+        """
+        tasks = [task for task in tasks if task_key(*task) not in self.store]
+        if not tasks:
+            return
+        # one group per fold and configuration up to the warm start parameter
+        groups = {}
+        for model_name, config, fold in tasks:
+            param = model_spec(model_name).warm_start_param
+            others = {name: value for name, value in config.items() if name != param}
+            groups.setdefault(task_key(model_name, others, fold), (model_name, [], fold))[1].append(config)
+        # most expensive groups first, so that the cheap ones fill the workers at the end instead of one long group
+        # running alone; a warm start group costs about as much as its largest configuration
+        groups = sorted(groups.values(),
+                        key=lambda group: -max(model_spec(group[0]).cost(config) for config in group[1]))
+        n_workers = min(os.cpu_count() if self.n_jobs < 0 else self.n_jobs, len(groups))
+        n_threads = max(1, os.cpu_count() // n_workers)
+        if n_workers == 1:
+            results = (run_task_group(*group, n_threads) for group in groups)
+        else:
+            # results come back in completion order so that each one is stored as soon as it is available
+            results = Parallel(n_jobs=n_workers, backend="loky", return_as="generator_unordered")(
+                delayed(run_task_group)(*group, n_threads) for group in groups
+            )
+        n_done = 0
+        for records in results:
+            for record in records:
+                self.store.append(record)
+                n_done += 1
+                if self.verbose:
+                    print(f"[{n_done}/{len(tasks)}] {record['model_name']} {record['hyperparameters']} "
+                          f"fold {record['fold']}: MSE {record['mse']:.4f} in {record['seconds']:.1f} seconds")
+
+    def run(self, model_name: str, grid: pd.DataFrame, cv_length: int) -> pd.DataFrame:
+        """
+        Score every configuration of a grid with the sliding cross-validation of cv_slide
+        :param model_name: name of the submodel
+        :param grid: DataFrame with one configuration per row and one column per hyperparameter
+        :param cv_length: number of sliding folds
+        :return: copy of grid with the columns MSE (mean over the evaluated folds), folds (number of evaluated
+                 folds) and pruned (dropped by successive halving before the last rung)
+        """
+        configs = [plain_params(row) for row in grid.to_dict("records")]
+        alive = list(range(len(configs)))
+        for rung, n_folds in enumerate(self.rungs(cv_length)):
+            self.run_tasks([(model_name, configs[i], fold) for i in alive for fold in range(n_folds)])
+            if n_folds < cv_length:
+                # promote the best configurations to the next rung
+                scores = {i: self.mean_mse(model_name, configs[i], n_folds) for i in alive}
+                n_keep = max(1, math.ceil(len(alive) / self.halving_eta))
+                alive = sorted(alive, key=lambda i: scores[i])[:n_keep]
+
+        out = grid.copy()
+        folds = [self.evaluated_folds(model_name, config, cv_length) for config in configs]
+        out["MSE"] = [self.mean_mse(model_name, config, n) for config, n in zip(configs, folds)]
+        out["folds"] = folds
+        out["pruned"] = [n < cv_length for n in folds]
+        return out
+
+    def evaluated_folds(self, model_name: str, hyperparameters: dict, cv_length: int) -> int:
+        """
+        :return: number of leading folds of the configuration found in the store
+        """
+        n = 0
+        while n < cv_length and self.store.get(model_name, hyperparameters, n) is not None:
+            n += 1
+        return n
+
+    def mean_mse(self, model_name: str, hyperparameters: dict, n_folds: int) -> float:
+        """
+        :return: mean MSE of the configuration over its first n_folds folds
+        """
+        return sum(self.store.get(model_name, hyperparameters, fold)["mse"] for fold in range(n_folds)) / n_folds
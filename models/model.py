@@ -1,14 +1,104 @@
 # class that takes a model from modules folder and creates a
 # model object that consists of multiple base models one for each weather station
 
+import os
 import numpy as np
-from models.modules.ridge_regression import RidgeRegressor
-from models.modules.random_forest import RandomForest
-from models.modules.gaussian_process import GaussianProcess
+import pandas as pd
+from datetime import datetime, timezone
+from threadpoolctl import threadpool_limits
+from data.feature_engineering import feature_float_dtype
+from models.artifact import LazyStationModels, fit_info_from_json, read_manifest, write_artifact
+from models.registry import model_spec
 import pickle
-import time
+from functools import partial
+from pipeline.instrumentation import span
+
+
+def make_station_model(model_name: str, **kwargs):
+    """
+    Construct an unfitted submodel, only the module of its family is imported (see models/registry.py)
+    :param model_name: name of the submodel
+    :param kwargs: dictionary of model parameters
+    :return: submodel
+    """
+    return model_spec(model_name).make(**kwargs)
+
+
+def restore_station_model(model_name: str, kwargs: dict, feature_names: list, arrays: dict):
+    """
+    Rebuild a fitted submodel from the arrays stored in a model artifact
+    :param model_name: name of the submodel
+    :param kwargs: dictionary of model parameters
+    :param feature_names: feature columns the submodel was fitted on
+    :param arrays: dictionary of arrays returned by the get_arrays method of the submodel
+    :return: submodel
+    """
+    return make_station_model(model_name, **kwargs).set_arrays(arrays, feature_names)
+
+
+def data_range(X: pd.DataFrame) -> tuple:
+    """
+    Dates of the first and last training rows, rebuilt from the YEAR and DAY_OF_YEAR features
+    :param X: feature DataFrame
+    :return: tuple of ISO dates (first, last), (None, None) if the features do not identify dates
+    """
+    if len(X) == 0 or 'YEAR' not in X.columns or 'DAY_OF_YEAR' not in X.columns:
+        return None, None
+    dates = [
+        (datetime(int(X['YEAR'].iloc[i]), 1, 1) + pd.Timedelta(days=int(X['DAY_OF_YEAR'].iloc[i]) - 1)).date().isoformat()
+        for i in [0, -1]
+    ]
+    return dates[0], dates[1]
+
+
+def fit_info(X: pd.DataFrame, fit_time: float) -> dict:
+    """
+    Record of a submodel fit, stored in the model artifact
+    :param X: feature DataFrame the submodel was fitted on
+    :param fit_time: fit time in seconds
+    :return: dictionary {fitted_at, fit_seconds, n_samples, first_date, last_date, feature_means, feature_stds}
+    """
+    first_date, last_date = data_range(X)
+    values = np.asarray(X, dtype=float)
+    return {
+        "fitted_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "fit_seconds": fit_time,
+        "n_samples": len(X),
+        "first_date": first_date,
+        "last_date": last_date,
+        # training distribution of the features, used to detect drift (see models/retrain.py)
+        "feature_means": values.mean(axis=0),
+        "feature_stds": values.std(axis=0),
+    }
+
+
+def fit_station_model(model_name: str, kwargs: dict, X: np.ndarray, y: np.ndarray, columns: list,
+                      targets: list, n_threads: int, station: str = None) -> tuple:
+    """
+    Fit one submodel, used by the parallel fit of MultiStationModel
+    :param model_name: name of the submodel
+    :param kwargs: dictionary of model parameters
+    :param X: array of shape (n_samples, n_features), possibly a read-only memmap shared with the parent
+    :param y: array of shape (n_samples, 15)
+    :param columns: feature names of X
+    :param targets: target names of y
+    :param n_threads: number of BLAS/OpenMP threads the submodel may use
+    :param station: station of the data, recorded in the fit_station span
+    :return: tuple (fitted submodel, fit time in seconds)
+    """
+    station_model = make_station_model(model_name, **kwargs)
+    # wrap the shared arrays without copying so the submodel keeps the feature names
+    X = pd.DataFrame(X, columns=columns, copy=False)
+    y = pd.DataFrame(y, columns=targets, copy=False)
+    with span("fit_station", station=station, model=model_name) as s, threadpool_limits(limits=n_threads):
+        station_model.fit(X, y)
+        s.add("samples", len(X))
+    return station_model, s.seconds
 
 class MultiStationModel:
+    # one submodel per station: a station can be refitted on its own data only
+    pooled = False
+
     def __init__(self, model_name: str, **kwargs) -> None:
         """
         Initialize the model
@@ -18,29 +108,60 @@ class MultiStationModel:
         self.model_name = model_name
         self.models = {}
         self.kwargs = kwargs
+        self.fit_times = {}
+        # feature columns, in the order the submodels expect them
+        self.feature_names = None
+        # per-station record of the last fit: when, on how many rows and on which date range
+        self.fit_info = {}
 
-    def fit(self, data: dict, verbose: bool = True) -> None:
+    def fit(self, data: dict, verbose: bool = True, n_jobs: int = 1) -> None:
         """
         Fit the submodels to the data
         :param verbose:
         :param data: dictionary of tuples {station_s: (X_s, y_s) for s in stations}
+        :param n_jobs: number of worker processes fitting stations in parallel (-1 for all cores); 1 fits the
+                       stations one after another in this process
         :return: None
         """
-        for station, (X, y) in data.items():
-            if self.model_name == 'ridge':
-                station_model = RidgeRegressor(**self.kwargs)
-            elif self.model_name == 'random_forest':
-                station_model = RandomForest(**self.kwargs)
-            elif self.model_name == 'gaussian_process':
-                station_model = GaussianProcess(**self.kwargs)
-            else:
-                raise ValueError('Invalid name')
-            # time to fit the model
-            start_time = time.time()
-            station_model.fit(X, y)
-            if verbose:
-                print(f"{self.model_name} Model for station {station} fitted in {time.time() - start_time} seconds")
+        if data:
+            self.feature_names = list(next(iter(data.values()))[0].columns)
+        with span("fit", model=self.model_name) as s:
+            s.add("stations", len(data))
+            if n_jobs == 1:
+                for station, (X, y) in data.items():
+                    station_model = make_station_model(self.model_name, **self.kwargs)
+                    # time to fit the model
+                    with span("fit_station", station=station, model=self.model_name) as station_span:
+                        station_model.fit(X, y)
+                        station_span.add("samples", len(X))
+                    self.fit_times[station] = station_span.seconds
+                    self.fit_info[station] = fit_info(X, self.fit_times[station])
+                    if verbose:
+                        print(f"{self.model_name} Model for station {station} fitted in {self.fit_times[station]} seconds")
+                    self.models[station] = station_model
+                return
+
+            # share the cores between the workers so that BLAS/OpenMP threads inside the submodels do not oversubscribe
+            n_workers = min(os.cpu_count() if n_jobs < 0 else n_jobs, len(data))
+            n_threads = max(1, os.cpu_count() // n_workers)
+            from joblib import Parallel, delayed
+            # contiguous arrays larger than 1MB are memory-mapped by joblib instead of being copied to the workers;
+            # they keep the float32 of the feature schema (see data/feature_engineering.py)
+            results = Parallel(n_jobs=n_workers, backend="loky", max_nbytes="1M", mmap_mode="r")(
+                delayed(fit_station_model)(
+                    self.model_name, self.kwargs,
+                    np.ascontiguousarray(X, dtype=feature_float_dtype),
+                    np.ascontiguousarray(y, dtype=feature_float_dtype),
+                    list(X.columns), list(y.columns), n_threads, station
+                )
+                for station, (X, y) in data.items()
+            )
+        for (station, (X, y)), (station_model, fit_time) in zip(data.items(), results):
             self.models[station] = station_model
+            self.fit_times[station] = fit_time
+            self.fit_info[station] = fit_info(X, fit_time)
+            if verbose:
+                print(f"{self.model_name} Model for station {station} fitted in {fit_time} seconds")
 
     def predict(self, X: dict) -> dict:
         """
@@ -50,7 +171,64 @@ class MultiStationModel:
         """
         y_pred = {}
         for station, model in self.models.items():
-            y_pred[station] = model.predict(X[station])
+            with span("predict_station", station=station, model=self.model_name) as s:
+                y_pred[station] = model.predict(X[station])
+                s.add("rows", len(X[station]))
+        return y_pred
+
+    def stack_features(self, X: dict, stations: list, n_dates: int = 1) -> np.ndarray:
+        """
+        Stack the last feature rows of each station into the input of predict_batch
+        :param X: dictionary of input data {station_s: X_s for s in stations}
+        :param stations: stations in output order; stations missing from X get NaN rows
+        :param n_dates: number of trailing rows taken from each station
+        :return: array of shape (len(stations), n_dates, n_features)
+        """
+        columns = self.feature_names or list(next(iter(X.values())).columns)
+        batch = np.full((len(stations), n_dates, len(columns)), np.nan)
+        for i, station in enumerate(stations):
+            if station in X:
+                rows = X[station][columns].to_numpy(dtype=float)[-n_dates:]
+                batch[i, n_dates - len(rows):] = rows
+        return batch
+
+    def predict_batch(self, X: np.ndarray, stations: list) -> np.ndarray:
+        """
+        Predict the targets of many stations and dates in one call
+        :param X: array of shape (n_stations, n_dates, n_features), features in the order of feature_names
+        :param stations: station of each slice of X
+        :return: array of shape (n_stations, n_dates, 15); NaN for stations without a model or with missing features
+        """
+        X = np.asarray(X, dtype=float)
+        if not self.models:
+            # e.g. an artifact loaded for stations it does not hold
+            return np.full(X.shape[:2] + (15,), np.nan)
+        if model_spec(self.model_name).batched_predict:
+            # one batched matmul over the stacked coefficients of all stations, timed as a whole
+            with span("predict_batch", model=self.model_name) as s:
+                n_targets = next(iter(self.models.values())).coefficients()[0].shape[0]
+                coefs = np.zeros((len(stations), n_targets, X.shape[2]))
+                intercepts = np.full((len(stations), n_targets), np.nan)
+                for i, station in enumerate(stations):
+                    if station in self.models:
+                        coefs[i], intercepts[i] = self.models[station].coefficients()
+                s.add("rows", X.shape[0] * X.shape[1])
+                return np.matmul(X, coefs.transpose(0, 2, 1)) + intercepts[:, None, :]
+
+        y_pred = None
+        for i, station in enumerate(stations):
+            complete = ~np.isnan(X[i]).any(axis=1)
+            if station not in self.models or not complete.any():
+                continue
+            X_station = pd.DataFrame(X[i][complete], columns=self.feature_names)
+            with span("predict_station", station=station, model=self.model_name) as s:
+                station_pred = self.models[station].predict(X_station)
+                s.add("rows", len(X_station))
+            if y_pred is None:
+                y_pred = np.full(X.shape[:2] + station_pred.shape[1:], np.nan)
+            y_pred[i, complete] = station_pred
+        if y_pred is None:
+            y_pred = np.full(X.shape[:2] + (15,), np.nan)
         return y_pred
 
     def evaluate(self, data: dict) -> float:
@@ -80,22 +258,52 @@ class MultiStationModel:
         self.kwargs = params
         return self
 
-    def save(self, path: str) -> None:
+    def save(self, path: str, compress: bool = True) -> None:
         """
-        Save the model to a file
-        :param path: path to the file
+        Save the model as a directory artifact (see models/artifact.py), or as a pickle if path ends with .pkl
+        :param path: path to the artifact directory or to the pickle file
+        :param compress: store the station arrays compressed, or uncompressed so that they are memory-mapped when
+                         loaded (artifact only)
         :return: None
         """
-        with open(path, 'wb') as f:
-            # noinspection PyTypeChecker
-            pickle.dump(self, f)
+        if path.endswith('.pkl'):
+            with open(path, 'wb') as f:
+                # noinspection PyTypeChecker
+                pickle.dump(self, f)
+            return
+        write_artifact(self, path, compress=compress)
 
     @staticmethod
-    def load(path: str) -> 'MultiStationModel':
+    def load(path: str, stations: list = None, mmap_mode: str = 'r') -> 'MultiStationModel':
         """
-        Load the model from a file
-        :param path: path to the file
+        Load the model from an artifact directory or a pickle file
+        :param path: path to the artifact directory or to the pickle file
+        :param stations: stations to load from an artifact (all if None); station models are only read when
+                         first used
+        :param mmap_mode: memory-map mode of the uncompressed station arrays of an artifact
         :return: model object
         """
+        if os.path.isdir(path):
+            manifest = read_manifest(path)
+            if 'pooled' in manifest:
+                from models.pooled import PooledModel
+                return PooledModel.from_artifact(path, manifest, stations=stations, mmap_mode=mmap_mode)
+            model = MultiStationModel(manifest['model_name'], **manifest['kwargs'])
+            model.feature_names = manifest['feature_names']
+            entries = {station: entry for station, entry in manifest['stations'].items()
+                       if stations is None or station in stations}
+            excluded = {station: entry for station, entry in manifest['stations'].items() if station not in entries}
+            model.fit_times = {station: entry['fit_seconds'] for station, entry in entries.items()}
+            model.fit_info = {station: fit_info_from_json(entry['fit_info'])
+                              for station, entry in entries.items() if entry['fit_info']}
+            restore = partial(restore_station_model, model.model_name, model.kwargs, model.feature_names)
+            model.models = LazyStationModels(path, {station: entry['file'] for station, entry in entries.items()},
+                                             restore, mmap_mode=mmap_mode, excluded=excluded)
+            return model
         with open(path, 'rb') as f:
-            return pickle.load(f)
+            model = pickle.load(f)
+        # models saved before fits were recorded
+        model.__dict__.setdefault('fit_times', {})
+        model.__dict__.setdefault('fit_info', {})
+        model.__dict__.setdefault('feature_names', None)
+        return model
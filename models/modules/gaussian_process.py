@@ -1,22 +1,205 @@
 # base model: Gaussian Process Regression
 # for each weather station, we train a separate base model that predicts 5 days of TMIN, TMAX, and TAVG
 # hyperparameter length_scale and noise_level are tuned by cross-validation
+# the exact GP costs O(n^3) time and O(n^2) memory in the number of training days; the approximate engines
+# (Nystroem inducing points or random Fourier features) cost O(n m^2) time and O(n m) memory for m components
 import numpy as np
 from sklearn.gaussian_process import GaussianProcessRegressor
 from sklearn.gaussian_process.kernels import RBF, WhiteKernel, Matern, Sum
 
+
+class ApproximateGP:
+    def __init__(self, kernel: str = 'rbf', length_scale: float = 1.0, sigma: float = 10e-6,
+                 approximation: str = 'nystroem', n_components: int = 500, random_state: int = 604) -> None:
+        """
+        GP posterior mean computed on a low-rank approximation of the kernel, with fixed hyperparameters
+        (unlike GaussianProcessRegressor, which tunes them by maximizing the marginal likelihood).
+        The features are standardized with the training means and standard deviations, so length_scale is in
+        standard deviations, and the prior mean is the training mean of each target.
+        :param kernel: kernel function, 'rbf' or 'matern' (nu = 1.5)
+        :param length_scale: length scale
+        :param sigma: noise level
+        :param approximation: 'nystroem' (kernel on m training days drawn as inducing points) or
+                              'rff' (m random Fourier features)
+        :param n_components: number of inducing points or random features m
+        :param random_state: seed of the inducing points or random features
+        """
+        if kernel not in ['rbf', 'matern']:
+            raise ValueError('Invalid kernel function')
+        if approximation not in ['nystroem', 'rff']:
+            raise ValueError('Invalid approximation')
+        self.kernel = kernel
+        self.length_scale = length_scale
+        self.sigma = sigma
+        self.approximation = approximation
+        self.n_components = n_components
+        self.random_state = random_state
+
+    def kernel_function(self):
+        """
+        :return: sklearn kernel object computing the kernel matrix between two sets of rows
+        """
+        if self.kernel == 'rbf':
+            return RBF(self.length_scale)
+        return Matern(length_scale=self.length_scale, nu=1.5)
+
+    def fit_components(self, X: np.ndarray) -> None:
+        """
+        draw the inducing points or the random frequencies
+        :param X: standardized array of shape (n_samples, n_features)
+        :return: None
+        """
+        rng = np.random.default_rng(self.random_state)
+        m = self.n_components
+        if self.approximation == 'nystroem':
+            self.inducing_points_ = X[np.sort(rng.choice(len(X), size=min(m, len(X)), replace=False))]
+            # K_mm^(-1/2), dropping the directions of numerically zero eigenvalues
+            eigenvalues, eigenvectors = np.linalg.eigh(self.kernel_function()(self.inducing_points_))
+            keep = eigenvalues > eigenvalues.max() * 1e-10
+            self.normalization_ = eigenvectors[:, keep] / np.sqrt(eigenvalues[keep])
+        else:
+            # frequencies drawn from the spectral density of the kernel: Gaussian for RBF, Student t with
+            # 2 nu = 3 degrees of freedom for Matern 1.5
+            frequencies = rng.standard_normal((X.shape[1], m))
+            if self.kernel == 'matern':
+                frequencies *= np.sqrt(3 / rng.chisquare(3, size=m))
+            self.frequencies_ = frequencies / self.length_scale
+            self.phases_ = rng.uniform(0, 2 * np.pi, size=m)
+
+    def features(self, X: np.ndarray) -> np.ndarray:
+        """
+        map the rows to the feature space whose inner products approximate the kernel
+        :param X: standardized array of shape (n_samples, n_features)
+        :return: array of shape (n_samples, m)
+        """
+        if self.approximation == 'nystroem':
+            return self.kernel_function()(X, self.inducing_points_) @ self.normalization_
+        return np.sqrt(2 / self.n_components) * np.cos(X @ self.frequencies_ + self.phases_)
+
+    def fit(self, X: np.ndarray, y: np.ndarray) -> None:
+        """
+        fit the model that predicts the 15 target variables
+        :param X: array-like of shape (n_samples, n_features)
+        :param y: array-like of shape (n_samples, 15)
+        :return: None
+        """
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float)
+        self.x_mean_ = X.mean(axis=0)
+        # constant features (e.g. YEAR over a short history) are left unscaled
+        self.x_scale_ = np.where(X.std(axis=0) > 0, X.std(axis=0), 1.0)
+        self.y_mean_ = y.mean(axis=0)
+        X = (X - self.x_mean_) / self.x_scale_
+        self.fit_components(X)
+        phi = self.features(X)
+        # posterior mean of the GP with the approximate kernel phi phi^T + sigma I, solved in the m-dimensional
+        # feature space: weights = (phi^T phi + sigma I)^(-1) phi^T (y - y_mean)
+        gram = phi.T @ phi
+        gram[np.diag_indices_from(gram)] += self.sigma
+        self.weights_ = np.linalg.solve(gram, phi.T @ (y - self.y_mean_))
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        predict the target
+        :param X: array-like of shape (n_samples, n_features)
+        :return: array of shape (n_samples, 15)
+        """
+        X = (np.asarray(X, dtype=float) - self.x_mean_) / self.x_scale_
+        return self.features(X) @ self.weights_ + self.y_mean_
+
+    def get_arrays(self) -> dict:
+        """
+        fitted arrays of the approximation
+        :return: dictionary of arrays
+        """
+        names = ['x_mean', 'x_scale', 'y_mean', 'weights']
+        names += ['inducing_points', 'normalization'] if self.approximation == 'nystroem' else ['frequencies', 'phases']
+        return {name: getattr(self, name + '_') for name in names}
+
+    def set_arrays(self, arrays: dict) -> 'ApproximateGP':
+        """
+        restore the fitted arrays of get_arrays
+        :param arrays: dictionary of arrays, possibly memory-mapped
+        :return: ApproximateGP
+        """
+        for name, value in arrays.items():
+            setattr(self, name + '_', value)
+        return self
+
+    def get_params(self) -> dict:
+        """
+        get the model parameters
+        :return: dict
+        """
+        return {'kernel': self.kernel, 'length_scale': self.length_scale, 'sigma': self.sigma,
+                'approximation': self.approximation, 'n_components': self.n_components,
+                'random_state': self.random_state}
+
+    def set_params(self, **params) -> 'ApproximateGP':
+        """
+        set model parameters, the model has to be fitted again
+        :param params: dict
+        :return: ApproximateGP
+        """
+        for name, value in params.items():
+            setattr(self, name, value)
+        return self
+
+
+class ExactGPArrays:
+    """
+    Posterior mean of a fitted GaussianProcessRegressor rebuilt from its training rows and weights
+    """
+    def __init__(self, kernel: str, arrays: dict, params: dict) -> None:
+        """
+        :param kernel: kernel function, 'rbf' or 'matern'
+        :param arrays: dictionary of arrays of GaussianProcess.get_arrays, possibly memory-mapped
+        :param params: GaussianProcessRegressor parameters, returned by get_params
+        """
+        # the stored length scale is an array (memory-mapped when not compressed), the kernels take a float
+        length_scale = np.asarray(arrays['length_scale']).item()
+        self.kernel = RBF(length_scale) if kernel == 'rbf' else Matern(length_scale=length_scale)
+        self.x_train = arrays['x_train']
+        self.alpha = arrays['alpha']
+        self.y_train_mean = arrays['y_train_mean']
+        self.y_train_std = arrays['y_train_std']
+        self.arrays = {name: arrays[name] for name in
+                       ['x_train', 'alpha', 'y_train_mean', 'y_train_std', 'length_scale']}
+        self.params = params
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        :param X: array-like of shape (n_samples, n_features)
+        :return: array of shape (n_samples, 15)
+        """
+        # the white noise term of the fitted kernel is zero between distinct rows, so it is left out
+        y_mean = self.kernel(np.asarray(X, dtype=float), self.x_train) @ self.alpha
+        return self.y_train_std * y_mean + self.y_train_mean
+
+    def get_params(self) -> dict:
+        return self.params
+
+
 class GaussianProcess:
-    def __init__(self, kernel: str = 'rbf', length_scale: float = 1.0, sigma: float = 10e-6) -> None:
+    def __init__(self, kernel: str = 'rbf', length_scale: float = 1.0, sigma: float = 10e-6,
+                 approximation: str = None, n_components: int = 500) -> None:
         """
         initialize the model
         :param kernel: kernel function
         :param length_scale: length scale
         :param sigma: noise level
+        :param approximation: None for the exact GP, 'nystroem' or 'rff' for an ApproximateGP
+        :param n_components: number of inducing points or random features of the approximation
         """
         self.kernel = kernel
         self.sigma = sigma
         self.length_scale = length_scale
-        if self.kernel == 'rbf':
+        self.approximation = approximation
+        self.n_components = n_components
+        if self.approximation is not None:
+            self.model = ApproximateGP(kernel=self.kernel, length_scale=self.length_scale, sigma=self.sigma,
+                                       approximation=self.approximation, n_components=self.n_components)
+        elif self.kernel == 'rbf':
             sum_kernel = Sum(RBF(self.length_scale), WhiteKernel(noise_level=self.sigma))
             self.model = GaussianProcessRegressor(kernel=sum_kernel)
         elif self.kernel == 'matern':
@@ -43,6 +226,39 @@ class GaussianProcess:
         # round to 2 decimal places
         return self.model.predict(X).round(2)
 
+    def get_arrays(self) -> dict:
+        """
+        fitted parameters as arrays, stored in the model artifact (see models/artifact.py)
+        :return: dictionary of arrays: training rows, weights, target scaling and fitted length scale for the
+                 exact GP, the fitted approximation otherwise
+        """
+        if self.approximation is not None:
+            return self.model.get_arrays()
+        # a restored exact GP already holds them
+        if isinstance(self.model, ExactGPArrays):
+            return self.model.arrays
+        return {
+            'x_train': np.asarray(self.model.X_train_, dtype=float),
+            'alpha': self.model.alpha_,
+            'y_train_mean': np.asarray(self.model._y_train_mean, dtype=float),
+            'y_train_std': np.asarray(self.model._y_train_std, dtype=float),
+            # the optimizer tunes the length scale of the first kernel of the sum
+            'length_scale': np.asarray(self.model.kernel_.k1.length_scale, dtype=float),
+        }
+
+    def set_arrays(self, arrays: dict, feature_names: list = None) -> 'GaussianProcess':
+        """
+        restore the fitted model from the arrays of get_arrays
+        :param arrays: dictionary of arrays, possibly memory-mapped
+        :param feature_names: feature columns the model was fitted on (unused, the columns are taken in order)
+        :return: GaussianProcess
+        """
+        if self.approximation is not None:
+            self.model.set_arrays(arrays)
+        else:
+            self.model = ExactGPArrays(self.kernel, arrays, self.model.get_params())
+        return self
+
     def evaluate(self, X: np.ndarray, y: np.ndarray) -> float:
         """
         return the MSE of the model on the given data
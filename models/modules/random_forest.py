@@ -5,6 +5,51 @@
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
 
+class ForestArrays:
+    """
+    Fitted forest rebuilt from flat node arrays, predicting like RandomForestRegressor without depending on the
+    internals of the sklearn version that fitted it
+    """
+    def __init__(self, arrays: dict, params: dict) -> None:
+        """
+        :param arrays: dictionary of arrays of RandomForest.get_arrays, possibly memory-mapped
+        :param params: RandomForestRegressor parameters, returned by get_params
+        """
+        self.roots = arrays['roots']
+        self.children_left = arrays['children_left']
+        self.children_right = arrays['children_right']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.leaf_values = arrays['leaf_values']
+        self.arrays = {name: arrays[name] for name in
+                       ['roots', 'children_left', 'children_right', 'feature', 'threshold', 'leaf_values']}
+        # row of leaf_values of each node (only meaningful for leaves)
+        self.leaf_rows = np.cumsum(self.children_left < 0) - 1
+        self.params = params
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        :param X: array-like of shape (n_samples, n_features)
+        :return: array of shape (n_samples, 15), mean of the leaf values reached in each tree
+        """
+        # the trees split float32 features, like sklearn does
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        # walk every (row, tree) pair down one level at a time
+        nodes = np.repeat(self.roots[None, :], len(X), axis=0)
+        while True:
+            left = self.children_left[nodes]
+            internal = left >= 0
+            if not internal.any():
+                break
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(internal, np.where(go_left, left, self.children_right[nodes]), nodes)
+        return self.leaf_values[self.leaf_rows[nodes]].mean(axis=1)
+
+    def get_params(self) -> dict:
+        return self.params
+
+
 class RandomForest:
     def __init__(self, n_estimators: int  =100, min_samples_leaf: int = 1, max_features: str = None) -> None:
         """
@@ -29,6 +74,19 @@ class RandomForest:
         """
         self.model.fit(X, y)
 
+    def grow(self, X: np.ndarray, y: np.ndarray, n_estimators: int) -> None:
+        """
+        add trees until the forest has n_estimators trees, keeping the ones already fitted (warm start):
+        growing to 100 then 200 trees gives a 200-tree forest for the cost of fitting 200 trees
+        :param X: array-like of shape (n_samples, n_features), the same data at every call
+        :param y: array-like of shape (n_samples, 15)
+        :param n_estimators: total number of trees, not smaller than the current number
+        :return: None
+        """
+        self.n_estimators = n_estimators
+        self.model.set_params(n_estimators=n_estimators, warm_start=True)
+        self.model.fit(X, y)
+
     def predict(self, X: np.ndarray) -> np.ndarray:
         """
         predict the target
@@ -38,6 +96,42 @@ class RandomForest:
         # round to 2 decimal places
         return self.model.predict(X).round(2)
 
+    def get_arrays(self) -> dict:
+        """
+        fitted trees as flat node arrays, stored in the model artifact (see models/artifact.py);
+        children indices are global over all trees (-1 for leaves) and leaf_values only holds the leaves
+        :return: dictionary of arrays {roots, children_left, children_right, feature, threshold, leaf_values}
+        """
+        # a restored forest already holds them
+        if isinstance(self.model, ForestArrays):
+            return self.model.arrays
+        trees = [estimator.tree_ for estimator in self.model.estimators_]
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        children_left = np.concatenate([np.where(t.children_left >= 0, t.children_left + o, -1)
+                                        for t, o in zip(trees, offsets)])
+        children_right = np.concatenate([np.where(t.children_right >= 0, t.children_right + o, -1)
+                                         for t, o in zip(trees, offsets)])
+        leaf_values = np.concatenate([t.value[t.children_left < 0, :, 0] for t in trees])
+        return {
+            'roots': offsets[:-1].astype(np.int64),
+            'children_left': children_left.astype(np.int64),
+            'children_right': children_right.astype(np.int64),
+            # features of the leaves are set to 0 so that every node indexes a valid column
+            'feature': np.concatenate([np.maximum(t.feature, 0) for t in trees]).astype(np.int32),
+            'threshold': np.concatenate([t.threshold for t in trees]),
+            'leaf_values': leaf_values,
+        }
+
+    def set_arrays(self, arrays: dict, feature_names: list = None) -> 'RandomForest':
+        """
+        restore the fitted forest from the arrays of get_arrays; the restored forest predicts but cannot grow
+        :param arrays: dictionary of arrays, possibly memory-mapped
+        :param feature_names: feature columns the model was fitted on (unused, the columns are taken in order)
+        :return: RandomForest
+        """
+        self.model = ForestArrays(arrays, self.model.get_params())
+        return self
+
     def evaluate(self, X: np.ndarray, y: np.ndarray) -> float:
         """
         return the MSE of the model on the given data
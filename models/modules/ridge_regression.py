@@ -21,7 +21,9 @@ class RidgeRegressor:
         :param y: array-like of shape (n_samples, 15)
         :return: None
         """
-        self.model.fit(X, y)
+        # sklearn solves in float32 for float32 inputs (the feature schema): solve in float64 as before, the copy
+        # only lives during the fit of one station
+        self.model.fit(X.astype(np.float64, copy=False), y.astype(np.float64, copy=False))
 
     def predict(self, X: np.ndarray) -> np.ndarray:
         """
@@ -31,6 +33,34 @@ class RidgeRegressor:
         """
         return self.model.predict(X)
 
+    def coefficients(self) -> tuple:
+        """
+        return the fitted linear map, predictions are X @ coef.T + intercept
+        :return: tuple (coef of shape (15, n_features), intercept of shape (15,))
+        """
+        return self.model.coef_, self.model.intercept_
+
+    def get_arrays(self) -> dict:
+        """
+        fitted parameters as arrays, stored in the model artifact (see models/artifact.py)
+        :return: dictionary of arrays {coef, intercept}
+        """
+        return {'coef': self.model.coef_, 'intercept': self.model.intercept_}
+
+    def set_arrays(self, arrays: dict, feature_names: list = None) -> 'RidgeRegressor':
+        """
+        restore the fitted parameters from the arrays of get_arrays
+        :param arrays: dictionary of arrays, possibly memory-mapped
+        :param feature_names: feature columns the model was fitted on
+        :return: RidgeRegressor
+        """
+        self.model.coef_ = arrays['coef']
+        self.model.intercept_ = arrays['intercept']
+        self.model.n_features_in_ = self.model.coef_.shape[1]
+        if feature_names is not None:
+            self.model.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        return self
+
     def evaluate(self, X: np.ndarray, y: np.ndarray) -> float:
         """
         return the MSE of the model on the given data
@@ -54,4 +84,60 @@ class RidgeRegressor:
         :return:
         """
         self.model.set_params(**params)
-        return self
\ No newline at end of file
+        return self
+
+
+class RidgeGram:
+    """
+    Sufficient statistics of ridge regressions with intercept (as fitted by sklearn's Ridge) on one training window.
+    One eigendecomposition of the centered Gram matrix gives the solution for a whole path of alphas, and
+    rows can be removed from the window with a rank-k downdate instead of refitting.
+    """
+    def __init__(self, X: np.ndarray, y: np.ndarray) -> None:
+        """
+        initialize the statistics from the first training window
+        :param X: array-like of shape (n_samples, n_features)
+        :param y: array-like of shape (n_samples, 15)
+        """
+        X, y = np.asarray(X, dtype=float), np.asarray(y, dtype=float)
+        # statistics are accumulated around a fixed shift to avoid cancellation when centering (e.g. YEAR ~ 2020)
+        self.x_shift, self.y_shift = X.mean(axis=0), y.mean(axis=0)
+        X, y = X - self.x_shift, y - self.y_shift
+        self.n = len(X)
+        self.x_sum, self.y_sum = X.sum(axis=0), y.sum(axis=0)
+        self.xx, self.xy = X.T @ X, X.T @ y
+
+    def remove_rows(self, X: np.ndarray, y: np.ndarray) -> None:
+        """
+        rank-k downdate: remove k rows from the training window
+        :param X: array-like of shape (k, n_features)
+        :param y: array-like of shape (k, 15)
+        :return: None
+        """
+        X = np.asarray(X, dtype=float) - self.x_shift
+        y = np.asarray(y, dtype=float) - self.y_shift
+        self.n -= len(X)
+        self.x_sum -= X.sum(axis=0)
+        self.y_sum -= y.sum(axis=0)
+        self.xx -= X.T @ X
+        self.xy -= X.T @ y
+
+    def path(self, alphas: np.ndarray) -> tuple:
+        """
+        ridge solutions for several regularization strengths
+        :param alphas: array-like of shape (n_alphas,)
+        :return: tuple (coefs of shape (n_alphas, n_features, 15), intercepts of shape (n_alphas, 15)),
+                 predictions are X @ coefs[a] + intercepts[a]
+        """
+        alphas = np.asarray(alphas, dtype=float)
+        x_mean, y_mean = self.x_sum / self.n, self.y_sum / self.n
+        # centered Gram matrix and cross-products of the window
+        gram = self.xx - self.n * np.outer(x_mean, x_mean)
+        cross = self.xy - self.n * np.outer(x_mean, y_mean)
+        eigenvalues, eigenvectors = np.linalg.eigh(gram)
+        projected = eigenvectors.T @ cross
+        # (X'X + alpha I)^-1 X'y = Q diag(1 / (lambda + alpha)) Q' X'y for every alpha at once
+        shrinkage = 1 / (np.maximum(eigenvalues, 0)[None, :] + alphas[:, None])
+        coefs = (eigenvectors[None, :, :] * shrinkage[:, None, :]) @ projected
+        intercepts = (y_mean + self.y_shift) - np.einsum('p,apt->at', x_mean + self.x_shift, coefs)
+        return coefs, intercepts
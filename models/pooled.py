@@ -0,0 +1,204 @@
+# pooled model: one submodel trained on the stacked data of all the stations, with station features built from
+# the GHCN station metadata (latitude, longitude, elevation) and optionally one indicator feature per station.
+# One fit and one prediction call serve every station, and stations with a short history (or none) borrow
+# strength from the stations with similar coordinates
+
+import os
+import numpy as np
+import pandas as pd
+from data.stations import StationRegistry
+from models.artifact import fit_info_from_json, fit_info_to_json, read_station_arrays, write_artifact
+from models.model import MultiStationModel, fit_info, make_station_model
+from pipeline.instrumentation import span
+
+# names of the metadata columns used as station features
+station_feature_names = ["STATION_LATITUDE", "STATION_LONGITUDE", "STATION_ELEVATION"]
+# key of the pooled submodel in the model artifact
+pooled_key = "POOLED"
+
+
+# function to read the station features of the registered stations (see data/stations.py)
+def load_station_features(registry: StationRegistry = None) -> pd.DataFrame:
+    """
+    :param registry: station registry, loaded from the downloaded station metadata if None
+    :return: DataFrame indexed by station with the columns of station_feature_names
+    """
+    features = (registry or StationRegistry.load()).station_features()
+    features.columns = station_feature_names
+    return features
+
+
+class PooledStationView:
+    """
+    Station model of a PooledModel: predicts with the pooled submodel and the station's features, so that the
+    per-station code of MultiStationModel (predict, evaluate, retrain checks) works unchanged
+    """
+    def __init__(self, model: 'PooledModel', station: str) -> None:
+        self.model = model
+        self.station = station
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        :param X: array-like of shape (n_samples, n_features)
+        :return: array of shape (n_samples, 15)
+        """
+        return self.model.pooled_predict(np.asarray(X, dtype=float), np.repeat(self.station, len(X)))
+
+    def evaluate(self, X: np.ndarray, y: np.ndarray) -> float:
+        """
+        :return: MSE of the pooled model on the station's data
+        """
+        return np.mean((self.predict(X) - y) ** 2).item()
+
+    def get_params(self) -> dict:
+        return self.model.pooled_model.get_params()
+
+
+class PooledModel(MultiStationModel):
+    # a fit always covers every station (see predictions/predictions.py)
+    pooled = True
+
+    def __init__(self, model_name: str, station_features: pd.DataFrame = None, station_indicators: bool = True,
+                 **kwargs) -> None:
+        """
+        Initialize the model
+        :param model_name: name of the pooled submodel
+        :param station_features: DataFrame indexed by station with the columns of station_feature_names
+                                 (see load_station_features); stations without features cannot be fitted or predicted
+        :param station_indicators: add one 0/1 feature per training station; stations outside the training data
+                                   are predicted from their coordinates only
+        :param kwargs: dictionary of model parameters
+        """
+        super().__init__(model_name, **kwargs)
+        self.station_features = station_features if station_features is not None else \
+            pd.DataFrame(columns=station_feature_names, dtype=float)
+        self.station_indicators = station_indicators
+        # stations with an indicator feature, in column order
+        self.indicator_stations = []
+        self.pooled_model = None
+
+    def pooled_feature_names(self) -> list:
+        """
+        :return: columns of the pooled submodel: the features, the station features and the indicators
+        """
+        return self.feature_names + station_feature_names + [f"STATION_{s}" for s in self.indicator_stations]
+
+    def augment(self, X: np.ndarray, stations: np.ndarray) -> pd.DataFrame:
+        """
+        Append the station features and indicators to feature rows
+        :param X: array of shape (n_samples, n_features)
+        :param stations: station of each row
+        :return: DataFrame with the columns of pooled_feature_names
+        """
+        coordinates = self.station_features.loc[stations].to_numpy(dtype=float)
+        indicators = (np.asarray(stations)[:, None] == np.asarray(self.indicator_stations)[None, :]).astype(float)
+        return pd.DataFrame(np.hstack([X, coordinates, indicators]), columns=self.pooled_feature_names())
+
+    def pooled_predict(self, X: np.ndarray, stations: np.ndarray) -> np.ndarray:
+        """
+        :param X: array of shape (n_samples, n_features)
+        :param stations: station of each row
+        :return: array of shape (n_samples, 15)
+        """
+        return np.asarray(self.pooled_model.predict(self.augment(X, stations)))
+
+    def fit(self, data: dict, verbose: bool = True, n_jobs: int = 1) -> None:
+        """
+        Fit the pooled submodel to the stacked data of all the stations
+        :param data: dictionary of tuples {station_s: (X_s, y_s) for s in stations}
+        :param verbose:
+        :param n_jobs: unused, there is a single submodel
+        :return: None
+        """
+        missing = [station for station in data if station not in self.station_features.index]
+        if missing:
+            raise ValueError(f"No station features for the stations {missing}")
+        self.feature_names = list(next(iter(data.values()))[0].columns)
+        self.indicator_stations = list(data) if self.station_indicators else []
+        X = pd.concat([
+            self.augment(X_s[self.feature_names].to_numpy(dtype=float), np.repeat(station, len(X_s)))
+            for station, (X_s, y_s) in data.items()
+        ], ignore_index=True)
+        y = np.concatenate([y_s.to_numpy(dtype=float) for X_s, y_s in data.values()])
+        self.pooled_model = make_station_model(self.model_name, **self.kwargs)
+        with span("fit", model=self.model_name, pooled=True) as s:
+            self.pooled_model.fit(X, y)
+            s.add("stations", len(data))
+            s.add("samples", len(X))
+        fit_time = s.seconds
+        for station, (X_s, y_s) in data.items():
+            self.fit_times[station] = fit_time
+            self.fit_info[station] = fit_info(X_s, fit_time)
+        if verbose:
+            print(f"pooled {self.model_name} model for {len(data)} stations fitted in {fit_time} seconds")
+        self.set_views()
+
+    def set_views(self, stations: list = None) -> None:
+        """
+        Expose a station model for each station with features
+        :param stations: stations to expose (all the stations with features if None)
+        :return: None
+        """
+        stations = self.station_features.index if stations is None else \
+            [station for station in stations if station in self.station_features.index]
+        self.models = {station: PooledStationView(self, station) for station in stations}
+
+    def predict_batch(self, X: np.ndarray, stations: list) -> np.ndarray:
+        """
+        Predict the targets of many stations and dates with one call of the pooled submodel
+        :param X: array of shape (n_stations, n_dates, n_features), features in the order of feature_names
+        :param stations: station of each slice of X
+        :return: array of shape (n_stations, n_dates, 15); NaN for stations without features or with missing features
+        """
+        X = np.asarray(X, dtype=float)
+        n_stations, n_dates, n_features = X.shape
+        rows = X.reshape(n_stations * n_dates, n_features)
+        row_stations = np.repeat(np.asarray(stations, dtype=object), n_dates)
+        complete = ~np.isnan(rows).any(axis=1) & np.isin(row_stations, list(self.models))
+        y_pred = np.full((n_stations * n_dates, 15), np.nan)
+        if complete.any():
+            y_pred[complete] = self.pooled_predict(rows[complete], row_stations[complete])
+        return y_pred.reshape(n_stations, n_dates, 15)
+
+    def save(self, path: str, compress: bool = True) -> None:
+        """
+        Save the model as a directory artifact holding the pooled submodel, or as a pickle if path ends with .pkl
+        :param path: path to the artifact directory or to the pickle file
+        :param compress: store the arrays compressed (artifact only)
+        :return: None
+        """
+        if path.endswith('.pkl'):
+            super().save(path)
+            return
+        pooled = {
+            "station_indicators": self.station_indicators,
+            "indicator_stations": self.indicator_stations,
+            "station_features": self.station_features.to_dict("index"),
+            "fit_times": self.fit_times,
+            "fit_info": {station: fit_info_to_json(info) for station, info in self.fit_info.items()},
+        }
+        write_artifact(self, path, compress=compress, models={pooled_key: self.pooled_model}, extra={"pooled": pooled})
+
+    @staticmethod
+    def from_artifact(path: str, manifest: dict, stations: list = None, mmap_mode: str = 'r') -> 'PooledModel':
+        """
+        Rebuild a pooled model from its artifact, called by MultiStationModel.load
+        :param path: artifact directory
+        :param manifest: manifest of the artifact
+        :param stations: stations to expose (all if None)
+        :param mmap_mode: memory-map mode of the uncompressed arrays
+        :return: model object
+        """
+        pooled = manifest["pooled"]
+        model = PooledModel(manifest["model_name"],
+                            station_features=pd.DataFrame.from_dict(pooled["station_features"], orient="index"),
+                            station_indicators=pooled["station_indicators"], **manifest["kwargs"])
+        model.feature_names = manifest["feature_names"]
+        model.indicator_stations = pooled["indicator_stations"]
+        model.fit_times = pooled["fit_times"]
+        model.fit_info = {station: fit_info_from_json(info) for station, info in pooled["fit_info"].items()}
+        arrays = read_station_arrays(os.path.join(path, manifest["stations"][pooled_key]["file"]), mmap_mode)
+        model.pooled_model = make_station_model(model.model_name, **model.kwargs).set_arrays(
+            arrays, model.pooled_feature_names())
+        model.set_views(stations)
+        return model
@@ -0,0 +1,112 @@
+# registry of the submodel families: how to build each one, the hyperparameter space searched by grid_search.py,
+# a cost hint used to schedule the search and what the family supports. Adding a family means adding one ModelSpec
+# to model_registry, MultiStationModel, the cross-validation and the grid search pick it up from here.
+
+import itertools
+import importlib
+import numpy as np
+import pandas as pd
+
+
+# function to convert numpy scalars of a DataFrame row to plain python values
+def plain_params(row: dict) -> dict:
+    """
+    :param row: dictionary of hyperparameters, possibly holding numpy scalars
+    :return: dictionary of JSON serializable hyperparameters
+    """
+    return {name: value.item() if hasattr(value, "item") else value for name, value in row.items()}
+
+
+class ModelSpec:
+    def __init__(self, name: str, module: str, class_name: str, label: str, hyperparameters: dict, cost,
+                 warm_start_param: str = None, batched_predict: bool = False, partial_fit: bool = False,
+                 alpha_path: bool = False, results_name: str = None) -> None:
+        """
+        :param name: name of the submodel, as passed to MultiStationModel
+        :param module: module of the submodel class, imported when the first submodel is built so that loading an
+                       artifact only imports the sklearn estimators of its family
+        :param class_name: name of the submodel class
+        :param label: short name in the printed search results, e.g. "RF"
+        :param hyperparameters: searched space {parameter: list of values}
+        :param cost: function of the hyperparameters returning the relative cost of fitting one station
+        :param warm_start_param: size parameter the submodel can grow in place with grow(X, y, size): the
+                                 configurations that only differ by it are scored in one pass (see warm_start_cv)
+        :param batched_predict: the submodel is linear and has coefficients(), predict_batch predicts every
+                                station with one matmul
+        :param partial_fit: the submodel has partial_fit(X, y) to update a fit with new rows
+        :param alpha_path: the whole grid is a ridge regularization path solved at once per fold (see ridge_cv_slide)
+        :param results_name: prefix of the CSV of the search results (defaults to name)
+        """
+        self.name = name
+        self.module = module
+        self.class_name = class_name
+        self.label = label
+        self.hyperparameters = hyperparameters
+        self.cost = cost
+        self.warm_start_param = warm_start_param
+        self.batched_predict = batched_predict
+        self.partial_fit = partial_fit
+        self.alpha_path = alpha_path
+        self.results_name = results_name or name
+
+    def model_class(self) -> type:
+        """
+        :return: class of the submodel, its module is imported on the first call
+        """
+        return getattr(importlib.import_module(self.module), self.class_name)
+
+    def make(self, **kwargs):
+        """
+        :param kwargs: dictionary of model parameters
+        :return: unfitted submodel
+        """
+        return self.model_class()(**kwargs)
+
+    def grid(self) -> pd.DataFrame:
+        """
+        :return: DataFrame with one row per combination of the hyperparameter space, one column per parameter
+        """
+        return pd.DataFrame(list(itertools.product(*self.hyperparameters.values())), columns=list(self.hyperparameters))
+
+    def params(self, row: dict) -> dict:
+        """
+        :param row: configuration, e.g. a row of the search results with its MSE and fold counts
+        :return: dictionary of the model parameters of the row, as plain python values
+        """
+        return plain_params({name: value for name, value in row.items() if name in self.hyperparameters})
+
+    def describe(self, params: dict) -> str:
+        """
+        :param params: dictionary of model parameters
+        :return: e.g. "RF(n_estimators = 100, min_samples_leaf = 5, max_features = sqrt)"
+        """
+        return f"{self.label}({', '.join(f'{name} = {value}' for name, value in params.items())})"
+
+
+# the approximate GP engine standardizes the features, so length scales are in standard deviations.
+# The costs are rough fit times of one station relative to a ridge fit, they only order the work
+model_registry = {spec.name: spec for spec in [
+    ModelSpec("ridge", "models.modules.ridge_regression", "RidgeRegressor", "Ridge",
+              hyperparameters={"alpha": [10 ** i for i in np.linspace(-3, 8, 20)]},
+              cost=lambda params: 1.0, batched_predict=True, alpha_path=True),
+    ModelSpec("gaussian_process", "models.modules.gaussian_process", "GaussianProcess", "GP",
+              hyperparameters={"length_scale": [10, 20], "sigma": [1], "kernel": ["rbf", "matern"],
+                               "approximation": ["nystroem"], "n_components": [500]},
+              cost=lambda params: params.get("n_components", 500) / 25, results_name="gp"),
+    ModelSpec("random_forest", "models.modules.random_forest", "RandomForest", "RF",
+              hyperparameters={"n_estimators": [100, 150, 200], "min_samples_leaf": [2, 5, 10],
+                               "max_features": ["sqrt"]},
+              cost=lambda params: 2 * params.get("n_estimators", 100),
+              warm_start_param="n_estimators"),
+]}
+
+
+# function to look up a submodel family
+def model_spec(model_name: str) -> ModelSpec:
+    """
+    :param model_name: name of the submodel
+    :return: its ModelSpec
+    """
+    if model_name not in model_registry:
+        raise ValueError('Invalid name')
+    return model_registry[model_name]
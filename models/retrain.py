@@ -0,0 +1,56 @@
+# retrain policy for the saved model used at prediction time
+# the daily prediction job only predicts with the persisted station models; a station model is refitted
+# when it is older than the maximum age or when the newest features drift away from its training data
+
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+
+
+class RetrainPolicy:
+    def __init__(self, max_age_days: float = 7, drift_threshold: float = 3.0) -> None:
+        """
+        Initialize the policy
+        :param max_age_days: refit a station model fitted more than this many days ago (None to disable)
+        :param drift_threshold: refit a station model when the mean absolute z-score of the newest features
+                                against its training distribution exceeds this value (None to disable)
+        """
+        self.max_age_days = max_age_days
+        self.drift_threshold = drift_threshold
+
+    @staticmethod
+    def drift(info: dict, X: pd.DataFrame) -> float:
+        """
+        Mean absolute z-score of the average of the given feature rows under the training distribution
+        :param info: fit record of the station model (see models.model.fit_info)
+        :param X: recent feature rows
+        :return: drift score (0 means the features look like the training data on average)
+        """
+        means, stds = np.asarray(info["feature_means"]), np.asarray(info["feature_stds"])
+        varying = stds > 0
+        z = (np.asarray(X, dtype=float).mean(axis=0) - means) / np.where(varying, stds, 1)
+        return np.abs(z[varying]).mean().item()
+
+    def reasons(self, model, X: dict, now: datetime = None) -> dict:
+        """
+        Decide which station models need to be refitted
+        :param model: MultiStationModel loaded from the artifact
+        :param X: dictionary of the newest feature rows {station_s: X_s for s in stations}
+        :param now: current time (defaults to now, UTC)
+        :return: dictionary {station: reason} of the stations to refit
+        """
+        now = now or datetime.now(timezone.utc)
+        stale = {}
+        for station in X:
+            info = model.fit_info.get(station)
+            if station not in model.models or info is None:
+                stale[station] = "no fit record"
+                continue
+            age = (now - datetime.fromisoformat(info["fitted_at"])).total_seconds() / 86400
+            if self.max_age_days is not None and age > self.max_age_days:
+                stale[station] = f"fitted {age:.1f} days ago"
+            elif self.drift_threshold is not None and len(X[station]) > 0:
+                score = self.drift(info, X[station])
+                if score > self.drift_threshold:
+                    stale[station] = f"feature drift {score:.2f}"
+        return stale
@@ -3,9 +3,9 @@
 # trains the model and saves it to disk
 
 import os
+import sys
 
-from sympy.abc import alpha
-
+from data.storage import table_files
 from models.utils import folder_to_data_dict
 from models.model import MultiStationModel
 import time
@@ -16,13 +16,17 @@ in_data_filepath = os.path.join(os.path.dirname(__file__), "../data/processed_da
 out_model_filepath = os.path.join(os.path.dirname(__file__), "../saved_models/")
 
 
-if __name__ == "__main__":
+# function to fit the ridge model on all but the last 5 days of each station, evaluate it and save it
+def main() -> None:
+    """
+    :return: None
+    """
     train_flag = True
+    # pass --pooled to train one model over all stations with their coordinates as features
+    pooled = "--pooled" in sys.argv[1:]
 
-    # get the list of files in the data folder
-    files = os.listdir(in_data_filepath)
-    # remove any non-csv files and join the file names with the path
-    files = [os.path.join(in_data_filepath, f) for f in files if f.endswith(".csv")]
+    # get the list of station tables in the data folder
+    files = table_files(in_data_filepath)
     print(files)
     # construct the data dictionary
     data = folder_to_data_dict(files)
@@ -52,7 +56,11 @@ if __name__ == "__main__":
     # train the model
     if train_flag:
         # initialize the model
-        model = MultiStationModel(model_name="ridge", alpha=615)
+        if pooled:
+            from models.pooled import PooledModel, load_station_features
+            model = PooledModel(model_name="ridge", station_features=load_station_features(), alpha=615)
+        else:
+            model = MultiStationModel(model_name="ridge", alpha=615)
         # time to fit the model
         start_time = time.time()
         # fit the model to the data
@@ -60,7 +68,7 @@ if __name__ == "__main__":
         print(f"Model fitting took {time.time() - start_time} seconds")
     else:
         # load the model from disk
-        model = MultiStationModel.load(os.path.join(out_model_filepath, "model.pkl"))
+        model = MultiStationModel.load(os.path.join(out_model_filepath, "model"))
     # evaluate the model
     mse = model.evaluate(test_data)
     print(f"Mean squared error: {mse}")
@@ -70,5 +78,9 @@ if __name__ == "__main__":
     for station in predictions:
         print(f"Station: {station} \n"
               f"Predicted - Actual: {predictions[station] - last_day_y[station]}")
-    # save theR model to disk
-    model.save(os.path.join(out_model_filepath, "model.pkl"))
\ No newline at end of file
+    # save the model to disk
+    model.save(os.path.join(out_model_filepath, "model"))
+
+
+if __name__ == "__main__":
+    main()
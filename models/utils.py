@@ -1,23 +1,29 @@
-import pandas as pd
+import os
+from data.feature_engineering import apply_feature_schema
+from data.storage import read_table, table_columns
 
 
-def folder_to_data_dict(filepaths: list) -> dict:
+def folder_to_data_dict(filepaths: list, features: list = None) -> dict:
     """
     Read in the data from the given list of filepaths and return a dictionary.
     Targets are in the first 15 columns and features are in the rest
-    :param filepaths: list of filepaths of station datasets
+    :param filepaths: list of filepaths of station datasets (csv, parquet or feather, see data/storage.py)
+    :param features: feature columns to load, all features if None (binary formats only read these columns)
     :return: dictionary of data {station_id: (X, y)}
     """
     data = {}
     for f in filepaths:
-        # read in the data
-        df = pd.read_csv(f)
-        # get the station id: filename is of the form "weatherPred/models/../data/processed_data/KPWM.csv"
-        station = f.split("/")[-1].split(".")[0]
+        # get the station id: filename is of the form "weatherPred/models/../data/processed_data/KPWM.parquet"
+        station = os.path.splitext(os.path.basename(f))[0]
+        # the target variables are the first 15 columns
+        columns = table_columns(f)
+        targets = columns[:15]
+        # read in the data, with the dtypes of the feature schema whatever the storage format
+        df = apply_feature_schema(read_table(f, columns=None if features is None else targets + list(features)))
         # drop the first 15 columns
-        X = df.drop(df.columns[:15], axis=1)
+        X = df.drop(columns=targets)
         # get the target variables (first 15 columns)
-        y = df[df.columns[:15]]
+        y = df[targets]
         # add the data to the dictionary
         data[station] = (X, y)
-    return data
\ No newline at end of file
+    return data
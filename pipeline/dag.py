@@ -0,0 +1,272 @@
+# pipeline runner: a DAG of tasks, each keyed by the digests of its input files, of the source files of its code and
+# of its parameters. A task runs again only when its key changed since its last successful run or when one of its
+# outputs is missing or was modified, so a change to one station's data only recomputes that station's tasks (and
+# the tasks that read all the stations). Tasks whose dependencies are done run in parallel.
+#
+# The state of the last successful runs is kept in a JSON file of the cache directory, with the digests of the
+# files memoized by size and modification time so unchanged files are not read again.
+
+import os
+import sys
+import json
+import time
+import hashlib
+import traceback
+import subprocess
+
+from pipeline.instrumentation import span
+
+# size of the blocks read when hashing a file
+digest_block_size = 1 << 20
+
+
+# function to hash the content of a file, or of every file under a directory
+def file_digest(path: str) -> str:
+    """
+    :param path: path to a file or a directory
+    :return: hex digest, None if the path does not exist
+    """
+    if os.path.isdir(path):
+        digest = hashlib.blake2b()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(file_digest(file_path).encode())
+        return digest.hexdigest()
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(digest_block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# function to run a module of the repository in a new interpreter, for the scripts that do their work at import
+def run_module(module: str, *args: str) -> None:
+    """
+    :param module: module name, e.g. "models.evaluation.grid_search"
+    :param args: command line arguments
+    :return: None
+    """
+    subprocess.run([sys.executable, "-m", module, *args], check=True)
+
+
+# function run by the workers: run a task and time it in a "task" span
+def execute(func, name: str = None, stage: str = None) -> tuple:
+    """
+    :param func: function of the task, without arguments
+    :param name: name of the task, recorded in the span
+    :param stage: stage of the task, recorded in the span
+    :return: (seconds, error message or None)
+    """
+    error = None
+    # timed outside the span, so that a failure when entering the span is reported like one of the task
+    start_time = time.perf_counter()
+    try:
+        with span("task", task=name, stage=stage):
+            func()
+    except BaseException as e:
+        error = "".join(traceback.format_exception_only(type(e), e)).strip()
+    return time.perf_counter() - start_time, error
+
+
+class Task:
+    def __init__(self, name: str, stage: str, func, inputs: list = None, outputs: list = None, code: list = None,
+                 deps: list = None, params: dict = None, volatile: bool = False) -> None:
+        """
+        :param name: unique task name, e.g. "features/KBOI"
+        :param stage: stage of the task in the timing report, e.g. "features"
+        :param func: top-level function without arguments (a functools.partial), importable by the worker processes
+        :param inputs: files or directories read by the task
+        :param outputs: files written by the task, a missing or modified output makes the task stale
+        :param code: source files of the code run by the task
+        :param deps: names of the tasks that must run first
+        :param params: JSON serializable parameters that change the result, e.g. the date for date-dependent tasks
+        :param volatile: always run, e.g. downloads whose inputs are remote
+        """
+        self.name = name
+        self.stage = stage
+        self.func = func
+        self.inputs = list(inputs or [])
+        self.outputs = list(outputs or [])
+        self.code = list(code or [])
+        self.deps = list(deps or [])
+        self.params = params or {}
+        self.volatile = volatile
+
+
+class Pipeline:
+    def __init__(self, cache_dir: str, jobs: int = 1, verbose: bool = True) -> None:
+        """
+        :param cache_dir: directory of the state of the last successful runs
+        :param jobs: number of worker processes (-1 for all cores); 1 runs the tasks in this process
+        :param verbose: print one line per task
+        """
+        self.cache_dir = cache_dir
+        self.jobs = jobs
+        self.verbose = verbose
+        self.tasks = {}
+        # wall time of the waves each stage took part in, filled by run
+        self.stage_seconds = {}
+        self.state_path = os.path.join(cache_dir, "state.json")
+        self.state = {"digests": {}, "tasks": {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path) as f:
+                self.state = json.load(f)
+
+    def add(self, task: Task) -> Task:
+        """
+        :param task: task to add, its dependencies must already be in the pipeline
+        :return: the task
+        """
+        if task.name in self.tasks:
+            raise ValueError(f"Duplicate task {task.name}")
+        missing = [dep for dep in task.deps if dep not in self.tasks]
+        if missing:
+            raise ValueError(f"Unknown dependencies {missing} of task {task.name}")
+        self.tasks[task.name] = task
+        return task
+
+    def digest(self, path: str) -> str:
+        """
+        :param path: path to a file or a directory
+        :return: digest of the content, memoized by size and modification time for files
+        """
+        if not os.path.isfile(path):
+            return file_digest(path)
+        stat = os.stat(path)
+        cached = self.state["digests"].get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = file_digest(path)
+        self.state["digests"][path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def key(self, task: Task) -> str:
+        """
+        :param task: task whose dependencies have run
+        :return: digest of the task's inputs, code and parameters
+        """
+        content = {
+            "name": task.name,
+            "params": task.params,
+            "inputs": {path: self.digest(path) for path in task.inputs},
+            "code": {path: self.digest(path) for path in task.code},
+        }
+        return hashlib.blake2b(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def stale_reason(self, task: Task, key: str) -> str:
+        """
+        :param task: task whose dependencies have run
+        :param key: key of the task
+        :return: why the task must run, None if its outputs are up to date
+        """
+        if task.volatile:
+            return "volatile"
+        previous = self.state["tasks"].get(task.name)
+        if previous is None:
+            return "never run"
+        if previous["key"] != key:
+            return "inputs or code changed"
+        for path, digest in previous["outputs"].items():
+            if self.digest(path) != digest:
+                return f"output {os.path.basename(path)} missing or modified"
+        return None
+
+    def save_state(self) -> None:
+        """
+        Write the state atomically, so an interrupted run keeps the tasks that completed
+        :return: None
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def run(self, force: bool = False) -> dict:
+        """
+        Run the stale tasks, in waves of tasks whose dependencies are done
+        :param force: run every task
+        :return: dictionary {task name: {status: "ran", "cached", "failed" or "skipped", seconds, reason}}
+        """
+        results = {}
+        pending = list(self.tasks)
+        while pending:
+            ready = [name for name in pending if all(dep in results for dep in self.tasks[name].deps)]
+            pending = [name for name in pending if name not in ready]
+            to_run = {}
+            for name in ready:
+                task = self.tasks[name]
+                failed = [dep for dep in task.deps if results[dep]["status"] in ("failed", "skipped")]
+                if failed:
+                    results[name] = {"status": "skipped", "seconds": 0.0, "reason": f"{failed[0]} did not run"}
+                    continue
+                key = self.key(task)
+                reason = "forced" if force else self.stale_reason(task, key)
+                if reason is None:
+                    results[name] = {"status": "cached", "seconds": 0.0, "reason": None}
+                else:
+                    to_run[name] = (key, reason)
+            if not to_run:
+                continue
+
+            # run the wave, in this process or on a pool of workers
+            tasks = [self.tasks[name] for name in to_run]
+            n_workers = min(os.cpu_count() if self.jobs < 0 else self.jobs, len(tasks))
+            start_time = time.time()
+            if n_workers <= 1:
+                outcomes = [execute(task.func, task.name, task.stage) for task in tasks]
+            else:
+                from joblib import Parallel, delayed
+                outcomes = Parallel(n_jobs=n_workers, backend="loky")(
+                    delayed(execute)(task.func, task.name, task.stage) for task in tasks
+                )
+            wall = time.time() - start_time
+            for stage in {self.tasks[name].stage for name in to_run}:
+                self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + wall
+
+            for (name, (key, reason)), (seconds, error) in zip(to_run.items(), outcomes):
+                task = self.tasks[name]
+                if error is None:
+                    missing = [path for path in task.outputs if not os.path.exists(path)]
+                    if missing:
+                        error = f"output {missing[0]} was not written"
+                if error is None:
+                    self.state["tasks"][name] = {
+                        "key": key, "outputs": {path: self.digest(path) for path in task.outputs}, "seconds": seconds
+                    }
+                    results[name] = {"status": "ran", "seconds": seconds, "reason": reason}
+                else:
+                    self.state["tasks"].pop(name, None)
+                    results[name] = {"status": "failed", "seconds": seconds, "reason": error}
+                if self.verbose:
+                    print(f"{name}: {results[name]['status']} ({reason}) in {seconds:.2f} seconds"
+                          + (f": {error}" if error else ""))
+            self.save_state()
+            if self.verbose:
+                print(f"{len(to_run)} tasks in {wall:.2f} seconds with {n_workers} workers")
+        self.save_state()
+        return results
+
+    def report(self, results: dict) -> str:
+        """
+        :param results: dictionary returned by run
+        :return: table with the number of tasks per status of each stage, in pipeline order, the wall time of the
+                 stage and the summed time of its tasks (larger than the wall time when they ran in parallel)
+        """
+        stages = {}
+        for name, result in results.items():
+            counts = stages.setdefault(self.tasks[name].stage,
+                                       {"ran": 0, "cached": 0, "failed": 0, "skipped": 0, "seconds": 0.0})
+            counts[result["status"]] += 1
+            counts["seconds"] += result["seconds"]
+        lines = [f"{'stage':<16}{'tasks':>7}{'ran':>6}{'cached':>8}{'failed':>8}{'skipped':>9}{'wall seconds':>14}{'task seconds':>14}"]
+        for stage, counts in stages.items():
+            n_tasks = counts["ran"] + counts["cached"] + counts["failed"] + counts["skipped"]
+            lines.append(f"{stage:<16}{n_tasks:>7}{counts['ran']:>6}{counts['cached']:>8}{counts['failed']:>8}"
+                         f"{counts['skipped']:>9}{self.stage_seconds.get(stage, 0.0):>14.2f}{counts['seconds']:>14.2f}")
+        return "\n".join(lines)
@@ -0,0 +1,339 @@
+# instrumentation of the pipeline stages: spans time a block of code (wall time, CPU time and peak memory) and carry
+# counters such as the bytes of a download or the rows of a parsed file, so rates like rows per second can be derived.
+#
+# Spans always measure their wall time, which the scripts print, but they are only recorded when WEATHERPRED_METRICS
+# names a directory: every process (the workers included) then appends one JSON line per span to its own
+# events-{pid}.jsonl file there, and
+#
+#   python -m pipeline.instrumentation [metrics directory]
+#
+# aggregates the events into metrics.json and a Prometheus textfile, metrics.prom (for the node_exporter textfile
+# collector), and prints a summary per span name. WEATHERPRED_PROFILE lists span names (or "all") whose spans also
+# run under cProfile and tracemalloc, the profiles are written to the profiles subdirectory.
+#
+# spans recorded by the pipeline:
+#   download            one file downloaded by data/fetcher.py: bytes, latency, status
+#   parse_by_year       one GHCN by-year archive read: rows parsed and kept_rows
+#   convert             conversion of a station's .dly history: rows
+#   parse_obs_history   parsing of a weather.gov page: rows
+#   features            feature engineering of a station: rows
+#   fit, fit_station    fit of a model and of each of its station models: stations, samples
+#   predict_station     predictions of a station model: rows
+#   predict_batch       batched predictions of all the ridge station models: rows
+#   cv_fold             fit and score of a model on one cross-validation fold: configs
+#   cv_slide            every fold of the ridge alpha path: folds, configs
+#   scrape, convert_data, grid_search   the whole run of data/scraper.py, data/converter.py and the model search
+#   task                one task of the pipeline DAG (see pipeline/dag.py)
+#
+# The events accumulate in the metrics directory, a nightly run should use a directory of its own, e.g.
+# make pipeline METRICS=metrics/$(date +%F)
+
+import os
+import sys
+import json
+import glob
+import time
+import resource
+import threading
+from contextlib import contextmanager
+
+# directory of the event files, None when the spans are not recorded
+metrics_path = os.environ.get("WEATHERPRED_METRICS") or None
+# names of the spans that run under cProfile and tracemalloc
+profile_spans = {name.strip() for name in os.environ.get("WEATHERPRED_PROFILE", "").split(",") if name.strip()}
+# number of allocation sites written with the tracemalloc statistics of a profiled span
+tracemalloc_top = 25
+
+# event file of this process, its pid and the lock serializing the writes of its threads
+_events = {"pid": None, "file": None}
+_lock = threading.Lock()
+# open spans of each thread, the innermost last
+_local = threading.local()
+
+
+# function to read the peak resident memory of the process
+def peak_rss_bytes() -> int:
+    """
+    :return: largest resident set size of the process so far, in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+# function to append an event to the event file of this process
+def emit(event: dict) -> None:
+    """
+    :param event: JSON serializable dictionary
+    :return: None
+    """
+    if metrics_path is None:
+        return
+    line = json.dumps(event, default=str) + "\n"
+    with _lock:
+        if _events["pid"] != os.getpid():
+            # first event of this process, or a forked child of a process that already opened its file
+            os.makedirs(metrics_path, exist_ok=True)
+            _events["file"] = open(os.path.join(metrics_path, f"events-{os.getpid()}.jsonl"), "a", buffering=1)
+            _events["pid"] = os.getpid()
+        _events["file"].write(line)
+
+
+class Span:
+    def __init__(self, name: str, labels: dict) -> None:
+        """
+        :param name: name of the span, e.g. "convert"
+        :param labels: labels identifying the span, e.g. {"station": "KBOI"}
+        """
+        self.name = name
+        self.labels = labels
+        self.counts = {}
+        # wall time in seconds, set when the span ends
+        self.seconds = None
+
+    def add(self, counter: str, value: float = 1) -> None:
+        """
+        :param counter: name of the counter, e.g. "rows" or "bytes"
+        :param value: amount added to the counter
+        :return: None
+        """
+        self.counts[counter] = self.counts.get(counter, 0) + value
+
+    def set(self, **labels) -> None:
+        """
+        :param labels: labels known once the block ran, e.g. the status of a download
+        :return: None
+        """
+        self.labels.update(labels)
+
+
+# function to profile a block of code with cProfile and tracemalloc
+@contextmanager
+def profiled(current: Span):
+    """
+    :param current: span of the block, the tracemalloc peak is added to its counts
+    :return: context manager
+    """
+    import cProfile
+    import tracemalloc
+    profile_dir = os.path.join(metrics_path, "profiles")
+    os.makedirs(profile_dir, exist_ok=True)
+    name = "-".join([current.name] + [str(value) for value in current.labels.values()] + [str(os.getpid()),
+                                                                                            str(time.time_ns())])
+    name = "".join(c if c.isalnum() or c in "-_." else "_" for c in name)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(profile_dir, f"{name}.prof"))
+        current.add("tracemalloc_peak_bytes", tracemalloc.get_traced_memory()[1])
+        with open(os.path.join(profile_dir, f"{name}.txt"), "w") as f:
+            for stat in tracemalloc.take_snapshot().statistics("lineno")[:tracemalloc_top]:
+                f.write(f"{stat}\n")
+        if started_tracing:
+            tracemalloc.stop()
+
+
+# function to time a block of code
+@contextmanager
+def span(name: str, **labels):
+    """
+    usage: with span("convert", station=code) as s: ...; s.add("rows", len(df))
+    :param name: name of the span, listed at the top of this file
+    :param labels: labels identifying the span, e.g. station=code
+    :return: context manager yielding the Span, whose seconds are set at the end of the block
+    """
+    current = Span(name, labels)
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1].name if stack else None
+    # only the outermost profiled span of a thread is profiled, the profilers do not nest
+    profile = metrics_path is not None and (name in profile_spans or "all" in profile_spans) \
+        and not getattr(_local, "profiling", False)
+    error = None
+    stack.append(current)
+    start_cpu = time.process_time()
+    start_time = time.perf_counter()
+    try:
+        if profile:
+            _local.profiling = True
+            try:
+                with profiled(current):
+                    yield current
+            finally:
+                _local.profiling = False
+        else:
+            yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        current.seconds = time.perf_counter() - start_time
+        stack.pop()
+        if metrics_path is not None:
+            emit({
+                "name": name, "labels": current.labels, "parent": parent, "pid": os.getpid(), "ended_at": time.time(),
+                "seconds": current.seconds,
+                # CPU time of the whole process, threads included
+                "cpu_seconds": time.process_time() - start_cpu,
+                "peak_rss_bytes": peak_rss_bytes(), "counts": current.counts, "error": error,
+            })
+
+
+# function to read the events of every process
+def read_events(path: str = None) -> list:
+    """
+    :param path: metrics directory (defaults to WEATHERPRED_METRICS)
+    :return: list of span events, a line cut short by a crash is skipped
+    """
+    events = []
+    for file_path in sorted(glob.glob(os.path.join(path or metrics_path, "events-*.jsonl"))):
+        with open(file_path) as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return events
+
+
+# function to aggregate the events by span name and by span name and labels
+def summarize(events: list) -> dict:
+    """
+    :param events: list returned by read_events
+    :return: dictionary {"spans": {name: totals}, "series": [totals with name and labels]}; totals hold the count,
+             seconds, cpu_seconds, max_seconds, peak_rss_bytes, errors, summed counts and their rates per second
+    """
+    def add(totals: dict, event: dict) -> None:
+        totals["count"] += 1
+        totals["seconds"] += event["seconds"]
+        totals["cpu_seconds"] += event["cpu_seconds"]
+        totals["max_seconds"] = max(totals["max_seconds"], event["seconds"])
+        totals["peak_rss_bytes"] = max(totals["peak_rss_bytes"], event["peak_rss_bytes"])
+        totals["errors"] += event["error"] is not None
+        for counter, value in event["counts"].items():
+            if counter == "tracemalloc_peak_bytes":
+                totals["counts"][counter] = max(totals["counts"].get(counter, 0), value)
+            else:
+                totals["counts"][counter] = totals["counts"].get(counter, 0) + value
+
+    def new_totals() -> dict:
+        return {"count": 0, "seconds": 0.0, "cpu_seconds": 0.0, "max_seconds": 0.0, "peak_rss_bytes": 0,
+                "errors": 0, "counts": {}}
+
+    spans, series = {}, {}
+    for event in events:
+        add(spans.setdefault(event["name"], new_totals()), event)
+        key = json.dumps([event["name"], event["labels"]], sort_keys=True)
+        totals = series.setdefault(key, {"name": event["name"], "labels": event["labels"], **new_totals()})
+        add(totals, event)
+    for totals in list(spans.values()) + list(series.values()):
+        totals["rates"] = {
+            f"{counter}_per_second": value / totals["seconds"] for counter, value in totals["counts"].items()
+            if counter != "tracemalloc_peak_bytes" and totals["seconds"] > 0
+        }
+    return {"spans": spans, "series": list(series.values())}
+
+
+# function to format a Prometheus metric name or label value
+def prometheus_name(name: str) -> str:
+    """
+    :param name: name of a span, counter or label
+    :return: name made of letters, digits and underscores
+    """
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus_labels(labels: dict) -> str:
+    """
+    :param labels: dictionary {label: value}
+    :return: label set, e.g. {span="convert",station="KBOI"}
+    """
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{prometheus_name(label)}="{escape(value)}"' for label, value in labels.items()) + "}"
+
+
+# function to format the summary in the Prometheus text exposition format
+def to_prometheus(summary: dict) -> str:
+    """
+    :param summary: dictionary returned by summarize
+    :return: text with one sample per series of each metric
+    """
+    metrics = {
+        "weatherpred_span_count_total": ("counter", "Number of spans", "count"),
+        "weatherpred_span_seconds_total": ("counter", "Wall time of the spans in seconds", "seconds"),
+        "weatherpred_span_cpu_seconds_total": ("counter", "CPU time of the process during the spans in seconds",
+                                               "cpu_seconds"),
+        "weatherpred_span_max_seconds": ("gauge", "Longest span in seconds", "max_seconds"),
+        "weatherpred_span_peak_rss_bytes": ("gauge", "Peak resident memory of the process at the end of the spans",
+                                            "peak_rss_bytes"),
+        "weatherpred_span_errors_total": ("counter", "Number of spans that raised an exception", "errors"),
+    }
+    lines = []
+    for metric, (kind, help_text, field) in metrics.items():
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+        for totals in summary["series"]:
+            lines.append(f"{metric}{prometheus_labels({'span': totals['name'], **totals['labels']})} {totals[field]}")
+    counters = sorted({counter for totals in summary["series"] for counter in totals["counts"]})
+    for counter in counters:
+        if counter == "tracemalloc_peak_bytes":
+            metric, kind = "weatherpred_span_tracemalloc_peak_bytes", "gauge"
+        else:
+            metric, kind = f"weatherpred_span_{prometheus_name(counter)}_total", "counter"
+        lines += [f"# HELP {metric} Counter {counter} of the spans", f"# TYPE {metric} {kind}"]
+        for totals in summary["series"]:
+            if counter in totals["counts"]:
+                labels = prometheus_labels({'span': totals['name'], **totals['labels']})
+                lines.append(f"{metric}{labels} {totals['counts'][counter]}")
+    return "\n".join(lines) + "\n"
+
+
+# function to format the summary as a table with one row per span name
+def report(summary: dict) -> str:
+    """
+    :param summary: dictionary returned by summarize
+    :return: table of the spans by total wall time, with their counters and rates
+    """
+    lines = [f"{'span':<18}{'count':>7}{'seconds':>10}{'mean ms':>10}{'max ms':>10}{'cpu s':>9}{'peak MB':>9}  counters"]
+    for name, totals in sorted(summary["spans"].items(), key=lambda item: -item[1]["seconds"]):
+        counters = ", ".join(
+            [f"{counter} {value:.0f}" for counter, value in totals["counts"].items()]
+            + [f"{rate} {value:.0f}" for rate, value in totals["rates"].items()]
+        )
+        lines.append(f"{name:<18}{totals['count']:>7}{totals['seconds']:>10.2f}"
+                     f"{totals['seconds'] / totals['count'] * 1e3:>10.1f}{totals['max_seconds'] * 1e3:>10.1f}"
+                     f"{totals['cpu_seconds']:>9.2f}{totals['peak_rss_bytes'] / 2 ** 20:>9.0f}  {counters}")
+    return "\n".join(lines)
+
+
+# function to aggregate the events of a metrics directory into metrics.json and metrics.prom
+def write_reports(path: str = None) -> dict:
+    """
+    The files are written atomically, as the textfile collector may read them at any time
+    :param path: metrics directory (defaults to WEATHERPRED_METRICS)
+    :return: dictionary returned by summarize
+    """
+    path = path or metrics_path
+    summary = summarize(read_events(path))
+    for file_name, text in [("metrics.json", json.dumps(summary, indent=2)), ("metrics.prom", to_prometheus(summary))]:
+        tmp_path = os.path.join(path, file_name + ".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, os.path.join(path, file_name))
+    return summary
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else metrics_path
+    if path is None:
+        sys.exit("usage: python -m pipeline.instrumentation <metrics directory> (or set WEATHERPRED_METRICS)")
+    print(report(write_reports(path)))
+    print(f"Wrote {os.path.join(path, 'metrics.json')} and {os.path.join(path, 'metrics.prom')}")
@@ -0,0 +1,180 @@
+# weatherPred pipeline as a per-station DAG (see pipeline/dag.py), in place of the makefile targets that wipe their
+# output directories and re-run whole scripts:
+#
+#   scrape/{code} --> convert/{code} --> features/{code} --> grid_search --> predictions
+#                     weather_gov/{code} ---^
+#
+# convert and features only run for the stations whose data or code changed; grid_search runs when any station's
+# features changed. Downloads (--scrape) and predictions (--predictions) always run, the downloads only write the
+# files that changed on the server so the downstream tasks of unchanged stations stay cached.
+# usage: python -m pipeline.run [--scrape] [--cv] [--predictions] [--force]
+# with WEATHERPRED_METRICS set, the spans of the run are summarized at the end (see pipeline/instrumentation.py)
+
+import os
+import sys
+import glob
+import time
+from datetime import date
+from functools import partial
+
+from data import converter, feature_engineering
+from data.fetcher import Fetcher
+from data.ghcn_by_year import by_year_path, ingest_by_year, partitions_path
+from data.stations import StationRegistry, n_jobs
+from data.storage import table_path
+from pipeline.dag import Pipeline, Task, run_module
+from pipeline import instrumentation
+
+repo_path = os.path.normpath(os.path.join(os.path.dirname(__file__), ".."))
+cache_path = os.path.join(repo_path, ".pipeline_cache")
+model_manifest_path = os.path.join(repo_path, "saved_models/final_model/manifest.json")
+
+# source files of the code run by each stage
+converter_code = ["data/converter.py", "data/ghcn_by_year.py", "data/stations.py", "data/storage.py"]
+features_code = ["data/feature_engineering.py", "data/stations.py", "data/storage.py"]
+grid_search_code = ["models/evaluation/*.py", "models/modules/*.py", "models/model.py", "models/registry.py",
+                    "models/pooled.py", "models/artifact.py", "models/utils.py", "data/feature_engineering.py",
+                    "data/storage.py"]
+predictions_code = ["predictions/*.py", "models/*.py", "models/modules/*.py", "data/converter.py",
+                    "data/feature_engineering.py", "data/stations.py", "data/storage.py"]
+
+
+# function to list the source files matching glob patterns relative to the repository
+def code_files(patterns: list) -> list:
+    """
+    :param patterns: glob patterns relative to the repository root
+    :return: sorted list of paths
+    """
+    return sorted(path for pattern in patterns for path in glob.glob(os.path.join(repo_path, pattern)))
+
+
+# function to download the raw data of a station: its .dly file and, for the forecast stations, the weather.gov page
+def scrape_station(code: str, ghcn_id: str, forecast: bool) -> None:
+    """
+    :param code: station code
+    :param ghcn_id: GHCN ID of the station
+    :param forecast: whether the station is a forecast airport with weather.gov observations
+    :return: None
+    """
+    jobs = {f"{converter.noaa_in_path}/{code}.dly": f"https://www1.ncdc.noaa.gov/pub/data/ghcn/daily/all/{ghcn_id}.dly"}
+    if forecast:
+        jobs[f"{converter.weather_gov_in_path}/{code}.html"] = f"https://forecast.weather.gov/data/obhistory/{code}.html"
+    fetcher = Fetcher(max_workers=len(jobs))
+    failed = [r for r in fetcher.fetch_all(jobs, verbose=False) if r["status"] == "failed"]
+    fetcher.close()
+    if failed:
+        raise RuntimeError(f"Failed to download {failed[0]['url']}: {failed[0]['error']}")
+
+
+# function to convert the weather.gov page of a station to csv
+def convert_weather_gov(code: str) -> None:
+    """
+    :param code: station code
+    :return: None
+    """
+    os.makedirs(converter.weather_gov_out_path, exist_ok=True)
+    data = converter.html_to_csv(f"{converter.weather_gov_in_path}/{code}.html")
+    data.to_csv(f"{converter.weather_gov_out_path}/{code}.csv", index=False)
+
+
+# function to build the DAG of the pipeline
+def build_pipeline(registry: StationRegistry, scrape: bool = False, cv: bool = False, predictions: bool = False,
+                   jobs: int = None) -> Pipeline:
+    """
+    :param registry: stations of the pipeline
+    :param scrape: download the raw data first
+    :param cv: run the hyperparameter search and save the final model
+    :param predictions: download the latest observations and print the predictions
+    :param jobs: number of worker processes (defaults to WEATHERPRED_JOBS)
+    :return: pipeline
+    """
+    pipeline = Pipeline(cache_path, jobs=jobs or n_jobs)
+    forecast = set(registry.forecast_codes())
+    today = date.today().isoformat()
+    os.makedirs(converter.noaa_out_path, exist_ok=True)
+    os.makedirs(feature_engineering.out_path, exist_ok=True)
+
+    # the by-year archives are split into per-station partitions by a single task, as each archive holds every station
+    ingest = None
+    if os.path.isdir(by_year_path) and glob.glob(os.path.join(by_year_path, "*.csv.gz")):
+        ingest = pipeline.add(Task(
+            "ingest_by_year", "ingest_by_year",
+            partial(ingest_by_year, {code: registry.ghcn_id(code) for code in registry}, verbose=False),
+            inputs=sorted(glob.glob(os.path.join(by_year_path, "*.csv.gz"))), code=code_files(converter_code),
+            params={"stations": registry.codes()},
+        ))
+
+    features = []
+    for code in registry:
+        dly_path = f"{converter.noaa_in_path}/{code}.dly"
+        html_path = f"{converter.weather_gov_in_path}/{code}.html"
+        weather_gov_csv = f"{converter.weather_gov_out_path}/{code}.csv"
+        deps = []
+        if scrape:
+            deps.append(pipeline.add(Task(f"scrape/{code}", "scrape",
+                                          partial(scrape_station, code, registry.ghcn_id(code), code in forecast),
+                                          volatile=True)).name)
+        elif not os.path.exists(dly_path) and not os.path.isdir(os.path.join(partitions_path, code)):
+            # no raw data for the station
+            continue
+
+        # NOAA history, merged with the by-year partitions if any
+        noaa_table = table_path(converter.noaa_out_path, code)
+        pipeline.add(Task(
+            f"convert/{code}", "convert", partial(converter.convert_station, code),
+            inputs=[dly_path, os.path.join(partitions_path, code)], outputs=[noaa_table],
+            code=code_files(converter_code), deps=deps + ([ingest.name] if ingest else []),
+        ))
+
+        # weather.gov observations of the forecast stations
+        feature_deps = [f"convert/{code}"]
+        if code in forecast and (scrape or os.path.exists(html_path)):
+            pipeline.add(Task(
+                f"weather_gov/{code}", "weather_gov", partial(convert_weather_gov, code),
+                inputs=[html_path], outputs=[weather_gov_csv], code=code_files(converter_code), deps=deps,
+            ))
+            feature_deps.append(f"weather_gov/{code}")
+
+        # the features drop the last days of NOAA data relative to today, so they are recomputed every day
+        features.append(pipeline.add(Task(
+            f"features/{code}", "features", partial(feature_engineering.process_station, code),
+            inputs=[noaa_table, weather_gov_csv], outputs=[table_path(feature_engineering.out_path, code)],
+            code=code_files(features_code), deps=feature_deps, params={"date": today},
+        )))
+
+    if cv:
+        pipeline.add(Task(
+            "grid_search", "grid_search", partial(run_module, "models.evaluation.grid_search"),
+            inputs=[task.outputs[0] for task in features], outputs=[model_manifest_path],
+            code=code_files(grid_search_code), deps=[task.name for task in features],
+        ))
+    if predictions:
+        pipeline.add(Task(
+            "predictions", "predictions", run_predictions,
+            inputs=[model_manifest_path], code=code_files(predictions_code),
+            deps=["grid_search"] if cv else [], volatile=True,
+        ))
+    return pipeline
+
+
+# function to download the latest observations and print the predictions
+def run_predictions() -> None:
+    """
+    :return: None
+    """
+    run_module("predictions.download_new", "--online")
+    run_module("predictions.predictions")
+
+
+if __name__ == '__main__':
+    start_time = time.time()
+    pipeline = build_pipeline(StationRegistry.load(), scrape="--scrape" in sys.argv[1:], cv="--cv" in sys.argv[1:],
+                              predictions="--predictions" in sys.argv[1:])
+    results = pipeline.run(force="--force" in sys.argv[1:])
+    print(pipeline.report(results))
+    print(f"Time taken: {time.time() - start_time:.2f} seconds")
+    if instrumentation.metrics_path is not None:
+        # spans of this run and of the workers and scripts it started, which inherit WEATHERPRED_METRICS
+        print(instrumentation.report(instrumentation.write_reports()))
+    if any(result["status"] == "failed" for result in results.values()):
+        sys.exit(1)
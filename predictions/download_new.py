@@ -2,126 +2,109 @@
 
 from data.scraper import weather_gov_scraper
 from data.converter import html_to_csv
-from data.feature_engineering import feature_engineering_weather_gov_data
+from data.feature_engineering import feature_engineering_noaa_climate_data as build_features_for_station
+from data.feature_engineering import OnlineFeatures, load_daily_climate, target_names
+from data.stations import StationRegistry, run_sharded
+from data.storage import table_path, write_table
+from pipeline.instrumentation import span
 
 import os
-import requests
+import sys
+from functools import partial
+import numpy as np
 import pandas as pd
-from datetime import datetime, timedelta
 
 
+# function to perform feature engineering on a city's NOAA data combined with the newly downloaded weather.gov data
 def feature_engineering_noaa_climate_data(file_path: str) -> pd.DataFrame:
     """
-    :param file_path: Path to the CSV file containing the climate data for a specific city.
+    :param file_path: Path to the table (see data/storage.py) containing the climate data for a specific city.
     :returns: A pandas DataFrame with the feature-engineered climate data.
     """
-    # Load the NOAA dataset
-    noaa_df = pd.read_csv(file_path, parse_dates=['DATE'])
-
-    # Filter out today and prior 2 days of data due to incompleteness
-    # We will augment it with the weather.gov dataset
-    noaa_df = noaa_df[noaa_df['DATE'] < (pd.Timestamp.now() - timedelta(days=4))]
-
-    # Climate variables of interest
-    climate_vars = ['PRCP', 'TMIN', 'TAVG', 'TMAX']
-    noaa_df = noaa_df[['DATE'] + climate_vars]
-
-    # Convert temperature variables from tenths of a degree Celsius to Farenheit
-    # (see NOAA docs: https://www.ncei.noaa.gov/pub/data/ghcn/daily/readme.txt)
-    noaa_df['TMIN'] = noaa_df['TMIN'] / 10 * (9 / 5) + 32
-    noaa_df['TAVG'] = noaa_df['TAVG'] / 10 * (9 / 5) + 32
-    noaa_df['TMAX'] = noaa_df['TMAX'] / 10 * (9 / 5) + 32
-
-    # Load the weather.gov dataset, which is already measured in Farenheit
-    weather_gov_file_path = "predictions/new_data/to_csv/"
-    station = file_path[-8:]
-    weather_gov_df = feature_engineering_weather_gov_data(weather_gov_file_path + station)
-    print("weather gov")
-    print(weather_gov_df.tail(1))
-    print("noaa")
-    print(noaa_df.tail(1))
-
-    # Combine the two datasets
-    df = pd.concat([noaa_df, weather_gov_df], axis=0)
-    print("df")
-    print(df.tail(1))
-
-    # Add year, month columns for plotting
-    df['YEAR'] = df['DATE'].dt.year
-    # Drop all observations before Year 2013
-    df = df[df['YEAR'] >= 2013]
-    df['MONTH'] = df['DATE'].dt.month
-
-    # Add a column for the day of the year
-    df['DAY_OF_YEAR'] = df['DATE'].dt.dayofyear
-
-    # Add a column for the week of the year
-    df['WEEK_OF_YEAR'] = df['DATE'].dt.isocalendar().week
-
-    # Add a column for the season
-    # season_map = {1: 'Winter', 2: 'Spring', 3: 'Summer', 4: 'Fall'}
-    df['SEASON'] = (df['DATE'].dt.month % 12 + 3) // 3
-
-    # Add columns for lagged versions of the climate variables
-    for var in climate_vars:
-        # Create a dictionary of forward and backward lagged columns
-        # Forward lags are for multi-day out prediction, backward lags are predictors
-        backward_lagged_columns = {f'{var}_lag_{i}': df[var].shift(i) for i in range(1, 30 + 1)}
-        forward_lagged_columns = {f'{var}_lag_{i}': df[var].shift(i) for i in range(-1, -4 - 1, -1)}
-        # Convert dictionaries to DataFrame and concatenate
-        backward_lagged_df = pd.DataFrame(backward_lagged_columns)
-        forward_lagged_df = pd.DataFrame(forward_lagged_columns)
-        df = pd.concat([df, backward_lagged_df, forward_lagged_df], axis=1)
-
-    # Add columns for the mean over a 5-day window for each climate variable
-    # based on the values of this window last year
-    for var in climate_vars:
-        df[f'{var}_mean_5d_window'] = df[var].shift(365).rolling(window=5).mean()
-
-    # Drop date column and convert all values in the df to float
-    df = df.drop('DATE', axis=1).astype(float)
-
-    # Drop all observations with missing values
-    df = df.dropna()
-
-    # Re-order columns so today's climate variables and negative lags are at the beginning
-    df = df[[item for sublist in [
-        ['TMIN', 'TMAX', 'TAVG'],  # Basic variables
-        *[
-            [f'TMIN_lag_{i}', f'TAVG_lag_{i}', f'TMAX_lag_{i}']
-            for i in range(-1, -5, -1)
-        ],  # Negative lags
-        *[
-            [f'TMIN_lag_{i}', f'TAVG_lag_{i}', f'TMAX_lag_{i}', f'PRCP_lag_{i}']
-            for i in range(1, 31)
-        ],  # Positive lags
-        [
-            f'{var}_mean_5d_window' for var in climate_vars
-        ],  # Mean window variables
-        ['YEAR', 'MONTH', 'DAY_OF_YEAR', 'WEEK_OF_YEAR', 'SEASON'],  # Time features
-    ] for item in sublist]]
-
-    return df
+    # The weather.gov data of the prediction run is in predictions/new_data/to_csv
+    station = os.path.splitext(os.path.basename(file_path))[0]
+    weather_gov_file_path = os.path.join(weather_gov_converted_path, station + ".csv")
+    return build_features_for_station(file_path, weather_gov_file_path=weather_gov_file_path)
+
+
+# function to compute only the new feature rows of a city from its rolling online state
+def online_feature_engineering(file_path: str, state_dir: str, revision_days: int = 60) -> pd.DataFrame:
+    """
+    The first call for a station builds its state from the full history; later calls only feed the last
+    revision_days days (NOAA revisions and the new weather.gov days) to the state.
+    :param file_path: Path to the table (see data/storage.py) containing the climate data for a specific city.
+    :param state_dir: Directory of the per-station OnlineFeatures states.
+    :param revision_days: Number of trailing days whose observations may have been revised since the last run.
+    :returns: A pandas DataFrame with the layout of the processed data (targets unknown, i.e. NaN) for the days not
+              returned by the previous call, the last row being the day after the last observation; if no day was
+              added, only that forecast row, so the table written for the predictions is never empty.
+    """
+    station = os.path.splitext(os.path.basename(file_path))[0]
+    state_path = os.path.join(state_dir, station + ".npz")
+    daily = load_daily_climate(file_path, os.path.join(weather_gov_converted_path, station + ".csv"))
+    if os.path.exists(state_path):
+        state = OnlineFeatures.load(state_path)
+        daily = daily[daily['DATE'] >= pd.Timestamp(state.last_observed) - pd.Timedelta(days=revision_days)]
+    else:
+        state = OnlineFeatures()
+    X = state.update(daily)
+    if X.empty:
+        # no new day: the forecast row was returned by a previous call, build it again from the state
+        X = state.features(np.array([state.last_observed + 1], dtype='datetime64[D]'))
+    state.save(state_path)
+    # targets are unknown for the new days
+    y = pd.DataFrame(np.nan, index=X.index, columns=target_names())
+    return pd.concat([y, X], axis=1).reset_index(drop=True)
+
+
+# function to compute the feature rows of a registered station, run by the workers of run_sharded
+def process_station(code: str, online: bool = False) -> int:
+    """
+    :param code: station code (see data/stations.py)
+    :param online: only compute the feature rows of the new days from the station's rolling state
+    :returns: number of feature rows written, None if the station has no converted NOAA table
+    """
+    file_path = table_path(noaa_converted_file_path, code)
+    if not os.path.exists(file_path):
+        return None
+    with span("features", station=code, online=online) as s:
+        # Perform feature engineering on the climate data
+        if online:
+            engineered_data = online_feature_engineering(file_path, online_state_path)
+        else:
+            engineered_data = feature_engineering_noaa_climate_data(file_path)
+        # Save the feature-engineered data in the storage format
+        write_table(engineered_data, table_path(weather_gov_processed_path, code))
+        s.add("rows", len(engineered_data))
+    return len(engineered_data)
 
 
 weather_gov_raw_path = os.path.join(os.path.dirname(__file__), "new_data")
 weather_gov_converted_path = os.path.join(os.path.dirname(__file__), "new_data/to_csv")
 weather_gov_processed_path = os.path.join(os.path.dirname(__file__), "new_data/processed")
+online_state_path = os.path.join(os.path.dirname(__file__), "new_data/state")
 noaa_converted_file_path = os.path.join(os.path.dirname(__file__), "../data/raw_data/noaa/to_csv")
-noaa_files = os.listdir(noaa_converted_file_path)
 
-# create the output directory if it doesn't exist
-if not os.path.exists(weather_gov_raw_path):
-    os.makedirs(weather_gov_raw_path)
 
-if not os.path.exists(weather_gov_converted_path):
-    os.makedirs(weather_gov_converted_path)
+# function to create the output directories
+def make_directories() -> None:
+    """
+    :return: None
+    """
+    for path in [weather_gov_raw_path, weather_gov_converted_path, weather_gov_processed_path, online_state_path]:
+        os.makedirs(path, exist_ok=True)
 
-if not os.path.exists(weather_gov_processed_path):
-    os.makedirs(weather_gov_processed_path)
 
-if __name__ == "__main__":
-    weather_gov_scraper(weather_gov_raw_path, verbose=True)
+# function to download the weather.gov pages and write the feature rows of the registered stations
+def main() -> None:
+    """
+    :return: None
+    """
+    # pass --online to only compute the feature rows of the new days from the per-station rolling state
+    online = "--online" in sys.argv[1:]
+    make_directories()
+    registry = StationRegistry.load()
+    weather_gov_scraper(weather_gov_raw_path, verbose=True, registry=registry)
     for file in os.listdir(weather_gov_raw_path):
         # skip the file if it is a directory
         if os.path.isdir(f"{weather_gov_raw_path}/{file}"):
@@ -133,11 +116,10 @@ if __name__ == "__main__":
             # save the file to csv format
             data.to_csv(f"{weather_gov_converted_path}/{file.replace('.html', '.csv')}", index=False)
 
-    for file in noaa_files:
-        print(f"Processing {file}")
-        # Skip the stations file
-        if 'stations' not in file:
-            # Perform feature engineering on the climate data
-            engineered_data = feature_engineering_noaa_climate_data(os.path.join(noaa_converted_file_path, file))
-            # Save the feature-engineered data to a new CSV file
-            engineered_data.to_csv(f"{weather_gov_processed_path}/{file}", index=False)
+    # process the registered stations in shards, in parallel within a shard
+    for code, n_rows in run_sharded(partial(process_station, online=online), registry):
+        print(f"Processed {code}: {n_rows} rows" if n_rows is not None else f"No NOAA data for station {code}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,111 +1,131 @@
 # predictions.py
+# runs as a fresh process every day: importing this module does no work, and the model only imports the sklearn
+# estimators of the family stored in the artifact (see models/model.py)
 
 import os
+import sys
 import random
 import numpy as np
 import pandas as pd
 from datetime import datetime
 from zoneinfo import ZoneInfo
+from data.stations import StationRegistry
+from data.storage import table_files
 from models.utils import folder_to_data_dict
 from models.model import MultiStationModel
+from models.retrain import RetrainPolicy
 
 # Paths
 base_dir = os.path.dirname("./")
 data_dir = os.path.join(base_dir, 'predictions', 'new_data', 'processed')
 model_dir = os.path.join(base_dir, 'saved_models')
-model_path = os.path.join(model_dir, 'final_model.pkl')
-
-# Set seed
-random.seed(604)
-
-# Get list of data files
-files = [os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.endswith('.csv')]
-
-# Use folder_to_data_dict to get the data
-data = folder_to_data_dict(files)
-
-# Prepare to collect all predictions
-all_predictions = []
-
-# Current date
-est = ZoneInfo("America/New_York")
-current_date = datetime.now(est).strftime("%Y-%m-%d")
-
-# Load the pre-trained model
-model = MultiStationModel.load(model_path)
-model.fit(data, verbose=False)
-
-# List of station codes in the specified order
-stations_order = [
-    "PANC",  # Anchorage
-    "KBOI",  # Boise
-    "KORD",  # Chicago
-    "KDEN",  # Denver
-    "KDTW",  # Detroit
-    "PHNL",  # Honolulu
-    "KIAH",  # Houston
-    "KMIA",  # Miami
-    "KMIC",  # Minneapolis
-    "KOKC",  # Oklahoma City
-    "KBNA",  # Nashville
-    "KJFK",  # New York
-    "KPHX",  # Phoenix
-    "KPWM",  # Portland ME
-    "KPDX",  # Portland OR
-    "KSLC",  # Salt Lake City
-    "KSAN",  # San Diego
-    "KSFO",  # San Francisco
-    "KSEA",  # Seattle
-    "KDCA",  # Washington DC
-]
-
-# Iterate over each station in the specified order
-for station_code in stations_order:
-    if station_code in data:
-        X, y = data[station_code]
-        # Use the last row of X as features
-        X_last = X.tail(1)
-        # Check if the model for this station exists
-        if station_code in model.models:
-            station_model = model.models[station_code]
-            # Make prediction
-            y_pred = station_model.predict(X_last)
-            y_pred = y_pred.flatten()
-            y_pred = np.round(y_pred, 1)
-            first_avg = y_pred[2]
-            first_max = y_pred[1]
-            y_pred[1] = first_avg
-            y_pred[2] = first_max
-            # Collect predictions
-            all_predictions.extend(y_pred.tolist())
-        else:
-            print(f"No model found for station {station_code}")
-            # Append NaNs for missing predictions (15 values)
-            all_predictions.extend([np.nan] * 15)
+model_path = os.path.join(model_dir, 'final_model')
+# pickle written by earlier versions of grid_search.py
+legacy_model_path = os.path.join(model_dir, 'final_model.pkl')
+# training data used when a station model has to be refitted
+train_dir = os.path.join(base_dir, 'data', 'processed_data')
+
+
+# function to load the model and refit the station models that are due according to the retrain policy
+def load_model(stations_order: list, data: dict, retrain: bool = False) -> MultiStationModel:
+    """
+    :param stations_order: station codes in submission order
+    :param data: dictionary {station: (X, y)} of the new feature rows
+    :param retrain: refit every station model
+    :return: model, only the manifest is read, each station model is read when it is first used
+    """
+    # predictions use the persisted station models as they are
+    model = MultiStationModel.load(model_path if os.path.isdir(model_path) else legacy_model_path,
+                                   stations=stations_order)
+
+    # refit only the station models that are due according to the retrain policy (pass --retrain to refit all)
+    policy = RetrainPolicy(max_age_days=7, drift_threshold=3.0)
+    if retrain:
+        stale = {station: "forced" for station in data}
     else:
-        print(f"No data found for station {station_code}")
-        # Append NaNs for missing predictions (15 values)
-        all_predictions.extend([np.nan] * 15)
-
-# Check if we have 300 predictions
-if len(all_predictions) != 300:
-    print(f"Expected 300 predictions, but got {len(all_predictions)}.")
-
-# Format the output
-formatted_predictions = ', '.join(f"{num:.1f}" if not np.isnan(num) else "NaN" for num in all_predictions)
-output = f'"{current_date}", {formatted_predictions}'
-
-# Save the output to a CSV file named "predictions_{date}.csv"
-output_csv_filename = f"predictions/intermediate/predictions_{current_date}.csv"
-output_csv_path = os.path.join(base_dir, output_csv_filename)
-    
-# Create a DataFrame for the CSV
-# Column names: Date, Pred1, Pred2, ..., Pred300
-column_names = ['Date'] + [f'Pred{i+1}' for i in range(300)]
-data_row = [current_date] + all_predictions
-predictions_df = pd.DataFrame([data_row], columns=column_names)
-    
-predictions_df.to_csv(output_csv_path, index=False)
-
-# Print the output
-print(output)
+        stale = policy.reasons(model, {station: X.tail(1) for station, (X, y) in data.items()})
+    if stale and os.path.isdir(train_dir):
+        train_files = [f for f in table_files(train_dir) if os.path.splitext(os.path.basename(f))[0] in stale]
+        if train_files:
+            # a pooled model is refitted on the data of every station
+            if model.pooled:
+                train_files = table_files(train_dir)
+            model.fit(folder_to_data_dict(train_files), verbose=False)
+            model.save(model_path)
+    return model
+
+
+# function to predict the 300 values of the submission from the last feature row of each station
+def predict_all(model: MultiStationModel, data: dict, stations_order: list) -> list:
+    """
+    :param model: model of the stations
+    :param data: dictionary {station: (X, y)} of the new feature rows
+    :param stations_order: station codes in submission order
+    :return: list of 300 predictions rounded to 0.1, NaN for stations without data or model
+    """
+    # Report stations that cannot be predicted
+    for station_code in stations_order:
+        if station_code not in data:
+            print(f"No data found for station {station_code}")
+        elif station_code not in model.models:
+            print(f"No model found for station {station_code}")
+
+    # Predict all stations in one call from the last feature row of each station, shape (20, 1, 15);
+    # stations without data or model get NaNs for their 15 values
+    X_last = model.stack_features({station: X for station, (X, y) in data.items()}, stations_order)
+    y_pred = model.predict_batch(X_last, stations_order)[:, -1, :]
+    # the first day is ordered TMIN, TMAX, TAVG: swap to TMIN, TAVG, TMAX like the other days
+    y_pred[:, [1, 2]] = y_pred[:, [2, 1]]
+    return np.round(y_pred, 1).ravel().tolist()
+
+
+# function to write and print the predictions of the day, pass --retrain to refit every station model
+def main() -> None:
+    """
+    :return: None
+    """
+    # Set seed
+    random.seed(604)
+
+    # Station codes in submission order
+    stations_order = StationRegistry.build().forecast_codes()
+
+    # Get list of data files, only the forecast stations are read
+    files = [f for f in table_files(data_dir) if os.path.splitext(os.path.basename(f))[0] in stations_order]
+
+    # Use folder_to_data_dict to get the data
+    data = folder_to_data_dict(files)
+
+    # Current date
+    est = ZoneInfo("America/New_York")
+    current_date = datetime.now(est).strftime("%Y-%m-%d")
+
+    model = load_model(stations_order, data, retrain='--retrain' in sys.argv[1:])
+    all_predictions = predict_all(model, data, stations_order)
+
+    # Check if we have 300 predictions
+    if len(all_predictions) != 300:
+        print(f"Expected 300 predictions, but got {len(all_predictions)}.")
+
+    # Format the output
+    formatted_predictions = ', '.join(f"{num:.1f}" if not np.isnan(num) else "NaN" for num in all_predictions)
+    output = f'"{current_date}", {formatted_predictions}'
+
+    # Save the output to a CSV file named "predictions_{date}.csv"
+    output_csv_filename = f"predictions/intermediate/predictions_{current_date}.csv"
+    output_csv_path = os.path.join(base_dir, output_csv_filename)
+
+    # Create a DataFrame for the CSV
+    # Column names: Date, Pred1, Pred2, ..., Pred300
+    column_names = ['Date'] + [f'Pred{i+1}' for i in range(300)]
+    data_row = [current_date] + all_predictions
+    predictions_df = pd.DataFrame([data_row], columns=column_names)
+
+    predictions_df.to_csv(output_csv_path, index=False)
+
+    # Print the output
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
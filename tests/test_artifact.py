@@ -0,0 +1,70 @@
+# Model artifacts: a loaded artifact predicts like the fitted model and can be saved again after predicting
+
+import numpy as np
+import pytest
+
+from benchmarks.dtypes import missing_rate
+from benchmarks.features import make_daily_climate
+from data.feature_engineering import build_features
+from data.storage import table_files, table_path, write_table
+from models.model import MultiStationModel
+from models.utils import folder_to_data_dict
+
+# small models of each family, the exact GP included
+family_models = {
+    "ridge": {"alpha": 615},
+    "random_forest": {"n_estimators": 5, "min_samples_leaf": 5, "max_features": "sqrt"},
+    "exact_gp": {"length_scale": 10, "sigma": 1, "kernel": "rbf", "approximation": None},
+    "nystroem_gp": {"length_scale": 10, "sigma": 1, "kernel": "matern", "approximation": "nystroem",
+                    "n_components": 20},
+}
+
+
+@pytest.fixture(scope="module")
+def data(tmp_path_factory):
+    processed_dir = tmp_path_factory.mktemp("processed")
+    for i in range(2):
+        features = build_features(make_daily_climate(2, missing_rate=missing_rate, seed=i))
+        write_table(features, table_path(str(processed_dir), f"S{i:03d}"))
+    return folder_to_data_dict(table_files(str(processed_dir)))
+
+
+def predict(model: MultiStationModel, data: dict) -> dict:
+    return model.predict({station: X for station, (X, _) in data.items()})
+
+
+@pytest.mark.parametrize("compress", [True, False])
+@pytest.mark.parametrize("family", list(family_models))
+def test_load_predict_save_again(data, tmp_path, family, compress):
+    kwargs = family_models[family]
+    model_name = "ridge" if family == "ridge" else "random_forest" if family == "random_forest" \
+        else "gaussian_process"
+    model = MultiStationModel(model_name, **kwargs)
+    model.fit(data, verbose=False)
+    expected = predict(model, data)
+    path = str(tmp_path / "model")
+    model.save(path, compress=compress)
+
+    loaded = MultiStationModel.load(path)
+    for station, y_pred in predict(loaded, data).items():
+        np.testing.assert_allclose(y_pred, expected[station])
+
+    # the restored station models are saved again, to another directory and over the artifact itself
+    other_path = str(tmp_path / "copy")
+    loaded.save(other_path, compress=compress)
+    loaded.save(path, compress=not compress)
+    for saved_path in [other_path, path]:
+        for station, y_pred in predict(MultiStationModel.load(saved_path), data).items():
+            np.testing.assert_allclose(y_pred, expected[station])
+
+
+def test_predict_batch_without_station_models(data, tmp_path):
+    model = MultiStationModel("ridge", **family_models["ridge"])
+    model.fit(data, verbose=False)
+    model.save(str(tmp_path / "model"))
+    # none of the requested stations is in the artifact
+    loaded = MultiStationModel.load(str(tmp_path / "model"), stations=["KAAA", "KBBB"])
+    X = np.zeros((2, 3, len(model.feature_names)))
+    for empty in [loaded, MultiStationModel("ridge")]:
+        y_pred = empty.predict_batch(X, ["KAAA", "KBBB"])
+        assert y_pred.shape == (2, 3, 15) and np.isnan(y_pred).all()
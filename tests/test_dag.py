@@ -0,0 +1,26 @@
+# Pipeline tasks: failures are reported with the time the task ran, whether they come from the task or its span
+
+from contextlib import contextmanager
+
+from pipeline import dag
+
+
+def test_task_error_is_reported():
+    def fail():
+        raise RuntimeError("no data")
+
+    seconds, error = dag.execute(fail, name="convert/KBOI", stage="convert")
+    assert error == "RuntimeError: no data"
+    assert seconds >= 0
+
+
+def test_span_error_is_reported(monkeypatch):
+    @contextmanager
+    def broken_span(name, **labels):
+        raise OSError("metrics file not writable")
+        yield
+
+    monkeypatch.setattr(dag, "span", broken_span)
+    seconds, error = dag.execute(lambda: None, name="convert/KBOI", stage="convert")
+    assert error == "OSError: metrics file not writable"
+    assert seconds >= 0
@@ -0,0 +1,33 @@
+# Online feature rows of the predictions: every run writes the forecast row, also when no day was observed since the
+# previous run (the makefile deletes the processed tables before each run)
+
+import os
+import pandas as pd
+
+from benchmarks.features import make_daily_climate
+from data.storage import read_table, table_path, write_table
+from predictions import download_new
+
+
+def test_online_run_twice_for_same_observed_day(tmp_path, monkeypatch):
+    for name in ["noaa_converted_file_path", "weather_gov_converted_path", "weather_gov_processed_path",
+                 "online_state_path"]:
+        os.makedirs(tmp_path / name)
+        monkeypatch.setattr(download_new, name, str(tmp_path / name))
+    write_table(make_daily_climate(3, end="2024-12-31", missing_rate=0),
+                table_path(str(tmp_path / "noaa_converted_file_path"), "KAAA"))
+    processed = table_path(str(tmp_path / "weather_gov_processed_path"), "KAAA")
+
+    tables = []
+    for _ in range(2):
+        if os.path.exists(processed):
+            os.remove(processed)
+        assert download_new.process_station("KAAA", online=True) == 1
+        tables.append(read_table(processed))
+
+    for df in tables:
+        assert len(df) == 1
+        # the forecast row: the day after the last observation, with every predictor
+        assert df[["YEAR", "MONTH", "DAY_OF_YEAR"]].values.tolist() == [[2025, 1, 1]]
+        assert not df[df.columns[len(download_new.target_names()):]].isna().any(axis=None)
+    pd.testing.assert_frame_equal(tables[0], tables[1])
@@ -0,0 +1,84 @@
+# Fetcher against the local stand-in server of benchmarks/fetch.py: conditional GETs and retries of broken bodies
+
+import os
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.fetch import StandInHandler, serve_directory
+from data.fetcher import Fetcher
+
+
+@pytest.fixture
+def remote(tmp_path):
+    remote_dir = tmp_path / "remote"
+    remote_dir.mkdir()
+    (remote_dir / "S000.dly").write_bytes(b"first version\n" * 1000)
+    server = serve_directory(str(remote_dir))
+    yield remote_dir, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_not_modified_then_changed(remote, tmp_path):
+    remote_dir, base_url = remote
+    local_path = str(tmp_path / "S000.dly")
+    fetcher = Fetcher(max_workers=2)
+
+    first = fetcher.fetch(f"{base_url}/S000.dly", local_path)
+    assert first["status"] == "downloaded"
+    assert first["bytes"] == os.path.getsize(remote_dir / "S000.dly")
+
+    # unchanged on the server: revalidated with its ETag, nothing transferred
+    second = fetcher.fetch(f"{base_url}/S000.dly", local_path)
+    assert second["status"] == "not_modified"
+    assert second["bytes"] == 0
+
+    # changed on the server: downloaded again and replaced
+    (remote_dir / "S000.dly").write_bytes(b"second version\n" * 500)
+    third = fetcher.fetch(f"{base_url}/S000.dly", local_path)
+    assert third["status"] == "downloaded"
+    with open(local_path, "rb") as f:
+        assert f.read() == b"second version\n" * 500
+    fetcher.close()
+
+
+class ResetHandler(StandInHandler):
+    """
+    Sends the headers and half of the body, then closes the connection, for the first n_resets requests
+    """
+    n_resets = 1
+    lock = threading.Lock()
+
+    def do_GET(self) -> None:
+        with self.lock:
+            reset = ResetHandler.n_resets > 0
+            ResetHandler.n_resets -= 1
+        if not reset:
+            return super().do_GET()
+        body = open(self.translate_path(self.path), "rb").read()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body[:len(body) // 2])
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def test_retry_when_body_is_cut(remote, tmp_path):
+    remote_dir, _ = remote
+    ResetHandler.n_resets = 1
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(ResetHandler, directory=str(remote_dir)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    local_path = str(tmp_path / "S000.dly")
+    fetcher = Fetcher(max_workers=1, backoff_factor=0.01)
+    result = fetcher.fetch(f"http://127.0.0.1:{server.server_address[1]}/S000.dly", local_path)
+    fetcher.close()
+    server.shutdown()
+
+    assert result["status"] == "downloaded"
+    with open(local_path, "rb") as f:
+        assert f.read() == (remote_dir / "S000.dly").read_bytes()
+    # no partial download left behind
+    assert not [name for name in os.listdir(tmp_path / ".http_cache") if name.endswith(".part")]
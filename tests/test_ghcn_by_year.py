@@ -0,0 +1,87 @@
+# GHCN by-year ingestion: the partitions written for each station and year, and how they are read back
+
+import os
+import numpy as np
+import pandas as pd
+
+from data.ghcn_by_year import ingest_by_year_file, read_station_partitions
+from data.storage import storage_extensions, storage_format, table_path, write_table
+
+stations = {"KAAA": "USW00000001", "KBBB": "USW00000002", "KCCC": "USW00000003"}
+# ID, YYYYMMDD, ELEMENT, DATA_VALUE, M-FLAG, Q-FLAG, S-FLAG, OBS-TIME; KCCC does not report in 2024
+archive_rows = [
+    ["USW00000002", "20240102", "TMAX", 50, "", "", "W", "0700"],
+    ["USW00000001", "20240101", "TMAX", 10, "", "", "W", "0700"],
+    ["XXX00000009", "20240101", "TMAX", 99, "", "", "W", "0700"],
+    ["USW00000001", "20240101", "TMIN", -5, "", "", "W", "0700"],
+    ["USW00000002", "20240101", "PRCP", 3, "", "", "W", "0700"],
+    ["USW00000001", "20240102", "TMAX", 12, "", "", "W", "0700"],
+    ["USW00000001", "20240102", "SNOW", 7, "", "", "W", "0700"],
+    ["USW00000002", "20240101", "TMAX", 40, "", "", "W", "0700"],
+]
+
+
+def write_archive(path, rows) -> str:
+    file_path = os.path.join(path, "2024.csv.gz")
+    pd.DataFrame(rows).to_csv(file_path, header=False, index=False)
+    return file_path
+
+
+def test_partition_contents(tmp_path):
+    out_path = str(tmp_path / "partitions")
+    # a chunk size smaller than the archive, so that a station's rows are spread over several chunks
+    written = ingest_by_year_file(write_archive(tmp_path, archive_rows), stations, out_path, chunksize=3)
+    assert written == {"KAAA": 2, "KBBB": 2}
+    assert sorted(os.listdir(out_path)) == ["KAAA", "KBBB"]
+    assert os.listdir(os.path.join(out_path, "KAAA")) == [f"2024{storage_extensions[storage_format]}"]
+
+    df = read_station_partitions("KAAA", out_path)
+    assert list(df.columns) == ["STATION_ID", "YEAR", "MONTH", "DAY", "DATE", "PRCP", "TMAX", "TMIN"]
+    assert (df["STATION_ID"] == "USW00000001").all()
+    assert df["DATE"].tolist() == [pd.Timestamp("2024-01-01"), pd.Timestamp("2024-01-02")]
+    assert df[["YEAR", "MONTH", "DAY"]].values.tolist() == [[2024, 1, 1], [2024, 1, 2]]
+    assert df["TMAX"].tolist() == [10, 12]
+    assert df["TMIN"].iloc[0] == -5 and np.isnan(df["TMIN"].iloc[1])
+    # SNOW is not ingested, PRCP is only reported by the other station
+    assert df["PRCP"].isna().all()
+
+    df = read_station_partitions("KBBB", out_path)
+    assert df["TMAX"].tolist() == [40, 50]
+    assert df["PRCP"].iloc[0] == 3 and np.isnan(df["PRCP"].iloc[1])
+    assert read_station_partitions("KCCC", out_path) is None
+
+
+def test_station_stops_reporting(tmp_path):
+    out_path = str(tmp_path / "partitions")
+    ingest_by_year_file(write_archive(tmp_path, archive_rows), stations, out_path)
+    # the archive of the year is ingested again without the rows of KBBB
+    rows = [row for row in archive_rows if row[0] != "USW00000002"]
+    assert ingest_by_year_file(write_archive(tmp_path, rows), stations, out_path) == {"KAAA": 2}
+    assert read_station_partitions("KBBB", out_path) is None
+
+
+def test_one_partition_per_year(tmp_path):
+    out_path = str(tmp_path / "partitions")
+    other_format = "feather" if storage_format != "feather" else "parquet"
+    stale = pd.DataFrame({"STATION_ID": ["USW00000001"], "YEAR": [2024], "MONTH": [1], "DAY": [1],
+                          "DATE": [pd.Timestamp("2024-01-01")], "TMAX": [0.0]})
+    os.makedirs(os.path.join(out_path, "KAAA"))
+    write_table(stale, table_path(os.path.join(out_path, "KAAA"), "2024", other_format))
+    write_table(stale.assign(YEAR=2023, DATE=pd.Timestamp("2023-01-01")),
+                table_path(os.path.join(out_path, "KAAA"), "2023", other_format))
+
+    # a partition of the same year written in another format is read once, the most recent one
+    newer = table_path(os.path.join(out_path, "KAAA"), "2024")
+    write_table(stale.assign(TMAX=1.0), newer)
+    os.utime(newer, (os.path.getmtime(newer) + 10,) * 2)
+    df = read_station_partitions("KAAA", out_path)
+    assert df["YEAR"].tolist() == [2023, 2024]
+    assert df["TMAX"].tolist() == [0, 1]
+
+    # ingesting the year replaces its partitions in every format, the other years are kept
+    ingest_by_year_file(write_archive(tmp_path, archive_rows), stations, out_path)
+    assert sorted(os.listdir(os.path.join(out_path, "KAAA"))) == \
+        sorted([f"2023{storage_extensions[other_format]}", f"2024{storage_extensions[storage_format]}"])
+    df = read_station_partitions("KAAA", out_path)
+    assert df["DATE"].dt.year.tolist() == [2023, 2024, 2024]
+    assert df["TMAX"].tolist() == [0, 10, 12]
@@ -0,0 +1,24 @@
+# read_obs_history against the pd.read_html reference implementation, on the synthetic page of the benchmark and on
+# a variant with the markup the row scanner has to handle
+
+from benchmarks.obs_history import check_same_values, make_synthetic_page
+
+
+def test_synthetic_page(tmp_path):
+    page = str(tmp_path / "SYNTHETIC.html")
+    make_synthetic_page(page)
+    check_same_values(page)
+
+
+def test_cell_attributes_case_and_entities(tmp_path):
+    page = str(tmp_path / "VARIANT.html")
+    make_synthetic_page(page, n_days=2)
+    with open(page, encoding="utf-8") as f:
+        html = f.read()
+    head, rest = html.split("<tbody>")
+    body, tail = rest.split("</tbody>")
+    body = body.replace("<td></td>", "<td>&nbsp;</td>").replace("<td>", '<td align="center" >', 20)
+    body = body.replace("<td>", "<TD>", 30).replace("<tr ", '<TR class="odd" ', 5)
+    with open(page, "w", encoding="utf-8") as f:
+        f.write(head + "<tbody>" + body + "</tbody>" + tail)
+    check_same_values(page)
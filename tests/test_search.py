@@ -0,0 +1,35 @@
+# ResultsStore: stored search results are reused only with the same context (training data and folds)
+
+from models.evaluation.search import ResultsStore
+
+
+def record(mse: float) -> dict:
+    return {"model_name": "ridge", "hyperparameters": {"alpha": 1.0}, "fold": 0, "mse": mse, "seconds": 0.1}
+
+
+def test_results_reused_with_same_context(tmp_path):
+    path = str(tmp_path / "search_results.jsonl")
+    context = {"data": "digest-1", "folds": {"eval_length": 5}}
+    ResultsStore(path, context=context).append(record(2.0))
+
+    store = ResultsStore(path, context=context)
+    assert store.get("ridge", {"alpha": 1.0}, 0)["mse"] == 2.0
+
+
+def test_results_discarded_when_data_changes(tmp_path):
+    path = str(tmp_path / "search_results.jsonl")
+    ResultsStore(path, context={"data": "digest-1"}).append(record(2.0))
+
+    store = ResultsStore(path, context={"data": "digest-2"})
+    assert store.get("ridge", {"alpha": 1.0}, 0) is None
+    # the new results are stored under the new context
+    store.append(record(3.0))
+    assert ResultsStore(path, context={"data": "digest-2"}).get("ridge", {"alpha": 1.0}, 0)["mse"] == 3.0
+    assert ResultsStore(path, context={"data": "digest-1"}).get("ridge", {"alpha": 1.0}, 0) is None
+
+
+def test_store_without_context_line_is_discarded(tmp_path):
+    # files written before the context line only hold records
+    path = tmp_path / "search_results.jsonl"
+    path.write_text('{"model_name": "ridge", "hyperparameters": {"alpha": 1.0}, "fold": 0, "mse": 2.0, "seconds": 0.1}\n')
+    assert ResultsStore(str(path), context={"data": "digest-1"}).get("ridge", {"alpha": 1.0}, 0) is None